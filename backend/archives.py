@@ -0,0 +1,159 @@
+"""
+Log files packed in archives or compressed, for the batch upload.
+
+An upload is a log file (see ingest.SUPPORTED_FORMATS), the same compressed (.gz, or
+.zst / .zstd with the optional zstandard package), or a tar / zip archive of those
+(.tar, .tar.gz / .tgz, .tar.zst, .zip). expand() lists the log pieces of an upload
+so they can be counted in parallel, and count_piece() reads one of them, members and
+compressed pieces straight from the archive, into per-window counts.
+
+Zip and plain tar members are read in place; a compressed tar has to be decompressed
+in order anyway, so expand() unpacks its log members into a work directory first.
+"""
+import gzip
+import io
+import logging
+import os
+import shutil
+import tarfile
+import zipfile
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, List, Optional
+
+from ingest import SUPPORTED_FORMATS, count_request_rate
+
+try:
+    import zstandard
+except ImportError:  # optional, only .zst uploads need it
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIONS = (".gz", ".zst", ".zstd")
+TAR_FORMATS = (".tar", ".tar.gz", ".tgz", ".tar.zst", ".tar.zstd")
+ARCHIVE_FORMATS = TAR_FORMATS + (".zip",)
+
+
+def _strip_compression(name: str) -> str:
+    for suffix in COMPRESSIONS:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def is_log(name: str) -> bool:
+    """A log file, maybe compressed, by its name."""
+    return _strip_compression(name.lower()).endswith(SUPPORTED_FORMATS)
+
+
+def is_supported(name: str) -> bool:
+    name = name.lower()
+    return name.endswith(ARCHIVE_FORMATS) or is_log(name)
+
+
+def _is_member_log(name: str) -> bool:
+    # Skips directories, READMEs and the resource forks macOS puts into zips
+    base = os.path.basename(name)
+    return bool(base) and not base.startswith(".") and not name.startswith("__MACOSX/") and is_log(base)
+
+
+class LogPiece:
+    """One log file of an upload: a file on disk, or a member of the zip / tar at `path`."""
+
+    def __init__(self, path: str, name: str, member: Optional[str] = None, container: Optional[str] = None):
+        self.path = path
+        self.name = name
+        self.member = member
+        self.container = container
+
+    def __repr__(self) -> str:
+        return f"LogPiece({self.name})"
+
+
+def _zstd_reader(raw: BinaryIO) -> BinaryIO:
+    if zstandard is None:
+        raise ValueError("Zstandard compressed uploads need the optional zstandard package")
+    return zstandard.ZstdDecompressor().stream_reader(raw)
+
+
+def expand(path: str, filename: str, workdir: str) -> List[LogPiece]:
+    """The log pieces of an upload spooled to `path`, in member order."""
+    name = filename.lower()
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            members = [m.filename for m in archive.infolist() if not m.is_dir() and _is_member_log(m.filename)]
+        pieces = [LogPiece(path, member, member, "zip") for member in members]
+    elif name.endswith(".tar"):
+        with tarfile.open(path) as archive:
+            members = [m.name for m in archive.getmembers() if m.isfile() and _is_member_log(m.name)]
+        pieces = [LogPiece(path, member, member, "tar") for member in members]
+    elif name.endswith(TAR_FORMATS):
+        pieces = _unpack_tar(path, workdir)
+    elif is_log(name):
+        pieces = [LogPiece(path, filename)]
+    else:
+        raise ValueError(f"Unsupported file format: {filename}")
+
+    if not pieces:
+        raise ValueError(f"No log files in {filename}")
+    return pieces
+
+
+def _unpack_tar(path: str, workdir: str) -> List[LogPiece]:
+    """Unpack the log members of a compressed tar, streamed through once."""
+    os.makedirs(workdir, exist_ok=True)
+    with open(path, "rb") as raw:
+        head = raw.read(4)
+        raw.seek(0)
+        if head[:2] == b"\x1f\x8b":
+            stream = gzip.GzipFile(fileobj=raw)
+        elif head == b"\x28\xb5\x2f\xfd":
+            stream = _zstd_reader(raw)
+        else:
+            stream = raw
+
+        pieces = []
+        with tarfile.open(fileobj=stream, mode="r|") as archive:
+            for member in archive:
+                if not member.isfile() or not _is_member_log(member.name):
+                    continue
+                # Numbered, so members with the same base name in different directories don't collide
+                target = os.path.join(workdir, f"{len(pieces):05d}-{os.path.basename(member.name)}")
+                with archive.extractfile(member) as src, open(target, "wb") as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+                pieces.append(LogPiece(target, member.name))
+    return pieces
+
+
+@contextmanager
+def open_piece(piece: LogPiece) -> Iterator[BinaryIO]:
+    """The decompressed bytes of a piece as a file object."""
+    with open(piece.path, "rb") as raw:
+        if piece.container == "zip":
+            archive = zipfile.ZipFile(raw)
+            src = archive.open(piece.member)
+        elif piece.container == "tar":
+            archive = tarfile.open(fileobj=raw)
+            src = archive.extractfile(piece.member)
+        else:
+            archive, src = None, raw
+
+        name = piece.name.lower()
+        try:
+            if name.endswith(".gz"):
+                src = gzip.GzipFile(fileobj=src)
+            elif name.endswith((".zst", ".zstd")):
+                src = _zstd_reader(src)
+            if _strip_compression(name).endswith(".parquet") and (piece.container or name != _strip_compression(name)):
+                # Parquet is read by seeking around; decompressed / archived bytes can't seek cheaply
+                src = io.BytesIO(src.read())
+            yield src
+        finally:
+            if archive is not None:
+                archive.close()
+
+
+def count_piece(piece: LogPiece, window: str, partition: Optional[str] = None):
+    """Per-window request counts of one piece (an ingest accumulator, mergeable with the others)."""
+    with open_piece(piece) as f:
+        return count_request_rate(f, _strip_compression(piece.name), window, partition=partition)
@@ -0,0 +1,7 @@
+"""
+Benchmarks for the backend: a seeded synthetic access-log generator (loggen) and a
+stage-by-stage timing suite (suite). Run from the backend directory:
+
+    python -m benchmarks --requests 1e6 --output bench.json
+    python -m benchmarks --requests 1e6 --compare bench.json
+"""
@@ -0,0 +1,61 @@
+import argparse
+import json
+import logging
+import sys
+
+from benchmarks.loggen import FORMATS
+from benchmarks.suite import REGRESSION_THRESHOLD, STAGES, compare, format_report, run
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Time each backend stage on a synthetic log")
+    parser.add_argument("--requests", type=float, default=1e6, help="log lines to generate (10^4 to 10^8)")
+    parser.add_argument("--days", type=float, default=1.0, help="time span of the log")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--points", type=int, default=500, help="history points requested")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma separated subset of " + ",".join(STAGES))
+    parser.add_argument("--models-dir", default="models")
+    parser.add_argument("--workdir", help="where the generated log is written (default: temp dir)")
+    parser.add_argument("--output", "-o", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", metavar="BASELINE", help="flag regressions against a stored report")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="relative slowdown counted as a regression")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    # predictor configures INFO logging on import; keep the benchmark output readable
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    report = run(int(args.requests), args.days, args.seed, args.format, args.repeat, args.points,
+                 args.models_dir, args.workdir, stages)
+
+    comparison = None
+    if args.compare:
+        with open(args.compare) as f:
+            comparison = compare(report, json.load(f), args.threshold)
+        report["comparison"] = comparison
+
+    print(format_report(report, comparison), file=sys.stderr)
+
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+    if comparison and comparison["regressions"]:
+        print(f"Regressions: {', '.join(comparison['regressions'])}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""
+Stage-by-stage benchmark of the upload and history paths.
+
+Every stage is timed on its own, `repeat` times, on a seeded synthetic log:
+
+    parse                  read and convert the timestamp column (ingest.iter_timestamp_chunks + parse_timestamps)
+    build_request_rate     RPSEstimator._build_request_rate on the parsed log
+    stream_request_rate    parse + count in one streaming pass, as upload jobs do
+    build_feature          RPSEstimator._build_feature on the per-minute frame
+    predict                RPSEstimator._predict_models on the feature matrix
+    write                  InfluxDBWrapper.write_inference_results into the local stand-in
+    history                InfluxDBWrapper.get_history, query + parse + downsample + serialization
+
+Results are JSON; compare() flags stages that got slower than a stored baseline.
+"""
+import json
+import logging
+import os
+import platform
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.loggen import write_log
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("parse", "build_request_rate", "stream_request_rate", "build_feature", "predict", "write", "history")
+# Above this many log lines the parsed log isn't kept in memory, and build_request_rate is skipped
+IN_MEMORY_MAX_ROWS = int(os.getenv("BENCH_IN_MEMORY_MAX_ROWS", str(20_000_000)))
+# A stage regresses when it is this much slower than the baseline ...
+REGRESSION_THRESHOLD = 0.10
+# ... and by at least this many seconds, so sub-millisecond noise doesn't count
+REGRESSION_MIN_SECONDS = 0.002
+
+
+def _time(fn: Callable, repeat: int, setup: Callable = None) -> dict:
+    runs = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - started)
+    return {"result": result, "runs": runs}
+
+
+def _stage(runs: list, rows: int) -> dict:
+    median = statistics.median(runs)
+    return {
+        "seconds": round(median, 6),
+        "min": round(min(runs), 6),
+        "max": round(max(runs), 6),
+        "repeat": len(runs),
+        "rows": rows,
+        "rows_per_sec": round(rows / median, 1) if median > 0 else None,
+    }
+
+
+def _environment() -> dict:
+    import lightgbm
+
+    from models.predictor import PREDICT_ENGINE
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "lightgbm": lightgbm.__version__,
+        "predict_engine": PREDICT_ENGINE,
+    }
+
+
+def run(requests: int = 1_000_000, days: float = 1.0, seed: int = 0, fmt: str = "csv", repeat: int = 3,
+        history_points: int = 500, models_dir: str = "models", workdir: Optional[str] = None,
+        stages=STAGES) -> dict:
+    """Generate a log, run the selected stages and return the report."""
+    from database import InfluxDBWrapper
+    from influx_stub import InfluxStubServer
+    from ingest import iter_timestamp_chunks, parse_timestamps, stream_request_rate
+    from models.predictor import RPSEstimator
+
+    estimator = RPSEstimator(models_dir)
+    if estimator.base_model is None:
+        raise RuntimeError(f"No models found in {models_dir}")
+
+    report = {
+        "config": {"requests": requests, "days": days, "seed": seed, "format": fmt, "repeat": repeat,
+                   "history_points": history_points},
+        "environment": _environment(),
+        "started_at": pd.Timestamp.now(tz="UTC").isoformat(),
+        "stages": {},
+        "skipped": {},
+    }
+    results: Dict[str, dict] = report["stages"]
+
+    if workdir:
+        os.makedirs(workdir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        path = os.path.join(tmp, f"bench.{fmt}")
+        report["log"] = write_log(path, requests, days, seed, fmt)
+        filename = os.path.basename(path)
+
+        # parse: only the reading, the parsed chunks are kept for build_request_rate
+        keep = requests <= IN_MEMORY_MAX_ROWS
+
+        def parse():
+            chunks = []
+            with open(path, "rb") as f:
+                for timestamps in iter_timestamp_chunks(f, filename):
+                    values, _ = parse_timestamps(timestamps)
+                    if keep:
+                        chunks.append(values)
+            return pd.Series(pd.to_datetime(np.concatenate(chunks), unit="ns")) if chunks else None
+
+        parsed = None
+        if "parse" in stages or "build_request_rate" in stages:
+            timed = _time(parse, repeat)
+            parsed = timed["result"]
+            if "parse" in stages:
+                results["parse"] = _stage(timed["runs"], requests)
+
+        if "build_request_rate" in stages:
+            if parsed is None:
+                report["skipped"]["build_request_rate"] = f"more than {IN_MEMORY_MAX_ROWS} rows"
+            else:
+                log_df = pd.DataFrame({"timestamp": parsed})
+                timed = _time(lambda: estimator._build_request_rate(log_df), repeat)
+                results["build_request_rate"] = _stage(timed["runs"], requests)
+            del parsed
+
+        def stream():
+            with open(path, "rb") as f:
+                return stream_request_rate(f, filename, estimator.WINDOW)
+
+        timed = _time(stream, repeat if "stream_request_rate" in stages else 1)
+        rate_df = timed["result"]
+        if "stream_request_rate" in stages:
+            results["stream_request_rate"] = _stage(timed["runs"], requests)
+
+    timed = _time(lambda: estimator._build_feature(rate_df), repeat if "build_feature" in stages else 1)
+    if "build_feature" in stages:
+        results["build_feature"] = _stage(timed["runs"], len(rate_df))
+    X = timed["result"][estimator.feature_names]
+
+    if "predict" in stages:
+        timed = _time(lambda: estimator._predict_models(X), repeat)
+        results["predict"] = _stage(timed["runs"], len(X))
+
+    if "write" in stages or "history" in stages:
+        result_df = estimator.predict_rate(rate_df)
+        server = InfluxStubServer().start()
+        try:
+            # Without the write buffer, so `write` measures the InfluxDB write itself
+            db = InfluxDBWrapper(url=server.url, token="bench", org="bench", bucket="bench", wal_dir="")
+            if "write" in stages:
+                timed = _time(lambda: db.write_inference_results(result_df, filename), repeat)
+                results["write"] = _stage(timed["runs"], len(result_df))
+                results["write"]["bytes"] = server.bytes // repeat
+
+            if "history" in stages:
+                server.set_query_result(result_df, tags={"filename": filename})
+                # Serialized the way FastAPI returns it, so JSON encoding is part of the stage
+                timed = _time(lambda: json.dumps(db.get_history(f"-{max(1, int(days * 24))}h", history_points)),
+                              repeat, setup=db.history_cache.clear)
+                results["history"] = _stage(timed["runs"], len(result_df))
+                results["history"]["response_bytes"] = len(timed["result"])
+            db.client.close()
+        finally:
+            server.stop()
+
+    report["total_seconds"] = round(sum(s["seconds"] for s in results.values()), 6)
+    return report
+
+
+def _workload(config: dict) -> dict:
+    """The config keys that change what is measured (repeat only changes how often)."""
+    return {k: v for k, v in (config or {}).items() if k != "repeat"}
+
+
+def compare(report: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD,
+            min_seconds: float = REGRESSION_MIN_SECONDS) -> dict:
+    """
+    Compare the median time of every stage with the baseline report.
+    A stage is a regression when it is more than `threshold` (relative) and
+    `min_seconds` (absolute) slower.
+    """
+    if _workload(report.get("config")) != _workload(baseline.get("config")):
+        logger.warning("Benchmark configuration differs from the baseline, ratios may not be meaningful")
+
+    stages = {}
+    for name, current in report["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None:
+            continue
+        delta = current["seconds"] - base["seconds"]
+        ratio = current["seconds"] / base["seconds"] if base["seconds"] > 0 else None
+        if ratio is not None and ratio > 1 + threshold and delta > min_seconds:
+            status = "regression"
+        elif ratio is not None and ratio < 1 - threshold and -delta > min_seconds:
+            status = "improvement"
+        else:
+            status = "unchanged"
+        stages[name] = {"baseline": base["seconds"], "current": current["seconds"],
+                        "ratio": round(ratio, 3) if ratio is not None else None, "status": status}
+
+    return {
+        "threshold": threshold,
+        "stages": stages,
+        "regressions": [name for name, s in stages.items() if s["status"] == "regression"],
+    }
+
+
+def format_report(report: dict, comparison: dict = None) -> str:
+    lines = [f"{'stage':<22}{'median s':>12}{'min s':>12}{'rows/s':>16}" + ("   vs baseline" if comparison else "")]
+    for name, stage in report["stages"].items():
+        line = f"{name:<22}{stage['seconds']:>12.4f}{stage['min']:>12.4f}{stage['rows_per_sec'] or 0:>16,.0f}"
+        if comparison and name in comparison["stages"]:
+            c = comparison["stages"][name]
+            line += f"   {c['ratio']:.2f}x {c['status']}"
+        lines.append(line)
+    for name, reason in report.get("skipped", {}).items():
+        lines.append(f"{name:<22}  skipped ({reason})")
+    return "\n".join(lines)
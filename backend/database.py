@@ -1,21 +1,269 @@
+import asyncio
+import codecs
+import csv
 import os
+import random
+import re
+import threading
+import time
+import numpy as np
 import pandas as pd
 import logging
-from datetime import datetime, timedelta
-from influxdb_client import InfluxDBClient, Point, WriteOptions
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+import aiohttp
+from influxdb_client import BucketRetentionRules, Dialect, InfluxDBClient, Query
+from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
 from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client.service.query_service import QueryService
+
+import metrics
+from cache import TTLCache
+from downsample import lttb
+from rollup import Resolution, Rollups, duration_seconds
+from wal import WAL_DIR, WriteAheadBuffer
 
 logger = logging.getLogger(__name__)
 
+MEASUREMENT = "inference_metrics"
+FIELDS = ("actual", "model1", "model2")
+# Multi-horizon forecast fields are written as pred_<horizon> (pred_1min, pred_5min, ...)
+HORIZON_FIELD_PREFIX = "pred_"
+
+
+def result_fields(columns) -> list:
+    """Columns of a result frame that are stored as fields."""
+    return [c for c in columns if c in FIELDS or str(c).startswith(HORIZON_FIELD_PREFIX)]
+
+# Tag holding the series of a partitioned upload (one per service / host / route)
+SERIES_TAG = "series"
+
+
+def _flux_string(value: str) -> str:
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _flux_time(timestamp: pd.Timestamp) -> str:
+    return timestamp.tz_convert("UTC").strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+# Resolution of the stored points, aggregateWindow never goes below it
+BASE_WINDOW_SECONDS = 60
+# Points returned by get_history when the caller doesn't ask for a count
+DEFAULT_HISTORY_POINTS = int(os.getenv("HISTORY_POINTS", "500"))
+# aggregateWindow keeps this many times more points than requested, LTTB picks the final ones
+HISTORY_OVERSAMPLE = 4
+# Rows per frame when history is read from the CSV response and streamed
+HISTORY_STREAM_ROWS = int(os.getenv("HISTORY_STREAM_ROWS", "10000"))
+# Plain CSV, the annotations aren't needed to read the pivoted rows
+CSV_DIALECT = Dialect(header=True, annotations=[], date_time_format="RFC3339")
+
+# Retention set on the bucket of the per-minute points, e.g. 7d, once rollups cover the longer
+# ranges; empty leaves the bucket as it is
+INFLUXDB_RETENTION = os.getenv("INFLUXDB_RETENTION", "")
+
+# Milliseconds an InfluxDB request may wait for the connection or for the next bytes of the response
+INFLUXDB_TIMEOUT_MS = int(os.getenv("INFLUXDB_TIMEOUT_MS", "10000"))
+# Connections pooled by the async client
+INFLUXDB_POOL_SIZE = int(os.getenv("INFLUXDB_POOL_SIZE", "20"))
+# Queries the request handlers run at once, further ones wait for a slot
+INFLUXDB_MAX_QUERIES = int(os.getenv("INFLUXDB_MAX_QUERIES", "8"))
+# Bytes read from a query response at a time by the async client
+CSV_BLOCK_BYTES = 1 << 16
+
+# Backoff between attempts to drain the write buffer while InfluxDB fails
+WAL_RETRY_MIN_SECONDS = float(os.getenv("WAL_RETRY_MIN_SECONDS", "1"))
+WAL_RETRY_MAX_SECONDS = float(os.getenv("WAL_RETRY_MAX_SECONDS", "60"))
+# Drainer wake-up interval when nothing new was buffered (also prunes old segments)
+WAL_IDLE_SECONDS = float(os.getenv("WAL_IDLE_SECONDS", "5"))
+
+WAL_DRAIN_FAILURES = metrics.REGISTRY.counter(
+    "rps_wal_drain_failures_total", "Failed attempts to drain the write buffer to InfluxDB")
+ROLLUP_FAILURES = metrics.REGISTRY.counter(
+    "rps_rollup_failures_total", "Rollup writes that failed; the points themselves were written")
+HISTORY_FALLBACKS = metrics.REGISTRY.counter(
+    "rps_history_local_fallbacks_total", "History requests answered from the local write buffer")
+QUERY_WAIT_SECONDS = metrics.REGISTRY.histogram(
+    "rps_influx_query_wait_seconds", "Time queries waited for one of the INFLUXDB_MAX_QUERIES slots")
+
+
+def _history_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """'time', actual, model1, model2 (always there), the other fields, then 'series'."""
+    for field in FIELDS:
+        if field not in df.columns:
+            df[field] = np.nan
+    fields = [c for c in result_fields(df.columns) if c not in FIELDS]
+    tags = [SERIES_TAG] if SERIES_TAG in df.columns else []
+    return df[["time", *FIELDS, *fields, *tags]]
+
+
+def _empty_history() -> pd.DataFrame:
+    return _history_columns(pd.DataFrame({"time": pd.Series(dtype="datetime64[ns, UTC]")}))
+
+
+def _history_chunk(header: list, rows: list) -> pd.DataFrame:
+    """Rows of a pivoted query as read from its CSV response, as a history frame."""
+    columns = dict(zip(header, zip(*rows)))
+    df = pd.DataFrame({"time": pd.to_datetime(columns["_time"], utc=True, format="ISO8601")})
+    for field in result_fields(header):
+        # Blank where a row has no such field (a table without it, or an empty value)
+        df[field] = pd.to_numeric(pd.Series(columns[field]).replace("", np.nan), errors="coerce").astype(np.float64)
+    if SERIES_TAG in columns:
+        df[SERIES_TAG] = [value or None for value in columns[SERIES_TAG]]
+    return _history_columns(df)
+
+
+class HistoryFrameReader:
+    """
+    Collects the rows of a pivoted query's CSV response, fed one at a time as the
+    response is read, into history frames of at most `chunk_rows` rows.
+    """
+
+    def __init__(self, chunk_rows: int = HISTORY_STREAM_ROWS):
+        self.chunk_rows = chunk_rows
+        self.header = None
+        self.time_index = None
+        self.rows = []
+
+    def feed(self, row: list) -> Optional[pd.DataFrame]:
+        """Add a row; returns a frame whenever one is complete."""
+        if len(row) < 2 or row[0].startswith("#"):
+            # Blank lines between tables and annotations
+            return None
+        if self.header is None or row[self.time_index] == "_time":
+            # Every table of the response starts with its own header
+            frame = self.flush()
+            self.header, self.time_index = row, row.index("_time")
+            return frame
+        self.rows.append(row)
+        return self.flush() if len(self.rows) >= self.chunk_rows else None
+
+    def flush(self) -> Optional[pd.DataFrame]:
+        if not self.rows:
+            return None
+        frame = _history_chunk(self.header, self.rows)
+        self.rows = []
+        return frame
+
+
+def aggregate_every(range_seconds: int, points: int, base: int = BASE_WINDOW_SECONDS) -> Optional[int]:
+    """
+    aggregateWindow period that leaves a few times `points` rows, None if the stored
+    points (one per `base` seconds) are few enough.
+    """
+    every = range_seconds // (points * HISTORY_OVERSAMPLE)
+    if base > BASE_WINDOW_SECONDS:
+        # Whole rollup windows, so every aggregate covers as many of them
+        every -= every % base
+    return every if every > base else None
+
+
+def history_records(df: pd.DataFrame) -> list:
+    """History frame as the /api/history records: ISO 'time' string, None for missing values."""
+    fields = [c for c in df.columns if c not in ("time", SERIES_TAG)]
+    values = df[fields].astype(object).where(df[fields].notna(), None).to_dict(orient="records")
+    times = [t.isoformat() for t in df["time"]]
+    series_values = df[SERIES_TAG].tolist() if SERIES_TAG in df.columns else None
+
+    results = []
+    for i, record in enumerate(values):
+        point = {"time": times[i], **record}
+        if series_values is not None and isinstance(series_values[i], str):
+            point[SERIES_TAG] = series_values[i]
+        results.append(point)
+    return results
+
+
+_DURATION_RE = re.compile(r"^-?(\d+)(s|m|h|d|w)$")
+_DURATION_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_range(range_str: str):
+    """
+    Turn a dashboard range ("1H", "-6h", "24h", "7d") into a Flux start duration
+    and its length in seconds.
+    """
+    match = _DURATION_RE.match(range_str.strip().lower())
+    if not match:
+        raise ValueError(f"Invalid range '{range_str}', expected e.g. -1h, 6H, 24h, 7d")
+    amount, unit = int(match.group(1)), match.group(2)
+    return f"-{amount}{unit}", amount * _DURATION_SECONDS[unit]
+
+
+def _escape_tag(value: str) -> str:
+    # Line protocol tag keys/values must escape commas, equals signs and spaces
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def encode_line_protocol(df: pd.DataFrame, measurement: str, tags: dict, fields=FIELDS) -> np.ndarray:
+    """
+    Encode a result frame as InfluxDB line protocol, one line per row, straight from
+    the column arrays. NaN / infinite fields are left out and rows without any field
+    are dropped. Rows without a timestamp are written at the current time.
+    """
+    n = len(df)
+
+    if 'timestamp' in df.columns:
+        times = pd.to_datetime(df['timestamp'], utc=True).to_numpy(dtype="datetime64[ns]").view("int64")
+        missing = times == np.iinfo(np.int64).min  # NaT
+        if missing.any():
+            times = times.copy()
+            times[missing] = time.time_ns()
+    else:
+        times = np.full(n, time.time_ns(), dtype=np.int64)
+
+    body = np.full(n, "", dtype=str)
+    for name in fields:
+        if name not in df.columns:
+            continue
+        values = df[name].to_numpy(dtype=np.float64, na_value=np.nan)
+        valid = np.isfinite(values)
+        encoded = np.where(valid, np.char.add(f"{name}=", values.astype(str)), "")
+        separator = np.where((body != "") & valid, ",", "")
+        body = np.char.add(np.char.add(body, separator), encoded)
+
+    keep = body != ""
+    tag_set = "".join(f",{_escape_tag(k)}={_escape_tag(v)}" for k, v in sorted(tags.items()))
+    prefix = f"{measurement}{tag_set} "
+
+    lines = np.char.add(np.char.add(np.char.add(prefix, body[keep]), " "), times[keep].astype(str))
+    return lines
+
+
 class InfluxDBWrapper:
-    def __init__(self):
-        self.url = os.getenv("INFLUXDB_URL", "http://influxdb:8086")
-        self.token = os.getenv("INFLUXDB_TOKEN", "my-super-secret-auth-token")
-        self.org = os.getenv("INFLUXDB_ORG", "my-org")
-        self.bucket = os.getenv("INFLUXDB_BUCKET", "my-bucket")
-        
+    def __init__(self, url: Optional[str] = None, token: Optional[str] = None,
+                 org: Optional[str] = None, bucket: Optional[str] = None,
+                 batch_size: Optional[int] = None, gzip: Optional[bool] = None,
+                 wal_dir: Optional[str] = None):
+        self.url = url or os.getenv("INFLUXDB_URL", "http://influxdb:8086")
+        self.token = token or os.getenv("INFLUXDB_TOKEN", "my-super-secret-auth-token")
+        self.org = org or os.getenv("INFLUXDB_ORG", "my-org")
+        self.bucket = bucket or os.getenv("INFLUXDB_BUCKET", "my-bucket")
+        # Points per write request and request compression
+        self.batch_size = batch_size or int(os.getenv("INFLUXDB_BATCH_SIZE", "5000"))
+        if gzip is None:
+            gzip = os.getenv("INFLUXDB_GZIP", "false").lower() in ("1", "true", "yes")
+        self.gzip = gzip
+        # History results keyed by (range, points), dropped whenever new points are written
+        self.history_cache = TTLCache(
+            maxsize=int(os.getenv("HISTORY_CACHE_SIZE", "64")),
+            ttl=float(os.getenv("HISTORY_CACHE_TTL", "30")),
+        )
+        # Results are buffered locally and drained to InfluxDB in the background ("" disables)
+        wal_dir = WAL_DIR if wal_dir is None else wal_dir
+        self.wal = WriteAheadBuffer(wal_dir) if wal_dir else None
+        # 5m / 1h / 1d aggregates written next to the points, read by long history ranges
+        self.rollups = Rollups(load=self._stored_points)
+        self._buckets_ready = False
+        self._drainer = None
+        self._stopping = threading.Event()
+
+        self.client = None
+        self._connect()
+
+    def _connect(self):
         try:
-            self.client = InfluxDBClient(url=self.url, token=self.token, org=self.org)
+            self.client = InfluxDBClient(url=self.url, token=self.token, org=self.org, enable_gzip=self.gzip,
+                                         timeout=INFLUXDB_TIMEOUT_MS)
             self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
             self.query_api = self.client.query_api()
             logger.info(f"Connected to InfluxDB at {self.url}")
@@ -23,94 +271,748 @@ class InfluxDBWrapper:
             logger.error(f"Failed to connect to InfluxDB: {e}")
             self.client = None
 
-    def write_inference_results(self, df: pd.DataFrame, filename: str):
+    def start(self):
+        """Start draining the write buffer in a background thread."""
+        if self.wal is not None and self._drainer is None:
+            self._stopping.clear()
+            self._drainer = threading.Thread(target=self._drain_loop, daemon=True, name="wal-drainer")
+            self._drainer.start()
+
+    def close(self):
+        self._stopping.set()
+        if self._drainer is not None:
+            self.wal.appended.set()
+            self._drainer.join(timeout=5)
+            self._drainer = None
+        if self.client is not None:
+            self.client.close()
+
+    def _tags(self, df: pd.DataFrame, filename: str, partition: Optional[str]) -> dict:
+        tags = {"filename": filename}
+        if SERIES_TAG in df.columns:
+            tags["partition"] = partition or SERIES_TAG
+        return tags
+
+    def _encode(self, df: pd.DataFrame, tags: dict, measurement: str = MEASUREMENT,
+                fields: Optional[list] = None) -> np.ndarray:
+        fields = result_fields(df.columns) if fields is None else fields
+        if SERIES_TAG not in df.columns:
+            return encode_line_protocol(df, measurement, tags, fields)
+        encoded = [encode_line_protocol(group, measurement, {**tags, SERIES_TAG: series}, fields)
+                   for series, group in df.groupby(SERIES_TAG, sort=False)]
+        return np.concatenate(encoded) if encoded else np.array([], dtype=str)
+
+    def rollup_bucket(self, resolution: Resolution) -> str:
+        return f"{self.bucket}_{resolution.name}"
+
+    def _encode_rollups(self, df: pd.DataFrame, tags: dict) -> dict:
+        """
+        Line protocol of the rollup windows the rows of `df` fall in, per rollup bucket.
+        Rollups never hold up the points: a failure is logged and counted, and leaves nothing to write.
+        """
+        started = time.perf_counter()
+        encoded = {}
+        try:
+            for resolution, frame in self.rollups.build(df, tags, result_fields(df.columns), SERIES_TAG):
+                fields = [c for c in frame.columns if c not in ("timestamp", SERIES_TAG)]
+                encoded[self.rollup_bucket(resolution)] = self._encode(frame, tags, resolution.measurement, fields)
+        except Exception as e:
+            ROLLUP_FAILURES.inc()
+            logger.warning(f"Could not compute rollups for {tags}: {e}")
+            return {}
+        if encoded:
+            metrics.observe_stage("rollup", time.perf_counter() - started, len(df))
+        return encoded
+
+    def _stored_points(self, tags: dict, start: pd.Timestamp, stop: pd.Timestamp) -> pd.DataFrame:
+        """The points of one tag set from `start` to `stop`, for Rollups to recompute whole windows."""
+        if self.client is None:
+            raise ConnectionError(f"InfluxDB at {self.url} is not reachable")
+        tag_filter = " and ".join(f'r["{key}"] == {_flux_string(value)}' for key, value in tags.items())
+        if "partition" not in tags:
+            tag_filter += ' and not exists r["partition"]'
+        query = f'''
+        from(bucket: "{self.bucket}")
+          |> range(start: {_flux_time(start)}, stop: {_flux_time(stop)})
+          |> filter(fn: (r) => r["_measurement"] == "{MEASUREMENT}" and {tag_filter})
+          |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
+        '''
+        frames = list(self._iter_csv_frames(query, HISTORY_STREAM_ROWS))
+        if not frames:
+            return pd.DataFrame({"timestamp": pd.Series(dtype="datetime64[ns, UTC]")})
+        return pd.concat(frames, ignore_index=True).rename(columns={"time": "timestamp"})
+
+    def _ensure_buckets(self):
+        """Create the rollup buckets with their retention (and set INFLUXDB_RETENTION), once."""
+        if self._buckets_ready:
+            return
+        buckets_api = self.client.buckets_api()
+        for resolution in self.rollups.resolutions:
+            name = self.rollup_bucket(resolution)
+            if buckets_api.find_bucket_by_name(name) is None:
+                rules = [BucketRetentionRules(type="expire", every_seconds=resolution.retention)] if resolution.retention else []
+                buckets_api.create_bucket(bucket_name=name, retention_rules=rules, org=self.org)
+                logger.info(f"Created rollup bucket {name}")
+        if INFLUXDB_RETENTION:
+            bucket = buckets_api.find_bucket_by_name(self.bucket)
+            if bucket is not None:
+                bucket.retention_rules = [BucketRetentionRules(type="expire",
+                                                               every_seconds=duration_seconds(INFLUXDB_RETENTION))]
+                buckets_api.update_bucket(bucket)
+        self._buckets_ready = True
+
+    def _write_rollups(self, encoded: dict) -> int:
+        """
+        Write rollup lines from _encode_rollups (or several of them merged); returns the points
+        written. Called once the points are stored, and like _encode_rollups never raises.
+        """
+        if not encoded:
+            return 0
+        try:
+            self._ensure_buckets()
+            for bucket, lines in encoded.items():
+                self._write_lines(lines, bucket)
+        except Exception as e:
+            ROLLUP_FAILURES.inc()
+            logger.warning(f"Could not write rollups: {e}")
+            return 0
+        return sum(len(lines) for lines in encoded.values())
+
+    def _write_lines(self, lines: np.ndarray, bucket: Optional[str] = None) -> int:
+        batches = 0
+        for offset in range(0, len(lines), self.batch_size):
+            batch = "\n".join(lines[offset:offset + self.batch_size].tolist())
+            try:
+                self.write_api.write(bucket=bucket or self.bucket, org=self.org, record=batch)
+            except Exception as e:
+                logger.error(f"Error writing data to InfluxDB: {e}")
+                raise e
+            batches += 1
+
+        if batches:
+            self.history_cache.clear()
+        return batches
+
+    def write_inference_results(self, df: pd.DataFrame, filename: str, partition: Optional[str] = None):
         """
         Write inference results to InfluxDB.
         df expected columns: 'timestamp', 'actual', 'model1', 'model2'
+        A partitioned result (with a 'series' column) is tagged per series, with the
+        partition column name in 'partition' and the series in 'series'.
+        With the write buffer on, the rows are appended to it and written to InfluxDB
+        by the drainer; otherwise they are encoded as line protocol in bulk and sent in
+        batches of INFLUXDB_BATCH_SIZE.
+        Returns write statistics (points, batches, seconds, rows_per_sec).
         """
+        started = time.perf_counter()
+        tags = self._tags(df, filename, partition)
+        if self.wal is not None:
+            if df.empty:
+                return {"points": 0, "buffered": True, "seconds": 0.0, "rows_per_sec": None}
+            # Durable locally at disk speed; the drainer forwards it to InfluxDB
+            columns = [c for c in df.columns if c in (SERIES_TAG, "timestamp")] + result_fields(df.columns)
+            self.wal.append(df[columns], tags)
+            elapsed = time.perf_counter() - started
+            metrics.observe_stage("wal_append", elapsed, len(df))
+            return {
+                "points": len(df),
+                "buffered": True,
+                "seconds": round(elapsed, 4),
+                "rows_per_sec": round(len(df) / elapsed, 1) if elapsed > 0 else None,
+            }
+
         if not self.client:
             logger.warning("InfluxDB client not initialized, skipping write")
-            return
+            return None
+
+        lines = self._encode(df, tags)
+        batches = self._write_lines(lines)
+        rollup_points = self._write_rollups(self._encode_rollups(df, tags))
+        return self._write_stats(lines, batches, started, rollup_points)
+
+    def _write_stats(self, lines: np.ndarray, batches: int, started: float, rollup_points: int = 0) -> dict:
+        elapsed = time.perf_counter() - started
+        stats = {
+            "points": len(lines),
+            "rollup_points": rollup_points,
+            "batches": batches,
+            "seconds": round(elapsed, 4),
+            "rows_per_sec": round(len(lines) / elapsed, 1) if elapsed > 0 else None,
+        }
+        metrics.observe_stage("db_write", elapsed, len(lines))
+        if lines.size:
+            logger.info(f"Written {stats['points']} points to InfluxDB in {batches} batches ({stats['rows_per_sec']} rows/s)")
+        return stats
+
+    def _history_query(self, start_range: str, every: Optional[int], series: Optional[str],
+                       merge: bool = False, resolution: Optional[Resolution] = None) -> str:
+        """
+        Flux for history rows; with a `resolution` they are read from its rollup, whose
+        <field>_mean values come back under the field names of the points.
+        """
+        imports = ""
+        if resolution is None:
+            bucket, measurement = self.bucket, MEASUREMENT
+            fields = (f'|> filter(fn: (r) => r["_field"] == "actual" or r["_field"] == "model1" or '
+                      f'r["_field"] == "model2" or r["_field"] =~ /^{HORIZON_FIELD_PREFIX}/)')
+        else:
+            bucket, measurement = self.rollup_bucket(resolution), resolution.measurement
+            imports = 'import "strings"'
+            fields = ('|> filter(fn: (r) => r["_field"] =~ /_mean$/)\n'
+                      '          |> map(fn: (r) => ({r with _field: strings.trimSuffix(v: r._field, suffix: "_mean")}))')
+        aggregate = ""
+        if every is not None:
+            aggregate = f"|> aggregateWindow(every: {every}s, fn: mean, createEmpty: false)"
+        series_filter = ""
+        if series is not None:
+            series_filter = f'|> filter(fn: (r) => r["{SERIES_TAG}"] == {_flux_string(series)})'
+        # One table for all uploads, so a stream comes back in time order
+        merge_tables = "|> group()" if merge else ""
+
+        return f'''
+        {imports}
+        from(bucket: "{bucket}")
+          |> range(start: {start_range})
+          |> filter(fn: (r) => r["_measurement"] == "{measurement}")
+          {fields}
+          {series_filter}
+          {aggregate}
+          |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
+          {merge_tables}
+          |> sort(columns: ["_time"], desc: false)
+        '''
+
+    def _coverage_query(self, start_range: str, resolution: Resolution) -> str:
+        """Flux for the first point of the range and the first window of its rollup, tagged by 'source'."""
+        return f'''
+        earliest = (bucket, measurement, field, source) => from(bucket: bucket)
+          |> range(start: {start_range})
+          |> filter(fn: (r) => r["_measurement"] == measurement and r["_field"] == field)
+          |> first()
+          |> group()
+          |> sort(columns: ["_time"])
+          |> limit(n: 1)
+          |> map(fn: (r) => ({{_time: r._time, _value: source}}))
+
+        union(tables: [
+          earliest(bucket: "{self.bucket}", measurement: "{MEASUREMENT}", field: "actual", source: "points"),
+          earliest(bucket: "{self.rollup_bucket(resolution)}", measurement: "{resolution.measurement}", field: "count", source: "rollup")
+        ])
+        '''
+
+    @staticmethod
+    def _rollup_covers(tables, resolution: Resolution) -> bool:
+        """Whether the rollup starts within a window of the first point of the range (or there are none)."""
+        first = {record.get_value(): record.get_time() for table in tables for record in table.records}
+        if "points" not in first:
+            return True
+        return "rollup" in first and (first["rollup"] - first["points"]).total_seconds() < resolution.seconds
+
+    def _history_resolution(self, start_range: str, range_seconds: int, points: int) -> Optional[Resolution]:
+        """
+        The rollup to read a history range from, if it covers the range: points written
+        before rollups existed, or while their writes failed, are only in the points'
+        bucket, and a missing rollup bucket would fail the query.
+        """
+        resolution = self.rollups.resolution_for(range_seconds, points)
+        if resolution is None:
+            return None
+        cache_key = ("rollup_coverage", start_range, resolution.name)
+        covered = self.history_cache.get(cache_key)
+        if covered is None:
+            try:
+                covered = self._rollup_covers(
+                    self.query_api.query(self._coverage_query(start_range, resolution), org=self.org), resolution)
+            except Exception as e:
+                logger.warning(f"Could not check the {resolution.name} rollup, reading the points: {e}")
+                covered = False
+            self.history_cache.set(cache_key, covered)
+        return resolution if covered else None
+
+    def _aggregated_history_query(self, start_range: str, range_seconds: int, points: int,
+                                  series: Optional[str], resolution: Optional[Resolution] = None) -> str:
+        base = resolution.seconds if resolution is not None else BASE_WINDOW_SECONDS
+        return self._history_query(start_range, aggregate_every(range_seconds, points, base), series,
+                                   resolution=resolution)
+
+    def _iter_csv_frames(self, query: str, chunk_rows: int):
+        """
+        Run a pivoted history query and yield its rows as history frames of at most
+        `chunk_rows` rows, read from the CSV response as it arrives.
+        """
+        reader = HistoryFrameReader(chunk_rows)
+        for row in self.query_api.query_csv(query, org=self.org, dialect=CSV_DIALECT):
+            frame = reader.feed(row)
+            if frame is not None:
+                yield frame
+        frame = reader.flush()
+        if frame is not None:
+            yield frame
 
+    def history_frame(self, range_str: str = "-1h", points: Optional[int] = None,
+                      series: Optional[str] = None) -> pd.DataFrame:
+        """
+        Query history data from InfluxDB as a frame: 'time' (UTC), actual, model1, model2,
+        the pred_* fields and, for partitioned uploads, 'series'.
+        range_str: e.g. "-1h", "-6h", "-24h" (also "1H" / "6H" / "24H" as sent by the dashboard)
+        points: target number of points; the range is aggregated in InfluxDB with
+        aggregateWindow and then reduced with LTTB, which keeps the peaks. Ranges long
+        enough are read from the coarsest rollup that still has `points` windows in them.
+        series: only the points of this series of a partitioned upload.
+        """
+        start_range, range_seconds = parse_range(range_str)
+        points = points or DEFAULT_HISTORY_POINTS
+
+        if not self.client:
+            if self.wal is not None:
+                return self._local_history(range_seconds, points, series)
+            logger.warning("InfluxDB client not initialized, returning empty history")
+            return _empty_history()
+
+        cache_key = (start_range, points, series)
+        cached = self.history_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        started = time.perf_counter()
         try:
-            write_df = df.copy()
-            if 'timestamp' in write_df.columns:
-                write_df['timestamp'] = pd.to_datetime(write_df['timestamp'], utc=True)
-            
-            points = []
-            for _, row in write_df.iterrows():
-                # Use current time if timestamp is missing or null
-                ts = row.get('timestamp')
-                if pd.isna(ts):
-                    ts = datetime.utcnow()
-                
-                point = Point("inference_metrics") \
-                    .tag("filename", filename) \
-                    .time(ts)
-                
-                # Add actual value if present
-                if 'actual' in row and not pd.isna(row['actual']):
-                    point.field("actual", float(row['actual']))
-                
-                # Add model1 prediction
-                if 'model1' in row and not pd.isna(row['model1']):
-                    point.field("model1", float(row['model1']))
-
-                # Add model2 prediction
-                if 'model2' in row and not pd.isna(row['model2']):
-                    point.field("model2", float(row['model2']))
-                
-                points.append(point)
-            
-            if points:
-                self.write_api.write(bucket=self.bucket, org=self.org, record=points)
-                logger.info(f"Written {len(points)} points to InfluxDB")
-            
+            # Pre-aggregate in InfluxDB so only a few times `points` rows come back
+            resolution = self._history_resolution(start_range, range_seconds, points)
+            query = self._aggregated_history_query(start_range, range_seconds, points, series, resolution)
+            df = self._combine_history(list(self._iter_csv_frames(query, HISTORY_STREAM_ROWS)), points)
+
+            self.history_cache.set(cache_key, df)
+            metrics.observe_stage("history_query", time.perf_counter() - started, len(df))
+            return df
         except Exception as e:
-            logger.error(f"Error writing data to InfluxDB: {e}")
-            raise e
+            logger.error(f"Error querying data from InfluxDB: {e}")
+            if self.wal is not None:
+                return self._local_history(range_seconds, points, series)
+            return _empty_history()
 
-    def get_history(self, range_str: str = "-1h"):
+    def get_history(self, range_str: str = "-1h", points: Optional[int] = None, series: Optional[str] = None):
+        """history_frame as records with an ISO 'time' string, the layout the dashboard reads."""
+        return history_records(self.history_frame(range_str, points, series))
+
+    def _local_history(self, range_seconds: int, points: Optional[int], series: Optional[str] = None) -> pd.DataFrame:
         """
-        Query history data from InfluxDB.
-        range_str: e.g. "-1h", "-6h", "-24h"
+        history_frame from the local write buffer, for when InfluxDB can't be queried.
+        Aggregates like aggregateWindow (mean per tag set, stamped with the window end);
+        points=None returns the buffered points as they are.
+        Not cached, so the InfluxDB answer is back as soon as it recovers.
         """
+        started = time.perf_counter()
+        HISTORY_FALLBACKS.inc()
+        df = self.wal.read(time.time_ns() - range_seconds * 10**9, series)
+        if df.empty:
+            return _empty_history()
+
+        fields = result_fields(df.columns)
+        every = aggregate_every(range_seconds, points) if points else None
+        if every is not None:
+            window = pd.Timedelta(seconds=every)
+            keys = [c for c in ("filename", "partition", SERIES_TAG) if c in df.columns]
+            df = df.assign(timestamp=df["timestamp"].dt.floor(window) + window)
+            df = df.groupby(keys + ["timestamp"], sort=False)[fields].mean().reset_index().sort_values("timestamp")
+
+        tags = [SERIES_TAG] if SERIES_TAG in df.columns else []
+        df = _history_columns(df.rename(columns={"timestamp": "time"})[["time"] + fields + tags])
+        if points and len(df) > points:
+            df = self._downsample(df, points)
+        metrics.observe_stage("history_local", time.perf_counter() - started, len(df))
+        logger.warning(f"Served history from the local write buffer ({len(df)} points)")
+        return df
+
+    def drain(self) -> int:
+        """Write the pending buffered segments to InfluxDB in order; returns the points written."""
+        if self.client is None:
+            self._connect()
+            if self.client is None:
+                raise ConnectionError(f"InfluxDB at {self.url} is not reachable")
+
+        written = 0
+        pending = self.wal.pending()
+        while pending:
+            # Several small segments per round trip, at least one whole segment
+            group, encoded, rollups, count = [], [], {}, 0
+            while pending and (not group or count < self.batch_size):
+                segment = pending.pop(0)
+                df = segment.read()
+                lines = self._encode(df, segment.tags)
+                group.append(segment)
+                encoded.append(lines)
+                for bucket, rollup_lines in self._encode_rollups(df, segment.tags).items():
+                    rollups.setdefault(bucket, []).append(rollup_lines)
+                count += len(lines)
+
+            started = time.perf_counter()
+            # A retried segment rewrites the same points, which InfluxDB overwrites in place
+            self._write_lines(np.concatenate(encoded))
+            self._write_rollups({bucket: np.concatenate(lines) for bucket, lines in rollups.items()})
+            self.wal.mark_drained(group[-1].seq)
+            metrics.observe_stage("wal_drain", time.perf_counter() - started, count)
+            written += count
+        return written
+
+    def _drain_loop(self):
+        delay = WAL_RETRY_MIN_SECONDS
+        while not self._stopping.is_set():
+            self.wal.appended.clear()
+            try:
+                written = self.drain()
+            except Exception as e:
+                WAL_DRAIN_FAILURES.inc()
+                wait = delay * random.uniform(0.5, 1.0)
+                logger.warning(f"Draining the write buffer failed, retrying in {wait:.1f}s: {e}")
+                self._stopping.wait(wait)
+                delay = min(delay * 2, WAL_RETRY_MAX_SECONDS)
+                continue
+
+            if written:
+                logger.info(f"Drained {written} buffered points to InfluxDB")
+            delay = WAL_RETRY_MIN_SECONDS
+            self.wal.prune()
+            self.wal.appended.wait(WAL_IDLE_SECONDS)
+
+    def _request_rate_query(self, start_range: str, series: Optional[str]) -> str:
+        if series is not None:
+            series_filter = f'|> filter(fn: (r) => r["{SERIES_TAG}"] == {_flux_string(series)})'
+        else:
+            series_filter = f'|> filter(fn: (r) => not exists r["{SERIES_TAG}"])'
+
+        return f'''
+        from(bucket: "{self.bucket}")
+          |> range(start: {start_range})
+          |> filter(fn: (r) => r["_measurement"] == "{MEASUREMENT}" and r["_field"] == "actual")
+          {series_filter}
+          |> group()
+          |> aggregateWindow(every: {BASE_WINDOW_SECONDS}s, fn: max, createEmpty: false, timeSrc: "_start")
+        '''
+
+    @staticmethod
+    def _request_rate_frame(tables) -> pd.DataFrame:
+        rows = [(record.get_time(), record.get_value()) for table in tables for record in table.records]
+        df = pd.DataFrame(rows, columns=["timestamp", "request_rate"])
+        df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
+        return df.sort_values("timestamp", ignore_index=True)
+
+    def _local_request_rate(self, range_seconds: int, series: Optional[str]) -> pd.DataFrame:
+        local = self.wal.read(time.time_ns() - range_seconds * 10**9, series)
+        if local.empty or "actual" not in local.columns:
+            return pd.DataFrame({"timestamp": pd.Series(dtype="datetime64[ns, UTC]"),
+                                 "request_rate": pd.Series(dtype="float64")})
+        if series is None and SERIES_TAG in local.columns:
+            local = local[local[SERIES_TAG].isna()]
+        df = local.groupby("timestamp")["actual"].max().rename("request_rate").reset_index()
+        return df.sort_values("timestamp", ignore_index=True)
+
+    def get_request_rate(self, range_str: str, series: Optional[str] = None) -> pd.DataFrame:
+        """
+        The stored 'actual' values of a range as a 'timestamp' / 'request_rate' frame, e.g.
+        to replay it. Without `series` only unpartitioned uploads count; a minute written
+        by several uploads keeps its highest value. Reads the write buffer when InfluxDB fails.
+        """
+        start_range, range_seconds = parse_range(range_str)
+        try:
+            if not self.client:
+                raise ConnectionError("InfluxDB client not initialized")
+            return self._request_rate_frame(self.query_api.query(self._request_rate_query(start_range, series),
+                                                                 org=self.org))
+        except Exception as e:
+            if self.wal is None:
+                raise
+            logger.warning(f"Reading request rates from the local write buffer: {e}")
+            return self._local_request_rate(range_seconds, series)
+
+    def _series_query(self, start_range: str) -> str:
+        return f'''
+        import "influxdata/influxdb/schema"
+        schema.tagValues(bucket: "{self.bucket}", tag: "{SERIES_TAG}", start: {start_range},
+                         predicate: (r) => r["_measurement"] == "{MEASUREMENT}")
+        '''
+
+    def list_series(self, range_str: str = "-30d") -> list:
+        """Series names of the partitioned uploads written within the range."""
+        start_range, _ = parse_range(range_str)
         if not self.client:
-            logger.warning("InfluxDB client not initialized, returning empty history")
             return []
 
         try:
-            # Map simplified range strings to Flux duration syntax if needed, 
-            # or just rely on them being valid Flux durations (e.g. -1h is valid).
-            # Flux start parameter usually takes e.g. -1h
-            
-            # Temporarily hardcode a broad range for debugging the 1995 data
-            start_range = "-100d" 
-            # Original line was: start_range = range_str if range_str.startswith("-") else f"-{range_str}"
-            
-            query = f'''
-            from(bucket: "{self.bucket}")
-              |> range(start: {start_range})
-              |> filter(fn: (r) => r["_measurement"] == "inference_metrics")
-              |> filter(fn: (r) => r["_field"] == "actual" or r["_field"] == "model1" or r["_field"] == "model2")
-              |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
-              |> sort(columns: ["_time"], desc: false)
-            '''
-            
-            tables = self.query_api.query(query, org=self.org)
-            results = []
-            
-            for table in tables:
-                for record in table.records:
-                    results.append({
-                        "time": record.get_time().isoformat(), # Frontend expects 'time' string
-                        "actual": record.values.get("actual"),
-                        "model1": record.values.get("model1"),
-                        "model2": record.values.get("model2"),
-                        # "filename": record.values.get("filename") # Removed filename as frontend doesn't use it in ChartDataPoint
-                    })
-            
-            return results
+            tables = self.query_api.query(self._series_query(start_range), org=self.org)
+            return sorted({record.get_value() for table in tables for record in table.records})
+        except Exception as e:
+            logger.error(f"Error querying series from InfluxDB: {e}")
+            return []
+
+    @classmethod
+    def _combine_history(cls, frames: list, points: int) -> pd.DataFrame:
+        """The frames read for one history query as a single frame of at most `points` rows."""
+        df = _history_columns(pd.concat(frames, ignore_index=True)) if frames else _empty_history()
+        return cls._downsample(df, points) if len(df) > points else df
+
+    @staticmethod
+    def _downsample(df: pd.DataFrame, points: int) -> pd.DataFrame:
+        # Points from several uploads can share a timestamp; LTTB needs them in time order
+        df = df.sort_values("time", kind="stable", ignore_index=True)
+        x = pd.DatetimeIndex(df["time"]).asi8.astype(np.float64)
+        y = df["actual"].to_numpy(dtype=np.float64)
+        return df.iloc[lttb(x, y, points)].reset_index(drop=True)
+
+
+async def _slices(df: pd.DataFrame, chunk_rows: int):
+    for i in range(0, len(df), chunk_rows):
+        yield df.iloc[i:i + chunk_rows]
+
+
+def _parse_csv_block(reader: HistoryFrameReader, text: str) -> list:
+    frames = (reader.feed(row) for row in csv.reader(text.splitlines()))
+    return [frame for frame in frames if frame is not None]
+
+
+class AsyncInfluxDB:
+    """
+    Non-blocking InfluxDB access for the request handlers, next to an InfluxDBWrapper
+    whose queries, cache and write buffer it shares. One InfluxDBClientAsync (a single
+    pooled aiohttp session) serves every request; connecting and every read of a
+    response time out after INFLUXDB_TIMEOUT_MS, and at most INFLUXDB_MAX_QUERIES
+    queries run at once while the others wait for a slot.
+
+    Until start() is called from the event loop, the calls run the wrapper's
+    synchronous methods in a thread. The write buffer's drainer keeps using the
+    synchronous client in its own thread.
+    """
+
+    def __init__(self, db: InfluxDBWrapper, pool_size: int = INFLUXDB_POOL_SIZE,
+                 max_queries: int = INFLUXDB_MAX_QUERIES, timeout_ms: int = INFLUXDB_TIMEOUT_MS):
+        self.db = db
+        self.pool_size = pool_size
+        self.max_queries = max_queries
+        self.timeout_ms = timeout_ms
+        self.client = None
+        self.in_flight = 0
+        self._slots = None
+
+    async def start(self):
+        if self.client is not None:
+            return
+        # No limit on the whole request: a long history stream is fine while its bytes keep coming
+        timeout = aiohttp.ClientTimeout(total=None, connect=self.timeout_ms / 1000, sock_read=self.timeout_ms / 1000)
+        self.client = InfluxDBClientAsync(url=self.db.url, token=self.db.token, org=self.db.org,
+                                          enable_gzip=self.db.gzip, timeout=timeout,
+                                          connection_pool_maxsize=self.pool_size)
+        self.query_api = self.client.query_api()
+        self.write_api = self.client.write_api()
+        self._query_service = QueryService(self.client.api_client)
+        self._slots = asyncio.Semaphore(self.max_queries)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    @asynccontextmanager
+    async def _query_slot(self):
+        waiting = time.perf_counter()
+        async with self._slots:
+            QUERY_WAIT_SECONDS.observe(time.perf_counter() - waiting)
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    async def _iter_csv_frames(self, query: str, chunk_rows: int):
+        """
+        InfluxDBWrapper._iter_csv_frames on the async client. The slot is held until the
+        response has been read; the rows are parsed in a thread, block by block.
+        """
+        reader = HistoryFrameReader(chunk_rows)
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        async with self._query_slot():
+            response = await self._query_service.post_query_async(
+                org=self.db.org, query=Query(query=query, dialect=CSV_DIALECT), async_req=False,
+                _preload_content=False, _return_http_data_only=True)
+            try:
+                if response.status >= 300:
+                    raise ConnectionError(f"InfluxDB query failed ({response.status}): {await response.text()}")
+                rest = ""
+                async for block in response.content.iter_chunked(CSV_BLOCK_BYTES):
+                    # Only whole lines are parsed, the last partial one waits for the next block
+                    text, _, rest = (rest + decoder.decode(block)).rpartition("\n")
+                    for frame in await asyncio.to_thread(_parse_csv_block, reader, text):
+                        yield frame
+            finally:
+                response.release()
+
+        for frame in _parse_csv_block(reader, rest + decoder.decode(b"", final=True)):
+            yield frame
+        frame = reader.flush()
+        if frame is not None:
+            yield frame
+
+    async def history_frame(self, range_str: str = "-1h", points: Optional[int] = None,
+                            series: Optional[str] = None) -> pd.DataFrame:
+        """InfluxDBWrapper.history_frame without blocking the event loop, sharing its cache."""
+        db = self.db
+        if self.client is None:
+            return await asyncio.to_thread(db.history_frame, range_str, points, series)
+
+        start_range, range_seconds = parse_range(range_str)
+        points = points or DEFAULT_HISTORY_POINTS
+        cache_key = (start_range, points, series)
+        cached = db.history_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        started = time.perf_counter()
+        try:
+            resolution = await self._history_resolution(start_range, range_seconds, points)
+            query = db._aggregated_history_query(start_range, range_seconds, points, series, resolution)
+            frames = [frame async for frame in self._iter_csv_frames(query, HISTORY_STREAM_ROWS)]
+            df = await asyncio.to_thread(db._combine_history, frames, points)
+            db.history_cache.set(cache_key, df)
+            metrics.observe_stage("history_query", time.perf_counter() - started, len(df))
+            return df
+        except Exception as e:
+            logger.error(f"Error querying data from InfluxDB: {e}")
+            if db.wal is not None:
+                return await asyncio.to_thread(db._local_history, range_seconds, points, series)
+            return _empty_history()
+
+    async def _history_resolution(self, start_range: str, range_seconds: int, points: int) -> Optional[Resolution]:
+        """InfluxDBWrapper._history_resolution on the async client."""
+        db = self.db
+        resolution = db.rollups.resolution_for(range_seconds, points)
+        if resolution is None:
+            return None
+        cache_key = ("rollup_coverage", start_range, resolution.name)
+        covered = db.history_cache.get(cache_key)
+        if covered is None:
+            try:
+                async with self._query_slot():
+                    tables = await self.query_api.query(db._coverage_query(start_range, resolution), org=db.org)
+                covered = db._rollup_covers(tables, resolution)
+            except Exception as e:
+                logger.warning(f"Could not check the {resolution.name} rollup, reading the points: {e}")
+                covered = False
+            db.history_cache.set(cache_key, covered)
+        return resolution if covered else None
+
+    async def history_frames(self, range_str: str = "-1h", points: Optional[int] = None,
+                             series: Optional[str] = None, raw: bool = False,
+                             chunk_rows: int = HISTORY_STREAM_ROWS) -> AsyncIterator[pd.DataFrame]:
+        """
+        History as frames of at most `chunk_rows` rows, columns as in history_frame.
+        raw=True skips aggregation and LTTB and streams every stored point of the range in
+        time order as the response arrives, so memory stays flat however long the range is.
+        The query has run and its first frame has been read when this returns: query
+        errors, and the fallback to the write buffer, happen here and not mid-stream.
+        """
+        if not raw:
+            return _slices(await self.history_frame(range_str, points, series), chunk_rows)
+
+        db = self.db
+        start_range, range_seconds = parse_range(range_str)
+        started = time.perf_counter()
+        try:
+            if self.client is None:
+                raise ConnectionError("InfluxDB client not started")
+            frames = self._iter_csv_frames(db._history_query(start_range, None, series, merge=True), chunk_rows)
+            first = await anext(frames, None)
         except Exception as e:
             logger.error(f"Error querying data from InfluxDB: {e}")
+            if db.wal is None:
+                return _slices(_empty_history(), chunk_rows)
+            return _slices(await asyncio.to_thread(db._local_history, range_seconds, None, series), chunk_rows)
+
+        async def stream():
+            if first is None:
+                return
+            rows = len(first)
+            yield first
+            async for frame in frames:
+                rows += len(frame)
+                yield frame
+            metrics.observe_stage("history_stream", time.perf_counter() - started, rows)
+
+        return stream()
+
+    async def get_history(self, range_str: str = "-1h", points: Optional[int] = None,
+                          series: Optional[str] = None) -> list:
+        return history_records(await self.history_frame(range_str, points, series))
+
+    async def get_request_rate(self, range_str: str, series: Optional[str] = None) -> pd.DataFrame:
+        """InfluxDBWrapper.get_request_rate without blocking the event loop."""
+        db = self.db
+        if self.client is None:
+            return await asyncio.to_thread(db.get_request_rate, range_str, series)
+
+        start_range, range_seconds = parse_range(range_str)
+        try:
+            async with self._query_slot():
+                tables = await self.query_api.query(db._request_rate_query(start_range, series), org=db.org)
+            return db._request_rate_frame(tables)
+        except Exception as e:
+            if db.wal is None:
+                raise
+            logger.warning(f"Reading request rates from the local write buffer: {e}")
+            return await asyncio.to_thread(db._local_request_rate, range_seconds, series)
+
+    async def list_series(self, range_str: str = "-30d") -> list:
+        db = self.db
+        if self.client is None:
+            return await asyncio.to_thread(db.list_series, range_str)
+
+        start_range, _ = parse_range(range_str)
+        try:
+            async with self._query_slot():
+                tables = await self.query_api.query(db._series_query(start_range), org=db.org)
+            return sorted({record.get_value() for table in tables for record in table.records})
+        except Exception as e:
+            logger.error(f"Error querying series from InfluxDB: {e}")
             return []
+
+    async def write_inference_results(self, df: pd.DataFrame, filename: str, partition: Optional[str] = None):
+        """
+        InfluxDBWrapper.write_inference_results without blocking the event loop. Buffered
+        writes are a local file write and run in a thread; direct writes are encoded in
+        a thread and sent with the async client.
+        """
+        db = self.db
+        if db.wal is not None or self.client is None:
+            return await asyncio.to_thread(db.write_inference_results, df, filename, partition)
+
+        started = time.perf_counter()
+        tags = db._tags(df, filename, partition)
+        lines = await asyncio.to_thread(db._encode, df, tags)
+        batches = await self._write_lines(lines, db.bucket)
+
+        rollups = await asyncio.to_thread(db._encode_rollups, df, tags)
+        rollup_points = sum(len(r) for r in rollups.values())
+        try:
+            if rollups and not db._buckets_ready:
+                await asyncio.to_thread(db._ensure_buckets)
+            for bucket, rollup_lines in rollups.items():
+                await self._write_lines(rollup_lines, bucket)
+        except Exception as e:
+            # As in InfluxDBWrapper._write_rollups, the points are written whatever happens to the rollups
+            ROLLUP_FAILURES.inc()
+            logger.warning(f"Could not write rollups: {e}")
+            rollup_points = 0
+        return db._write_stats(lines, batches, started, rollup_points)
+
+    async def _write_lines(self, lines: np.ndarray, bucket: str) -> int:
+        db = self.db
+        batches = 0
+        for offset in range(0, len(lines), db.batch_size):
+            batch = "\n".join(lines[offset:offset + db.batch_size].tolist())
+            try:
+                await self.write_api.write(bucket=bucket, org=db.org, record=batch)
+            except Exception as e:
+                logger.error(f"Error writing data to InfluxDB: {e}")
+                raise e
+            batches += 1
+
+        if batches:
+            db.history_cache.clear()
+        return batches
@@ -0,0 +1,137 @@
+"""
+Streamed encodings of the history frames from AsyncInfluxDB.history_frames.
+
+    records   [{"time": "<ISO>", "actual": ..., ...}, ...], the layout of get_history
+    columnar  {"format": "columnar", "time_unit": "ms",
+               "chunks": [{"rows": n, "time": [epoch ms, ...], "actual": [...], ...}, ...], "rows": total}
+    arrow     Arrow IPC stream, one record batch per frame (needs the optional pyarrow package)
+
+Every frame is encoded, in a thread, and handed to the response as soon as it has been
+read, so the first bytes go out before the rest of the range has been queried.
+"""
+import asyncio
+import io
+import json
+from typing import AsyncIterator
+
+import pandas as pd
+
+from database import FIELDS, SERIES_TAG, history_records
+from models.predictor import FORECAST_HORIZONS, horizon_column
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional, only format=arrow needs it
+    pa = None
+
+FORMATS = ("records", "columnar", "arrow")
+MEDIA_TYPES = {
+    "records": "application/json",
+    "columnar": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def _dumps(value) -> str:
+    # Same settings as FastAPI's JSONResponse
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+
+def _epoch_ms(times: pd.Series) -> list:
+    return pd.DatetimeIndex(times).as_unit("ms").asi8.tolist()
+
+
+class RecordsEncoder:
+    def __init__(self):
+        self.first = True
+
+    def begin(self) -> str:
+        return "["
+
+    def encode(self, df: pd.DataFrame) -> str:
+        if df.empty:
+            return ""
+        # The records of one frame without their brackets
+        body = ("" if self.first else ",") + _dumps(history_records(df))[1:-1]
+        self.first = False
+        return body
+
+    def end(self) -> str:
+        return "]"
+
+
+class ColumnarEncoder:
+    def __init__(self):
+        self.rows = 0
+
+    def begin(self) -> str:
+        return '{"format":"columnar","time_unit":"ms","chunks":['
+
+    def encode(self, df: pd.DataFrame) -> str:
+        chunk = {"rows": len(df), "time": _epoch_ms(df["time"])}
+        for column in df.columns.drop("time"):
+            values = df[column]
+            chunk[column] = values.astype(object).where(values.notna(), None).tolist()
+        body = ("," if self.rows else "") + _dumps(chunk)
+        self.rows += len(df)
+        return body
+
+    def end(self) -> str:
+        return f'],"rows":{self.rows}}}'
+
+
+def arrow_schema():
+    """Every column a history frame can have, so frames that lack some still share one schema."""
+    fields = [*FIELDS, *(horizon_column(h) for h in FORECAST_HORIZONS)]
+    return pa.schema([("time", pa.timestamp("ms", tz="UTC"))] + [(f, pa.float64()) for f in fields]
+                     + [(SERIES_TAG, pa.string())])
+
+
+class ArrowEncoder:
+    """The schema is fixed up front (arrow_schema); every frame is conformed to it."""
+
+    def __init__(self):
+        if pa is None:
+            raise ValueError("format=arrow needs the optional pyarrow package")
+        self.buffer = io.BytesIO()
+        self.schema = arrow_schema()
+        self.writer = pa.ipc.new_stream(self.buffer, self.schema)
+
+    def _take(self) -> bytes:
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def begin(self) -> bytes:
+        # The schema message, so even an empty range is a readable stream
+        return self._take()
+
+    def encode(self, df: pd.DataFrame) -> bytes:
+        df = df.assign(time=pd.DatetimeIndex(df["time"]).as_unit("ms")).reindex(columns=self.schema.names)
+        series = df[SERIES_TAG]
+        df[SERIES_TAG] = series.astype(object).where(series.notna(), None)
+        self.writer.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+        return self._take()
+
+    def end(self) -> bytes:
+        self.writer.close()
+        return self._take()
+
+
+ENCODERS = {"records": RecordsEncoder, "columnar": ColumnarEncoder, "arrow": ArrowEncoder}
+
+
+def encode(fmt: str, frames: AsyncIterator[pd.DataFrame]) -> AsyncIterator:
+    """The response body for `frames` in format `fmt`; raises ValueError if it isn't available."""
+    encoder = ENCODERS[fmt]()
+
+    async def body():
+        yield encoder.begin()
+        async for df in frames:
+            data = await asyncio.to_thread(encoder.encode, df)
+            if data:
+                yield data
+        yield encoder.end()
+
+    return body()
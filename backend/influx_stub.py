@@ -0,0 +1,230 @@
+"""
+Minimal local stand-in for the InfluxDB 2.x HTTP API.
+
+Accepts line protocol on /api/v2/write (plain or gzip, counted per bucket), keeps the
+buckets created on /api/v2/buckets and answers /ping, /health and /api/v2/orgs, so the
+write path can be exercised and its throughput measured without a live InfluxDB.
+/api/v2/query ignores the Flux and returns a fixed pivoted result table (set_query_result),
+which is enough to time the history read path. `latency` delays every answer, as a
+remote InfluxDB would.
+
+    python influx_stub.py --port 8086          # run the stand-in
+    python influx_stub.py --bench 100000       # measure InfluxDBWrapper write throughput
+"""
+import argparse
+import gzip
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    server: "InfluxStubServer"
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith("/ping"):
+            self.send_response(204)
+            self.end_headers()
+        elif self.path.startswith("/health"):
+            self._send_json(200, {"name": "influxdb-stub", "status": "pass"})
+        elif self.path.startswith("/api/v2/orgs"):
+            name = parse_qs(urlparse(self.path).query).get("org", ["stub"])[0]
+            self._send_json(200, {"orgs": [{"id": "0000000000000001", "name": name}]})
+        elif self.path.startswith("/api/v2/buckets"):
+            names = parse_qs(urlparse(self.path).query).get("name")
+            with self.server._lock:
+                buckets = [b for b in self.server.buckets.values() if not names or b["name"] in names]
+            self._send_json(200, {"buckets": buckets})
+        else:
+            self._send_json(404, {"code": "not found", "message": self.path})
+
+    def _save_bucket(self, status: int):
+        bucket = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with self.server._lock:
+            bucket.setdefault("id", f"{len(self.server.buckets) + 1:016x}")
+            bucket.setdefault("retentionRules", [])
+            self.server.buckets[bucket["name"]] = bucket
+        self._send_json(status, bucket)
+
+    def do_PATCH(self):
+        if self.path.startswith("/api/v2/buckets/"):
+            self._save_bucket(200)
+        else:
+            self._send_json(404, {"code": "not found", "message": self.path})
+
+    def do_POST(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.path.startswith("/api/v2/buckets"):
+            self._save_bucket(201)
+            return
+        if self.path.startswith("/api/v2/query"):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            body = self.server.query_body
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if not self.path.startswith("/api/v2/write"):
+            self._send_json(404, {"code": "not found", "message": self.path})
+            return
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+
+        bucket = parse_qs(urlparse(self.path).query).get("bucket", [""])[0]
+        self.server.record_write(body, bucket)
+        self.send_response(204)
+        self.end_headers()
+
+
+class InfluxStubServer(ThreadingHTTPServer):
+    """Threaded HTTP server that counts the line protocol it receives."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _StubHandler)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.requests = 0
+        self.lines = 0
+        self.bytes = 0
+        self.query_body = b""
+        self.buckets = {}
+        self.bucket_lines = {}
+        # Seconds before a query or write is answered
+        self.latency = 0.0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record_write(self, body: bytes, bucket: str = ""):
+        lines = body.count(b"\n") + (1 if body and not body.endswith(b"\n") else 0)
+        with self._lock:
+            self.requests += 1
+            self.lines += lines
+            self.bytes += len(body)
+            self.bucket_lines[bucket] = self.bucket_lines.get(bucket, 0) + lines
+
+    def set_query_result(self, df: pd.DataFrame, measurement: str = "inference_metrics", tags: dict = None):
+        """
+        Answer every query with `df` as a single pivoted table in annotated CSV, the way
+        InfluxDB returns the output of pivot(rowKey:["_time"], columnKey: ["_field"]).
+        """
+        tags = tags or {}
+        fields = [c for c in df.columns if c != "timestamp"]
+        times = pd.to_datetime(df["timestamp"], utc=True)
+        start = times.min().strftime("%Y-%m-%dT%H:%M:%SZ") if len(df) else "1970-01-01T00:00:00Z"
+        stop = times.max().strftime("%Y-%m-%dT%H:%M:%SZ") if len(df) else "1970-01-01T00:00:00Z"
+
+        columns = ["result", "table", "_start", "_stop", "_time", "_measurement"] + list(tags) + fields
+        datatypes = ["string", "long"] + ["dateTime:RFC3339"] * 3 + ["string"] * (1 + len(tags)) + ["double"] * len(fields)
+        group = ["false", "false", "true", "true", "false", "true"] + ["true"] * len(tags) + ["false"] * len(fields)
+
+        table = pd.DataFrame({
+            "": "",
+            "result": "",
+            "table": 0,
+            "_start": start,
+            "_stop": stop,
+            "_time": times.dt.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "_measurement": measurement,
+            **tags,
+            **{f: df[f].astype("float64") for f in fields},
+        })
+        header = (
+            "#datatype," + ",".join(datatypes) + "\n"
+            + "#group," + ",".join(group) + "\n"
+            + "#default,_result" + "," * (len(columns) - 1) + "\n"
+        )
+        self.query_body = (header + table.to_csv(index=False, lineterminator="\n") + "\n").encode()
+
+    def start(self) -> "InfluxStubServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def synthetic_results(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Result frame shaped like RPSEstimator.predict_rate output."""
+    rng = np.random.default_rng(seed)
+    actual = rng.poisson(100, rows).astype(np.int64)
+    return pd.DataFrame({
+        "timestamp": pd.date_range("1995-07-01", periods=rows, freq="60s"),
+        "actual": actual,
+        "model1": actual * rng.uniform(0.8, 1.2, rows),
+        "model2": actual * rng.uniform(0.8, 1.2, rows),
+    })
+
+
+def measure_write_throughput(rows: int, batch_size: int = None, gzip_enabled: bool = None) -> dict:
+    """Write `rows` synthetic results through InfluxDBWrapper into a local stand-in."""
+    from database import InfluxDBWrapper
+
+    server = InfluxStubServer().start()
+    try:
+        db = InfluxDBWrapper(url=server.url, token="stub", org="stub", bucket="stub",
+                             batch_size=batch_size, gzip=gzip_enabled, wal_dir="")
+
+        stats = db.write_inference_results(synthetic_results(rows), "benchmark")
+        stats.update({"received_lines": server.lines, "bucket_lines": server.bucket_lines, "requests": server.requests,
+                      "bytes": server.bytes, "gzip": db.gzip, "batch_size": db.batch_size})
+        db.client.close()
+        return stats
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local InfluxDB write stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8086)
+    parser.add_argument("--bench", type=int, metavar="ROWS", help="measure write throughput for ROWS rows and exit")
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every query / write is answered")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.bench:
+        print(json.dumps(measure_write_throughput(args.bench, args.batch_size, args.gzip or None), indent=2))
+    else:
+        server = InfluxStubServer(args.host, args.port)
+        server.latency = args.latency
+        logger.info(f"InfluxDB stand-in listening on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
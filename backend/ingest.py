@@ -0,0 +1,383 @@
+import os
+import logging
+import time
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+try:
+    import pyarrow.csv as pa_csv
+except ImportError:  # optional, CSV falls back to pandas' reader
+    pa_csv = None
+
+logger = logging.getLogger(__name__)
+
+# Number of log lines parsed per chunk for CSV / JSON-lines uploads
+CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "500000"))
+# Bytes per block when CSV is read with pyarrow's streaming reader
+CSV_BLOCK_BYTES = int(os.getenv("INGEST_CSV_BLOCK_BYTES", str(8 << 20)))
+
+STREAMING_FORMATS = ('.csv', '.jsonl', '.ndjson', '.parquet')
+SUPPORTED_FORMATS = STREAMING_FORMATS + ('.json',)
+
+# Series of log lines that have no value in the partition column
+MISSING_PARTITION = "unknown"
+
+_MISSING_TIMESTAMP = "Input DataFrame must contain a 'timestamp' column for request rate calculation."
+
+
+class RequestRateAccumulator:
+    """
+    Folds chunks of raw log timestamps into per-window request counts.
+
+    Timestamps are bucketed by integer floor division of their epoch nanoseconds
+    and counted with bincount into one dense counter array covering the time span
+    seen so far, so memory depends on the span of the logs and not on the number
+    of log lines. The result matches RPSEstimator._build_request_rate for windows
+    that divide a day evenly (e.g. the default 60s window).
+    """
+
+    def __init__(self, window: str):
+        self.window = window
+        self.window_ns = pd.Timedelta(window).value
+        self.counts = None  # int64 counts of buckets first, first + 1, ...
+        self.first = 0
+        self.tz = None
+        self.rows = 0
+
+    def add(self, timestamps):
+        values, tz = parse_timestamps(timestamps)
+        self.add_epoch_ns(values, tz, rows=len(timestamps))
+
+    def add_epoch_ns(self, values: np.ndarray, tz=None, rows: int = None):
+        """Add already parsed int64 epoch nanoseconds (NaT excluded)."""
+        self.rows += len(values) if rows is None else rows
+        if self.tz is None:
+            self.tz = tz
+        if not len(values):
+            return
+
+        buckets = values // self.window_ns
+        low = int(buckets.min())
+        self._add_counts(low, np.bincount(buckets - low))
+
+    def merge(self, other: "RequestRateAccumulator"):
+        """Merge the counts of another accumulator built with the same window."""
+        self.rows += other.rows
+        if self.tz is None:
+            self.tz = other.tz
+        if other.counts is not None:
+            self._add_counts(other.first, other.counts)
+
+    def _add_counts(self, first: int, counts: np.ndarray):
+        if self.counts is None:
+            self.first, self.counts = first, counts.astype(np.int64)
+            return
+
+        start = min(self.first, first)
+        end = max(self.first + len(self.counts), first + len(counts))
+        if start != self.first or end != self.first + len(self.counts):
+            grown = np.zeros(end - start, dtype=np.int64)
+            grown[self.first - start:self.first - start + len(self.counts)] = self.counts
+            self.first, self.counts = start, grown
+        self.counts[first - self.first:first - self.first + len(counts)] += counts
+
+    def to_frame(self) -> pd.DataFrame:
+        """Return a 'timestamp' / 'request_rate' frame with empty windows filled with 0."""
+        if self.counts is None:
+            return pd.DataFrame({
+                "timestamp": pd.Series(dtype="datetime64[ns]"),
+                "request_rate": pd.Series(dtype="int64"),
+            })
+
+        # The counter array spans first..last bucket, empty windows included, like resample().size()
+        epoch_ns = (self.first + np.arange(len(self.counts), dtype=np.int64)) * self.window_ns
+        timestamps = pd.to_datetime(epoch_ns, unit="ns")
+        if self.tz is not None:
+            timestamps = timestamps.tz_localize("UTC").tz_convert(self.tz)
+        return pd.DataFrame({"timestamp": timestamps, "request_rate": self.counts})
+
+
+class PartitionedRequestRate:
+    """
+    Per-window request counts for every value of a partition column (service, host,
+    route, ...), one RequestRateAccumulator per series. A chunk is counted with a
+    single bincount over (series, window) pairs instead of one pass per series.
+    """
+
+    def __init__(self, window: str):
+        self.window = window
+        self.window_ns = pd.Timedelta(window).value
+        self.series: Dict[str, RequestRateAccumulator] = {}
+        self.rows = 0
+
+    def add_epoch_ns(self, values: np.ndarray, keys, tz=None, rows: int = None):
+        """Add parsed epoch nanoseconds (NaT kept in place) with the partition value of each row."""
+        self.rows += len(values) if rows is None else rows
+        codes, names = pd.factorize(keys)
+        # Lines without a partition value (missing or empty) still count, under their own series
+        names = [str(name) or MISSING_PARTITION for name in names]
+        if (codes < 0).any():
+            codes = np.where(codes < 0, len(names), codes)
+            names.append(MISSING_PARTITION)
+
+        valid = values != _NAT
+        if not valid.all():
+            values, codes = values[valid], codes[valid]
+        if not len(values):
+            return
+
+        buckets = values // self.window_ns
+        low = int(buckets.min())
+        buckets -= low
+        span = int(buckets.max()) + 1
+
+        if len(names) * span <= 4 * len(values) + (1 << 20):
+            counts = np.bincount(codes * span + buckets, minlength=len(names) * span).reshape(len(names), span)
+            per_series = enumerate(counts)
+        else:
+            # Many series over a long span: group the rows instead of allocating every (series, window) pair
+            order = np.argsort(codes, kind="stable")
+            bounds = np.cumsum(np.bincount(codes, minlength=len(names)))[:-1]
+            per_series = enumerate(np.bincount(b) for b in np.split(buckets[order], bounds))
+
+        for code, row in per_series:
+            nonzero = np.flatnonzero(row)
+            if not len(nonzero):
+                continue
+            accumulator = self.series.get(names[code])
+            if accumulator is None:
+                accumulator = self.series[names[code]] = RequestRateAccumulator(self.window)
+            if accumulator.tz is None:
+                accumulator.tz = tz
+            accumulator.rows += int(row.sum())
+            # Trimmed to the series' own first and last window
+            accumulator._add_counts(low + int(nonzero[0]), row[nonzero[0]:nonzero[-1] + 1])
+
+    def merge(self, other: "PartitionedRequestRate"):
+        """Merge the counts of another partitioned count built with the same window."""
+        self.rows += other.rows
+        for name, series in other.series.items():
+            if name in self.series:
+                self.series[name].merge(series)
+            else:
+                self.series[name] = series
+
+    def to_frame(self) -> pd.DataFrame:
+        """'series' / 'timestamp' / 'request_rate' frame, series in name order, each gap-filled."""
+        frames = []
+        for name in sorted(self.series):
+            frame = self.series[name].to_frame()
+            frame.insert(0, "series", name)
+            frames.append(frame)
+        if not frames:
+            frame = RequestRateAccumulator(self.window).to_frame()
+            frame.insert(0, "series", pd.Series(dtype=object))
+            return frame
+        return pd.concat(frames, ignore_index=True)
+
+
+_NAT = np.iinfo(np.int64).min
+# Epoch timestamps below these magnitudes are read as seconds / ms / us, larger ones as ns
+_EPOCH_UNITS = ((1e11, 10**9), (1e14, 10**6), (1e17, 10**3))
+
+
+def parse_timestamps(timestamps, keep_nat: bool = False):
+    """
+    Convert a timestamp column to int64 epoch nanoseconds with NaT dropped.
+    Returns (values, tz); tz is set for timezone-aware input, whose values are UTC.
+    With keep_nat, unparseable rows stay in place as the int64 minimum, so the
+    values line up with the other columns of the chunk.
+
+    datetime64 columns are reinterpreted without a copy, integer / float columns are
+    read as epoch seconds, milliseconds, microseconds or nanoseconds depending on their
+    magnitude, and strings go through the ISO 8601 parser before falling back to
+    pandas' format inference.
+    """
+    values = timestamps.to_numpy() if hasattr(timestamps, "to_numpy") else np.asarray(timestamps)
+    dtype = getattr(timestamps, "dtype", values.dtype)
+
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        index = pd.DatetimeIndex(timestamps)
+        ns = index.tz_convert("UTC").tz_localize(None).as_unit("ns").asi8
+        return (ns if keep_nat else ns[ns != _NAT]), index.tz
+
+    if np.issubdtype(values.dtype, np.datetime64):
+        ns = values.astype("datetime64[ns]").view(np.int64)
+        return (ns if keep_nat else ns[ns != _NAT]), None
+
+    if np.issubdtype(values.dtype, np.integer) or np.issubdtype(values.dtype, np.floating):
+        return _epoch_to_ns(values, keep_nat), None
+
+    try:
+        parsed = pd.to_datetime(timestamps, format="ISO8601")
+    except (ValueError, TypeError):
+        parsed = pd.to_datetime(timestamps)
+    return parse_timestamps(parsed, keep_nat)
+
+
+def _epoch_to_ns(values: np.ndarray, keep_nat: bool = False) -> np.ndarray:
+    finite = None
+    if np.issubdtype(values.dtype, np.floating):
+        finite = np.isfinite(values)
+        if keep_nat:
+            values = np.where(finite, values, 0.0)
+        else:
+            values = values[finite]
+    if not len(values):
+        return np.empty(0, dtype=np.int64)
+
+    magnitude = float(np.abs(values).max())
+    factor = 1
+    for limit, unit_factor in _EPOCH_UNITS:
+        if magnitude < limit:
+            factor = unit_factor
+            break
+
+    if np.issubdtype(values.dtype, np.floating):
+        ns = np.round(values * factor).astype(np.int64)
+        if keep_nat:
+            ns[~finite] = _NAT
+        return ns
+    return values.astype(np.int64, copy=False) * factor
+
+
+def iter_timestamp_chunks(fileobj: BinaryIO, filename: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.Series]:
+    """
+    Yield the 'timestamp' column of an uploaded log file chunk by chunk.
+    CSV and JSON-lines are read in chunks of `chunk_rows` lines, parquet one row group at a time.
+    Only the timestamp column is materialized: CSV is read with usecols and parquet
+    with column projection, so the other columns of wide logs are never converted.
+    """
+    for chunk in iter_column_chunks(fileobj, filename, ['timestamp'], chunk_rows):
+        yield chunk['timestamp']
+
+
+def iter_column_chunks(fileobj: BinaryIO, filename: str, columns: List[str],
+                       chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Like iter_timestamp_chunks, yielding frames with just `columns` ('timestamp' first)."""
+    name = filename.lower()
+
+    if name.endswith('.csv'):
+        yield from _iter_csv_columns(fileobj, columns, chunk_rows)
+    elif name.endswith(('.jsonl', '.ndjson')):
+        # JSON has no column projection; at least skip pandas' date and dtype guessing
+        for chunk in pd.read_json(fileobj, lines=True, chunksize=chunk_rows, convert_dates=False, dtype=False):
+            yield _select_columns(chunk, columns)
+    elif name.endswith('.parquet'):
+        import fastparquet
+
+        parquet_file = fastparquet.ParquetFile(fileobj)
+        missing = [c for c in columns if c not in parquet_file.columns]
+        if missing:
+            raise _missing_columns(missing)
+        for chunk in parquet_file.iter_row_groups(columns=columns):
+            yield chunk
+    elif name.endswith('.json'):
+        # A plain JSON document can't be split without parsing it whole
+        yield _select_columns(pd.read_json(fileobj, convert_dates=False, dtype=False), columns)
+    else:
+        raise ValueError(f"Unsupported file format: {filename}")
+
+
+def _iter_csv_columns(fileobj: BinaryIO, columns: List[str], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    if pa_csv is not None:
+        # pyarrow's multi-format tokenizer also converts ISO timestamps while reading
+        try:
+            reader = pa_csv.open_csv(
+                fileobj,
+                read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_BYTES),
+                convert_options=pa_csv.ConvertOptions(include_columns=columns),
+            )
+        except KeyError as e:
+            raise _missing_columns([c for c in columns if f"'{c}'" in str(e)] or columns) from e
+        for batch in reader:
+            yield batch.to_pandas()
+        return
+
+    try:
+        reader = pd.read_csv(fileobj, usecols=columns, chunksize=chunk_rows)
+    except ValueError as e:
+        # usecols reports a missing column as a mismatch, keep the usual message
+        raise _missing_columns([c for c in columns if f"'{c}'" in str(e)] or columns) from e
+    for chunk in reader:
+        yield chunk[columns]
+
+
+def _select_columns(chunk: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    missing = [c for c in columns if c not in chunk.columns]
+    if missing:
+        raise _missing_columns(missing)
+    return chunk[columns]
+
+
+def _missing_columns(missing: List[str]) -> ValueError:
+    if 'timestamp' in missing:
+        return ValueError(_MISSING_TIMESTAMP)
+    return ValueError(f"Partition column '{missing[0]}' not found in the upload")
+
+
+def count_requests(timestamps, window: str) -> pd.DataFrame:
+    """Per-window 'timestamp' / 'request_rate' frame for an in-memory timestamp column."""
+    accumulator = RequestRateAccumulator(window)
+    accumulator.add(timestamps)
+    return accumulator.to_frame()
+
+
+def count_request_rate(fileobj: BinaryIO, filename: str, window: str, chunk_rows: int = CHUNK_ROWS,
+                       partition: Optional[str] = None):
+    """
+    Count the requests of an uploaded log file per window, chunk by chunk. Returns the
+    RequestRateAccumulator (PartitionedRequestRate with `partition`), so the counts of
+    several files can be merged before they become a frame.
+    """
+    if partition:
+        accumulator = PartitionedRequestRate(window)
+        columns = ['timestamp', partition]
+    else:
+        accumulator = RequestRateAccumulator(window)
+        columns = ['timestamp']
+    parse_seconds = resample_seconds = 0.0
+
+    chunks = iter_column_chunks(fileobj, filename, columns, chunk_rows)
+    while True:
+        # Parsing happens inside the generator, counting in add(); both are timed separately
+        started = time.perf_counter()
+        chunk = next(chunks, None)
+        if chunk is None:
+            parse_seconds += time.perf_counter() - started
+            break
+        values, tz = parse_timestamps(chunk['timestamp'], keep_nat=bool(partition))
+        parse_seconds += time.perf_counter() - started
+
+        started = time.perf_counter()
+        if partition:
+            accumulator.add_epoch_ns(values, chunk[partition], tz, rows=len(chunk))
+        else:
+            accumulator.add_epoch_ns(values, tz, rows=len(chunk))
+        resample_seconds += time.perf_counter() - started
+
+    metrics.observe_stage("parse", parse_seconds, accumulator.rows)
+    metrics.observe_stage("resample", resample_seconds, accumulator.rows)
+    return accumulator
+
+
+def stream_request_rate(fileobj: BinaryIO, filename: str, window: str, chunk_rows: int = CHUNK_ROWS,
+                        partition: Optional[str] = None) -> pd.DataFrame:
+    """
+    Build the per-window request_rate frame for an uploaded log file without
+    loading the whole file into memory.
+    With `partition`, the log is split into one series per value of that column and
+    the frame gets a leading 'series' column (see PartitionedRequestRate).
+    """
+    accumulator = count_request_rate(fileobj, filename, window, chunk_rows, partition)
+    rate_df = accumulator.to_frame()
+    if partition:
+        logger.info(f"Streamed {accumulator.rows} log lines from {filename} into {len(rate_df)} windows "
+                    f"across {len(accumulator.series)} '{partition}' series")
+    else:
+        logger.info(f"Streamed {accumulator.rows} log lines from {filename} into {len(rate_df)} windows")
+    return rate_df
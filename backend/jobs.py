@@ -0,0 +1,430 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, List, Optional, Tuple
+
+import pandas as pd
+
+import archives
+import metrics
+from ingest import stream_request_rate
+from models.predictor import RPSEstimator
+from result_cache import CacheEntry, ResultCache, copy_and_hash, upload_digest
+
+logger = logging.getLogger(__name__)
+
+# Worker processes running parse + inference (0 runs jobs in a thread of the API process)
+WORKER_PROCESSES = int(os.getenv("INFERENCE_WORKERS", "2"))
+# Jobs allowed to run at the same time, the rest wait in the queue
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "2"))
+# Finished jobs kept for the status API
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "100"))
+WORKER_START_METHOD = os.getenv("WORKER_START_METHOD", "spawn")
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", tempfile.gettempdir())
+
+JOBS = metrics.REGISTRY.counter("rps_jobs_total", "Finished upload jobs by status", ["status"])
+
+# Estimators of each worker process by models directory; active and shadow at most
+_worker_estimators: "OrderedDict[str, RPSEstimator]" = OrderedDict()
+WORKER_MODEL_SLOTS = 2
+
+
+def _init_worker(models_dir: str):
+    _worker(models_dir)
+
+
+def _worker(models_dir: str = "models", model_version: Optional[str] = None) -> RPSEstimator:
+    """The worker's estimator for `models_dir`, reloaded when the files there changed version."""
+    estimator = _worker_estimators.get(models_dir)
+    if estimator is None or (model_version is not None and estimator.model_version != model_version):
+        estimator = RPSEstimator(models_dir)
+        _worker_estimators[models_dir] = estimator
+    _worker_estimators.move_to_end(models_dir)
+    while len(_worker_estimators) > WORKER_MODEL_SLOTS:
+        _worker_estimators.popitem(last=False)
+    return estimator
+
+
+def _run_parse(path: str, filename: str, partition: Optional[str] = None):
+    """
+    Parse a spooled upload into its per-window request_rate (executed in a worker).
+    Returns the rate frame and the stage timings recorded on the way.
+    """
+    with metrics.capture() as observations:
+        with open(path, "rb") as f:
+            rate_df = stream_request_rate(f, filename, RPSEstimator.WINDOW, partition=partition)
+    return rate_df, observations
+
+
+def _run_expand(path: str, filename: str, workdir: str):
+    """List the log pieces of a spooled batch upload, unpacking a compressed tar (executed in a worker)."""
+    with metrics.capture() as observations:
+        with metrics.timed("unpack"):
+            pieces = archives.expand(path, filename, workdir)
+    return pieces, observations
+
+
+def _run_count(piece: archives.LogPiece, partition: Optional[str] = None):
+    """Count the requests of one log piece per window (executed in a worker)."""
+    with metrics.capture() as observations:
+        accumulator = archives.count_piece(piece, RPSEstimator.WINDOW, partition)
+    return accumulator, observations
+
+
+def _discard(path: str):
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def _batch_name(filenames: List[str]) -> str:
+    """Name a batch is written under when none is given: its first file, and how many follow."""
+    if len(filenames) == 1:
+        return filenames[0]
+    return f"{filenames[0]}+{len(filenames) - 1}"
+
+
+def _run_predict(models_dir: str, model_version: Optional[str], rate_df: pd.DataFrame, start=None):
+    """Run inference on a rate frame, optionally only from `start` on (executed in a worker)."""
+    estimator = _worker(models_dir, model_version)
+    with metrics.capture() as observations:
+        result_df = estimator.predict_rate(rate_df, start)
+    return result_df, observations
+
+
+class Job:
+    STAGES = ("queued", "inference", "writing", "done")
+
+    def __init__(self, filename: str, path: str, digest: str = None, partition: str = None,
+                 files: Optional[List[Tuple[str, str]]] = None):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        # A batch job's path is its spool directory, `files` the (path, filename) of each upload in it
+        self.path = path
+        self.files = files
+        self.pieces = None
+        self.digest = digest
+        self.partition = partition
+        self.status = "queued"
+        self.stage = "queued"
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def progress(self) -> float:
+        if self.status == "succeeded":
+            return 1.0
+        return self.STAGES.index(self.stage) / (len(self.STAGES) - 1)
+
+    def to_dict(self, include_result: bool = True) -> dict:
+        data = {
+            "job_id": self.id,
+            "filename": self.filename,
+            "partition": self.partition,
+            "files": [filename for _, filename in self.files] if self.files is not None else None,
+            "pieces": self.pieces,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 2),
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if include_result:
+            data["result"] = self.result
+        return data
+
+
+class JobManager:
+    """
+    Runs uploads as background jobs: parsing and inference go to a process pool where
+    every worker holds its own RPSEstimator, and the DB write runs in a thread, so the
+    event loop stays free for /api/health, /api/history and the WebSockets.
+
+    With a ResultCache, a file uploaded before (same digest and model version) is
+    answered from the cache, and an upload extending a cached series only predicts
+    and writes the windows that are new.
+
+    use_models() switches the model version for jobs started afterwards; a running job
+    finishes with the version it started with.
+    """
+
+    def __init__(self, db, models_dir: str = "models", workers: int = WORKER_PROCESSES,
+                 max_concurrent: int = MAX_CONCURRENT_JOBS, cache: Optional[ResultCache] = None,
+                 model_version: Optional[str] = None):
+        self.db = db
+        self.models_dir = models_dir
+        self.cache = cache
+        # The cache is only used while results can be tied to the models that made them
+        self.model_version = model_version
+        self.workers = workers
+        self.max_concurrent = max_concurrent
+        self.semaphore = None
+        self.executor = None
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._tasks = set()
+
+    def start(self):
+        """Create the pool; call from within the running event loop (app startup)."""
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        if self.workers > 0 and self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(WORKER_START_METHOD),
+                initializer=_init_worker,
+                initargs=(self.models_dir,),
+            )
+            logger.info(f"Started inference pool with {self.workers} workers")
+
+    def use_models(self, models_dir: str, model_version: Optional[str], estimator: Optional[RPSEstimator] = None):
+        """
+        Run the jobs started from now on with the models in `models_dir`. Workers load
+        them on their next job; without a pool, an already loaded `estimator` is reused.
+        """
+        self.models_dir = models_dir
+        self.model_version = model_version
+        if self.workers <= 0 and estimator is not None:
+            _worker_estimators[models_dir] = estimator
+            _worker_estimators.move_to_end(models_dir)
+
+    def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for job in self.jobs.values() if job.status == "queued")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def submit(self, fileobj, filename: str, partition: Optional[str] = None) -> Job:
+        """
+        Spool the upload to disk and queue it. Returns immediately with the job.
+        With `partition`, the log is split into one series per value of that column.
+        """
+        suffix = os.path.splitext(filename)[1]
+        fd, path = tempfile.mkstemp(prefix="upload-", suffix=suffix, dir=UPLOAD_DIR)
+        with os.fdopen(fd, "wb") as out:
+            digest = upload_digest(await asyncio.to_thread(copy_and_hash, fileobj, out), partition)
+        return self._queue(Job(filename, path, digest, partition))
+
+    async def submit_batch(self, uploads: List[Tuple[BinaryIO, str]], partition: Optional[str] = None,
+                           name: Optional[str] = None) -> Job:
+        """
+        Spool several uploads (log files, compressed logs, tar / zip archives of them) and
+        queue them as one job written under `name`. Their log pieces are counted in
+        parallel and the counts merged into one series before it is predicted.
+        """
+        directory = tempfile.mkdtemp(prefix="batch-", dir=UPLOAD_DIR)
+        files, digests = [], []
+        try:
+            for i, (fileobj, filename) in enumerate(uploads):
+                path = os.path.join(directory, f"{i:04d}-{os.path.basename(filename)}")
+                with open(path, "wb") as out:
+                    digests.append(await asyncio.to_thread(copy_and_hash, fileobj, out))
+                files.append((path, filename))
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+
+        # The counts are summed, so the same files in another order make the same series
+        digest = upload_digest(hashlib.sha256("\0".join(sorted(digests)).encode()).hexdigest(), partition)
+        filenames = [filename for _, filename in files]
+        return self._queue(Job(name or _batch_name(filenames), directory, digest, partition, files))
+
+    def _queue(self, job: Job) -> Job:
+        self.start()
+        self.jobs[job.id] = job
+        self._prune()
+
+        model_version = self.model_version
+        entry = self.cache.get(job.digest, model_version) if self.cache is not None and model_version else None
+        if entry is not None:
+            # Same file, same models: nothing to compute or write
+            result_df = entry.upload_result()
+            job.result = self._summary(result_df, None, model_version=model_version, cache="hit",
+                                       series=entry.rate_df["series"].nunique() if job.partition else None,
+                                       reused_rows=len(result_df), new_rows=0)
+            job.started_at = job.finished_at = time.time()
+            job.stage = "done"
+            job.status = "succeeded"
+            JOBS.inc(status=job.status)
+            _discard(job.path)
+            logger.info(f"Upload {job.filename} matches cached result {entry.key}")
+            return job
+
+        task = asyncio.create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job: Job):
+        try:
+            async with self.semaphore:
+                job.status = "running"
+                job.stage = "inference"
+                job.started_at = time.time()
+                # Pinned for the whole job, a model swap only affects jobs started after it
+                models_dir, model_version = self.models_dir, self.model_version
+                cache = self.cache if model_version else None
+
+                rate_df = await self._parse(job)
+
+                # Reuse the predictions of a cached series this upload continues
+                entry, resume = None, None
+                if cache is not None:
+                    entry, resume = cache.find_prefix(rate_df, model_version, RPSEstimator.WINDOW)
+
+                if entry is None:
+                    series_df = rate_df
+                    new_df = await self._predict(models_dir, model_version, rate_df)
+                    full_df = new_df
+                else:
+                    # Cached history up to `resume`, then the upload's own windows
+                    history = entry.rate_df[entry.rate_df["timestamp"] < resume]
+                    series_df = pd.concat([history, rate_df[rate_df["timestamp"] >= resume]], ignore_index=True)
+                    if series_df["timestamp"].iloc[-1] >= resume:
+                        new_df = await self._in_worker(_run_predict, models_dir, model_version, series_df, resume)
+                    else:
+                        new_df = entry.result_df.iloc[:0]
+                    cached_df = entry.result_df[entry.result_df["timestamp"] < resume]
+                    full_df = pd.concat([cached_df, new_df], ignore_index=True)
+                    logger.info(f"Job {job.id} extends cached result {entry.key}: "
+                                f"{len(new_df)} new windows from {resume}")
+
+                first = rate_df["timestamp"].iloc[0] if len(rate_df) else None
+                result_df = full_df[full_df["timestamp"] >= first].reset_index(drop=True) if first is not None else full_df
+
+                job.stage = "writing"
+                write_stats = None
+                write_ok = False
+                try:
+                    # Windows taken from the cache were written by the earlier upload
+                    write_stats = await self.db.write_inference_results(new_df, job.filename, job.partition)
+                    write_ok = write_stats is not None or new_df.empty
+                except Exception as e:
+                    # As before, a failed write is logged but doesn't fail the upload
+                    logger.error(f"Database write failed for job {job.id}: {e}")
+
+                # Only cache what made it to the database, or a retry would skip the write
+                if cache is not None and write_ok:
+                    cache.put(CacheEntry(job.digest, model_version, series_df, full_df, first, job.filename))
+
+                job.result = self._summary(
+                    result_df, write_stats,
+                    model_version=model_version,
+                    cache="miss" if entry is None else "extended",
+                    series=rate_df["series"].nunique() if job.partition else None,
+                    reused_rows=len(result_df) - len(new_df) if entry is not None else 0,
+                    new_rows=len(new_df),
+                )
+                job.stage = "done"
+                job.status = "succeeded"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.filename}) failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            JOBS.inc(status=job.status)
+            if job.started_at is not None:
+                metrics.observe_stage("job", job.finished_at - job.started_at)
+            _discard(job.path)
+
+    async def _parse(self, job: Job) -> pd.DataFrame:
+        """
+        The upload's per-window request_rate. The files of a batch are expanded into their
+        log pieces, which are counted in the pool at the same time; the counts are summed
+        per window, so a window split across files counts every request in it.
+        """
+        if job.files is None:
+            return await self._in_worker(_run_parse, job.path, job.filename, job.partition)
+
+        expanded = await asyncio.gather(*(
+            self._in_worker(_run_expand, path, filename, os.path.join(job.path, f"unpacked-{i}"))
+            for i, (path, filename) in enumerate(job.files)
+        ))
+        pieces = [piece for group in expanded for piece in group]
+        job.pieces = len(pieces)
+        counts = await asyncio.gather(*(self._in_worker(_run_count, piece, job.partition) for piece in pieces))
+
+        started = time.perf_counter()
+        total = counts[0]
+        for accumulator in counts[1:]:
+            total.merge(accumulator)
+        rate_df = total.to_frame()
+        metrics.observe_stage("merge", time.perf_counter() - started, total.rows)
+        logger.info(f"Job {job.id} counted {total.rows} log lines from {len(pieces)} files into {len(rate_df)} windows")
+        return rate_df
+
+    async def _predict(self, models_dir: str, model_version: Optional[str], rate_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Predict a rate frame in the pool. The series of a partitioned frame are spread
+        over the workers, each predicting its share in one stacked batch.
+        """
+        if "series" not in rate_df.columns or self.executor is None or self.workers < 2:
+            return await self._in_worker(_run_predict, models_dir, model_version, rate_df)
+
+        sizes = rate_df.groupby("series", sort=False).size().sort_values(ascending=False)
+        shares = [[] for _ in range(min(self.workers, len(sizes)))]
+        loads = [0] * len(shares)
+        # Largest series first onto the least loaded worker
+        for series, size in sizes.items():
+            i = loads.index(min(loads))
+            shares[i].append(series)
+            loads[i] += size
+        if len(shares) < 2:
+            return await self._in_worker(_run_predict, models_dir, model_version, rate_df)
+
+        results = await asyncio.gather(*(
+            self._in_worker(_run_predict, models_dir, model_version, rate_df[rate_df["series"].isin(share)])
+            for share in shares
+        ))
+        return pd.concat(results, ignore_index=True).sort_values(["series", "timestamp"], ignore_index=True)
+
+    async def _in_worker(self, fn, *args):
+        if self.executor is not None:
+            result, observations = await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+            # Timings from the worker process show up in this process's /metrics
+            metrics.record(observations)
+        else:
+            result, _ = await asyncio.to_thread(fn, *args)
+        return result
+
+    @staticmethod
+    def _summary(result_df: pd.DataFrame, write_stats, **cache_info) -> dict:
+        return {
+            "rows_processed": len(result_df),
+            "db_write": write_stats,
+            **cache_info,
+            "preview": result_df.head().to_dict(orient="records"),
+        }
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - JOB_HISTORY)]:
+            del self.jobs[job_id]
@@ -0,0 +1,212 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+import pandas as pd
+from fastapi import WebSocket
+
+import metrics
+
+try:
+    import msgpack
+except ImportError:  # optional, clients fall back to JSON frames
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Seconds between pushes; points published in between are batched into one frame
+TICK_SECONDS = float(os.getenv("WS_TICK_SECONDS", "1.0"))
+# Frames buffered per client before the oldest ones are dropped
+CLIENT_QUEUE_SIZE = int(os.getenv("WS_CLIENT_QUEUE_SIZE", "32"))
+# A send taking longer than this marks the client as dead
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5.0"))
+# Points kept between ticks if nobody drains them
+MAX_PENDING_POINTS = int(os.getenv("WS_MAX_PENDING_POINTS", "10000"))
+# Recent frame deliveries kept for lag reports (e.g. of a replay run)
+DELIVERY_HISTORY = 10000
+
+DELIVERY_SECONDS = metrics.REGISTRY.histogram(
+    "rps_ws_delivery_seconds", "Time from publishing the oldest point of a frame until it was sent")
+
+
+def _compact_point(point: dict) -> dict:
+    """Point as sent to the dashboard: epoch-ms time and only the values that are set."""
+    compact = {}
+    for key, value in point.items():
+        if value is None:
+            continue
+        if key in ("timestamp", "time"):
+            compact["time"] = int(pd.Timestamp(value).value // 1_000_000)
+        else:
+            compact[key] = value
+    return compact
+
+
+class EncodedBatch:
+    """
+    The points of one tick, encoded once and shared by every client.
+    Batches queued for a slow client are concatenated into a single frame without re-encoding.
+    """
+
+    def __init__(self, points: List[dict], oldest: Optional[float] = None):
+        self.count = len(points)
+        # perf_counter() of the earliest publish (or due time) among the points
+        self.oldest = oldest if oldest is not None else time.perf_counter()
+        self.json_items = ",".join(json.dumps(p, separators=(",", ":")) for p in points)
+        self.msgpack_items = b"".join(msgpack.packb(p) for p in points) if msgpack else None
+
+    @staticmethod
+    def join_json(batches: List["EncodedBatch"]) -> str:
+        items = ",".join(b.json_items for b in batches if b.count)
+        return f'{{"type":"batch","points":[{items}]}}'
+
+    @staticmethod
+    def join_msgpack(batches: List["EncodedBatch"]) -> bytes:
+        packer = msgpack.Packer()
+        header = packer.pack_map_header(2) + packer.pack("type") + packer.pack("batch") + packer.pack("points")
+        header += packer.pack_array_header(sum(b.count for b in batches))
+        return header + b"".join(b.msgpack_items for b in batches)
+
+
+class LiveClient:
+    """One dashboard socket with its own bounded queue and sender task."""
+
+    def __init__(self, websocket: WebSocket, binary: bool):
+        self.websocket = websocket
+        self.binary = binary
+        self.queue: "asyncio.Queue[EncodedBatch]" = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.dropped = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def offer(self, batch: EncodedBatch):
+        # Drop-oldest: a client that falls behind skips stale points instead of stalling the others
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(batch)
+
+    async def run(self, manager: "ConnectionManager"):
+        try:
+            while True:
+                batches = [await self.queue.get()]
+                # Coalesce everything that piled up into a single frame
+                while not self.queue.empty():
+                    batches.append(self.queue.get_nowait())
+
+                started = time.perf_counter()
+                if self.binary:
+                    send = self.websocket.send_bytes(EncodedBatch.join_msgpack(batches))
+                else:
+                    send = self.websocket.send_text(EncodedBatch.join_json(batches))
+                await asyncio.wait_for(send, timeout=SEND_TIMEOUT)
+                sent = time.perf_counter()
+                metrics.observe_stage("ws_send", sent - started, sum(b.count for b in batches))
+                manager.record_delivery(sent, sent - min(b.oldest for b in batches))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"Dropping websocket client: {e!r}")
+            manager.disconnect(self.websocket)
+
+
+class ConnectionManager:
+    """
+    Push pipeline for /ws/live. Points published during a tick are encoded once and
+    handed to every client's bounded queue; each client has its own sender task, so
+    fan-out is concurrent and a slow or dead socket never blocks the others.
+    """
+
+    def __init__(self, tick_seconds: float = TICK_SECONDS):
+        self.tick_seconds = tick_seconds
+        self.active_connections: Dict[WebSocket, LiveClient] = {}
+        self.pending = deque(maxlen=MAX_PENDING_POINTS)
+        self.dropped_frames = 0
+        self.dropped_points = 0
+        self.deliveries = deque(maxlen=DELIVERY_HISTORY)  # (sent_at, lag) per frame sent
+        self._oldest: Optional[float] = None
+        self._ticker: Optional[asyncio.Task] = None
+
+    async def connect(self, websocket: WebSocket, binary: bool = False):
+        await websocket.accept()
+        if binary and msgpack is None:
+            logger.warning("msgpack is not installed, sending JSON frames instead")
+            binary = False
+        client = LiveClient(websocket, binary)
+        client.task = asyncio.create_task(client.run(self))
+        self.active_connections[websocket] = client
+
+    def disconnect(self, websocket: WebSocket):
+        client = self.active_connections.pop(websocket, None)
+        if client is None:
+            return
+        self.dropped_frames += client.dropped
+        if client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
+
+    def publish(self, point: dict, due: Optional[float] = None):
+        """
+        Queue a point for the next tick. `due` is the perf_counter() time the point
+        was meant to be available (defaults to now); delivery lag is measured from it.
+        """
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped_points += 1
+        self.pending.append(_compact_point(point))
+        due = time.perf_counter() if due is None else due
+        if self._oldest is None or due < self._oldest:
+            self._oldest = due
+
+    def record_delivery(self, sent_at: float, lag: float):
+        DELIVERY_SECONDS.observe(lag)
+        self.deliveries.append((sent_at, lag))
+
+    async def broadcast(self, message: dict):
+        """Push a single point right away, outside the tick schedule."""
+        self._fan_out(EncodedBatch([_compact_point(message)]))
+
+    def flush(self):
+        if not self.pending:
+            return
+        points = list(self.pending)
+        self.pending.clear()
+        oldest, self._oldest = self._oldest, None
+        self._fan_out(EncodedBatch(points, oldest))
+
+    def _fan_out(self, batch: EncodedBatch):
+        for client in list(self.active_connections.values()):
+            client.offer(batch)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(client.queue.qsize() for client in self.active_connections.values())
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self.active_connections),
+            "pending_points": len(self.pending),
+            "queued_frames": self.queue_depth,
+            "dropped_frames": self.dropped_frames + sum(c.dropped for c in self.active_connections.values()),
+            "dropped_points": self.dropped_points,
+        }
+
+    async def _run_ticker(self):
+        while True:
+            await asyncio.sleep(self.tick_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Live tick failed: {e}")
+
+    def start(self):
+        if self._ticker is None:
+            self._ticker = asyncio.create_task(self._run_ticker())
+
+    async def stop(self):
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
+        for websocket in list(self.active_connections):
+            self.disconnect(websocket)
@@ -1,20 +1,49 @@
 import asyncio
 import logging
 import json
+from contextlib import asynccontextmanager
 from typing import List, Optional
-from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect
+import time
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
-import io
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel
 
-from database import InfluxDBWrapper
+import archives
+import history_stream
+import metrics
+
+from database import AsyncInfluxDB, InfluxDBWrapper
+from ingest import SUPPORTED_FORMATS, stream_request_rate
+from jobs import JobManager
+from live import ConnectionManager
 from models.predictor import RPSEstimator
+from models.streaming import StreamingRPSEstimator
+from registry import ModelRegistry
+from replay import ReplayManager
+from result_cache import ResultCache
+from scaling import ScalingEngine, simulate
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="ScaleOps Backend", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Models load in the background, /api/health answers while they do
+    registry.start()
+    db.start()
+    await adb.start()
+    job_manager.start()
+    manager.start()
+    yield
+    replay_manager.shutdown()
+    await manager.stop()
+    job_manager.shutdown()
+    await adb.close()
+    db.close()
+
+app = FastAPI(title="ScaleOps Backend", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -27,111 +56,484 @@ app.add_middleware(
 
 # Initialize components
 db = InfluxDBWrapper()
-estimator = RPSEstimator()
+# What the request handlers use, so database round trips don't hold up the event loop
+adb = AsyncInfluxDB(db)
+registry = ModelRegistry()
+job_manager = JobManager(adb, cache=ResultCache())
+profiler = metrics.SlowRequestProfiler()
+# Created once the first model version is active; the shadow stream only while one is set
+stream_estimator: Optional[StreamingRPSEstimator] = None
+shadow_stream: Optional[StreamingRPSEstimator] = None
+# Replica recommendations from the live stream's forecasts (see scaling.py)
+scaling = ScalingEngine()
+
+def _on_model_swap(role, version):
+    """Point the upload jobs and the live stream at a newly swapped-in model version."""
+    global stream_estimator, shadow_stream
+    if role == "active":
+        job_manager.use_models(version.path, version.model_version, version.estimator)
+        if stream_estimator is None:
+            stream_estimator = StreamingRPSEstimator(version.estimator)
+        else:
+            stream_estimator.use_estimator(version.estimator)
+    elif version is None:
+        shadow_stream = None
+    elif shadow_stream is not None:
+        shadow_stream.use_estimator(version.estimator)
+    elif stream_estimator is not None:
+        # Starts from the live stream's state, so it forecasts the same windows right away
+        shadow_stream = stream_estimator.fork(version.estimator)
+
+registry.add_listener(_on_model_swap)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    sampler = profiler.start()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        # Route template, not the raw path, so job ids don't blow up the label set
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.HTTP_SECONDS.observe(elapsed, method=request.method, route=route, status=status)
+        profiler.finish(sampler, route, elapsed)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Stage latencies, rows/sec and queue depths in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/api/health")
 async def health_check():
-    return {"status": "ok", "service": "backend"}
+    active = registry.active_version
+    return {
+        "status": "ok",
+        "service": "backend",
+        "models": registry.state,
+        "model_version": active.name if active is not None else None,
+    }
 
-@app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...)):
+@app.get("/api/models")
+async def list_models():
     """
-    Handle file upload (csv, parquet, json), run inference, and store results.
+    Model versions on disk, which one is active / shadowed, and the shadow comparison.
+    """
+    registry.scan()
+    return registry.status()
+
+@app.post("/api/models/reload")
+async def reload_models():
+    """
+    Reload the active and shadow versions whose files changed on disk and swap them in.
     """
     try:
-        content = await file.read()
-        filename = file.filename
-        
-        # Read file into DataFrame
-        if filename.endswith('.csv'):
-            df = pd.read_csv(io.BytesIO(content))
-        elif filename.endswith('.parquet'):
-            df = pd.read_parquet(io.BytesIO(content))
-        elif filename.endswith('.json'):
-            df = pd.read_json(io.BytesIO(content))
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported file format")
+        reloaded = await asyncio.to_thread(registry.reload)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"reloaded": reloaded, **registry.status()}
 
-        logger.info(f"Received file {filename} with shape {df.shape}")
+@app.post("/api/models/{name}/activate")
+async def activate_model(name: str):
+    """
+    Load a model version and swap it in; requests already running finish on the old one.
+    """
+    try:
+        await asyncio.to_thread(registry.activate, name)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return registry.status()
 
-        # Run inference
-        try:
-            # predictions will now be a DataFrame, not an array
-            result_df = estimator.predict(df) 
-            # We no longer need this line: df['predicted_rps'] = predictions
-            # Instead, result_df already contains 'predicted_rps' and relevant timestamps
-
-            # The 'result_df' now contains the processed data with predictions.
-            # We need to decide what to store and return.
-            # For now, let's assume result_df is what we want.
-            predictions_count = len(result_df) # Get count of actual predictions made
-            
-        except Exception as e:
-            logger.error(f"Inference failed: {e}")
-            raise HTTPException(status_code=500, detail=f"Inference failed: {str(e)}")
+@app.post("/api/models/{name}/shadow")
+async def shadow_model(name: str):
+    """
+    Run a model version next to the active one on the live stream and compare forecasts.
+    """
+    try:
+        await asyncio.to_thread(registry.set_shadow, name)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return registry.status()
+
+@app.delete("/api/models/shadow")
+async def stop_shadow_model():
+    """
+    Stop running the shadow version.
+    """
+    await asyncio.to_thread(registry.set_shadow, None)
+    return registry.status()
+
+@app.post("/api/upload", status_code=202)
+async def upload_file(file: UploadFile = File(...), partition: Optional[str] = Query(None, min_length=1)):
+    """
+    Handle file upload (csv, parquet, json, jsonl) and queue it for inference.
+    With `partition` (e.g. service, host or route), every value of that column is
+    forecast as its own series and written with a 'series' tag.
+    Returns a job id right away; progress and results are served by /api/jobs/{job_id}.
+    """
+    filename = file.filename
+
+    if not filename.lower().endswith(SUPPORTED_FORMATS):
+        raise HTTPException(status_code=400, detail="Unsupported file format")
+
+    try:
+        job = await job_manager.submit(file.file, filename, partition)
+    except Exception as e:
+        logger.error(f"Upload failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    logger.info(f"Queued {filename} as job {job.id}")
+    return {
+        "status": "queued",
+        "job_id": job.id,
+        "filename": filename,
+        "partition": partition,
+    }
+
+@app.post("/api/upload/batch", status_code=202)
+async def upload_batch(files: List[UploadFile] = File(...), partition: Optional[str] = Query(None, min_length=1),
+                       name: Optional[str] = Query(None, min_length=1)):
+    """
+    Upload several log files, or tar / zip archives and .gz / .zst compressed logs, as
+    one job. The log files in them are parsed and counted in parallel worker processes,
+    their per-minute counts summed (a minute split across two files counts in full), and
+    the combined series is predicted once and written under `name`.
+    Returns a job id right away, like /api/upload.
+    """
+    unsupported = [f.filename for f in files if not archives.is_supported(f.filename)]
+    if unsupported:
+        raise HTTPException(status_code=400, detail=f"Unsupported file format: {', '.join(unsupported)}")
+
+    try:
+        job = await job_manager.submit_batch([(f.file, f.filename) for f in files], partition, name)
+    except Exception as e:
+        logger.error(f"Batch upload failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    logger.info(f"Queued {len(files)} files as job {job.id}")
+    return {
+        "status": "queued",
+        "job_id": job.id,
+        "filename": job.filename,
+        "files": [f.filename for f in files],
+        "partition": partition,
+    }
+
+@app.get("/api/jobs")
+async def list_jobs():
+    """
+    List queued, running and recently finished upload jobs.
+    """
+    return {
+        "queue_depth": job_manager.queue_depth,
+        "jobs": [job.to_dict(include_result=False) for job in reversed(job_manager.jobs.values())],
+    }
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Progress of an upload job, with the inference result once it has succeeded.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job.to_dict()
+
+def _serialize_point(point: Optional[dict]) -> Optional[dict]:
+    # Frontend expects a 'time' string, like the /api/history records
+    if point is None:
+        return None
+    values = {k: v for k, v in point.items() if k != "timestamp"}
+    return {"time": point["timestamp"].isoformat(), **values}
+
+class StepRequest(BaseModel):
+    timestamp: str
+    request_rate: float
+
+@app.post("/api/stream/step")
+async def stream_step(step: StepRequest):
+    """
+    Ingest the request_rate of one new window and return the prediction for the next one.
+    """
+    if stream_estimator is None:
+        raise HTTPException(status_code=503, detail=f"Models are not loaded ({registry.state})")
+
+    try:
+        result = stream_estimator.step(step.timestamp, step.request_rate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Streaming step failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Store results - needs to use result_df
+    if shadow_stream is not None:
+        # Same window through the shadow version; only compared, never returned
         try:
-            db.write_inference_results(result_df, filename) # <--- CHANGE
+            shadow = shadow_stream.step(step.timestamp, step.request_rate)
+            registry.compare(result["forecast"], shadow["forecast"])
         except Exception as e:
-            logger.error(f"Database write failed: {e}")
-            # We don't fail the request if DB write fails, but we log it.
-            # Alternatively, raise 500.
-
-        return {
-            "status": "success",
-            "filename": filename,
-            "rows_processed": predictions_count, # <--- CHANGE
-            "preview": result_df.head().to_dict(orient="records") # <--- CHANGE
-        }
-
-    except HTTPException as he:
-        raise he
+            logger.warning(f"Shadow streaming step failed: {e}")
+
+    # Push the completed window to the dashboards on the next tick
+    manager.publish(result["point"])
+    scaling.observe(result["point"])
+    scaling.decide(result["forecast"], stream_estimator.estimator.model_version)
+
+    return {
+        "point": _serialize_point(result["point"]),
+        "forecast": _serialize_point(result["forecast"]),
+    }
+
+@app.post("/api/stream/reset")
+async def stream_reset():
+    """
+    Drop the online feature state, e.g. before feeding a different series.
+    """
+    for stream in (stream_estimator, shadow_stream):
+        if stream is not None:
+            stream.reset()
+    scaling.reset()
+    return {"status": "success"}
+
+@app.get("/api/scaling")
+async def get_scaling(request: Request):
+    """
+    Current replica recommendation, for autoscalers polling it. The body is encoded once
+    per decision; send its ETag back as If-None-Match to get a 304 until the next one.
+    """
+    etag = f'"{scaling.sequence}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(scaling.current_json, media_type="application/json", headers=headers)
+
+@app.get("/api/scaling/status")
+async def scaling_status(limit: int = Query(60, ge=0, le=1000)):
+    """
+    Policy, the last `limit` decisions and how their capacity compared with the actual requests.
+    """
+    return scaling.status(limit)
+
+class ScalingPolicyUpdate(BaseModel):
+    replica_capacity: Optional[float] = None
+    headroom: Optional[float] = None
+    hysteresis: Optional[float] = None
+    min_replicas: Optional[int] = None
+    max_replicas: Optional[int] = None
+    max_step_up: Optional[int] = None
+    max_step_down: Optional[int] = None
+    up_cooldown: Optional[float] = None
+    down_stabilization: Optional[float] = None
+    lead_time: Optional[str] = None
+
+@app.get("/api/scaling/policy")
+async def get_scaling_policy():
+    return scaling.policy.to_dict()
+
+@app.put("/api/scaling/policy")
+async def update_scaling_policy(update: ScalingPolicyUpdate):
+    """
+    Change some policy settings; they apply from the next decision on.
+    """
+    try:
+        scaling.set_policy(scaling.policy.replace(**update.model_dump()))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return scaling.policy.to_dict()
+
+@app.post("/api/scaling/simulate")
+async def simulate_scaling(file: Optional[UploadFile] = File(None), range: Optional[str] = Query(None),
+                           series: Optional[str] = None, policy: Optional[str] = Form(None),
+                           points: int = Query(500, ge=10, le=10000)):
+    """
+    Run the scaling policy over a log file (or a stored InfluxDB range) and score it
+    against the actual requests, next to a reactive policy. `policy` is a JSON object
+    of settings that override the current policy for this run.
+    """
+    estimator = registry.active
+    if estimator is None:
+        raise HTTPException(status_code=503, detail=f"Models are not loaded ({registry.state})")
+    if (file is None) == (range is None):
+        raise HTTPException(status_code=400, detail="Give either a log file or a range to simulate")
+
+    try:
+        overrides = json.loads(policy) if policy else {}
+        if not isinstance(overrides, dict):
+            raise ValueError("policy must be a JSON object")
+        run_policy = scaling.policy.replace(**overrides)
+        if file is not None:
+            if not file.filename.lower().endswith(SUPPORTED_FORMATS):
+                raise HTTPException(status_code=400, detail="Unsupported file format")
+            rate_df = await asyncio.to_thread(stream_request_rate, file.file, file.filename, RPSEstimator.WINDOW)
+        else:
+            rate_df = await adb.get_request_rate(range, series)
+        if rate_df.empty:
+            raise ValueError("No requests to simulate")
+
+        def run():
+            return simulate(estimator.predict_rate(rate_df), run_policy, points)
+
+        return await asyncio.to_thread(run)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Upload failed: {e}")
+        logger.error(f"Scaling simulation failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/series")
+async def list_series(range: str = "-30d"):
+    """
+    Series written by partitioned uploads, for the `series` filter of /api/history.
+    """
+    try:
+        return {"series": await adb.list_series(range)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/api/history")
-async def get_history(range: str = "-1h"):
+async def get_history(range: str = "-1h", points: Optional[int] = Query(None, ge=10, le=10000),
+                      series: Optional[str] = None,
+                      format: str = Query("records", pattern="^(records|columnar|arrow)$"),
+                      raw: bool = False):
     """
-    Get historical data from InfluxDB.
+    Get historical data from InfluxDB, downsampled to about `points` points,
+    optionally only for one series of the partitioned uploads.
+    The response is streamed as it is read (see history_stream.py): format=columnar gives
+    epoch-ms time and value arrays, format=arrow an Arrow IPC stream. raw=true returns
+    every stored point of the range instead of the downsampled ones.
     """
     try:
-        data = db.get_history(range)
-        return data
+        body = history_stream.encode(format, await adb.history_frames(range, points, series, raw=raw))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(body, media_type=history_stream.MEDIA_TYPES[format])
 
-# WebSocket manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+# WebSocket push pipeline (see live.py)
+manager = ConnectionManager()
+replay_manager = ReplayManager(manager, adb)
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+@app.post("/api/replay", status_code=202)
+async def start_replay(file: Optional[UploadFile] = File(None), range: Optional[str] = Query(None),
+                       series: Optional[str] = None, speed: float = Query(60.0, ge=1, le=1000),
+                       write: bool = False):
+    """
+    Replay a log file (or a stored InfluxDB range) minute by minute through the
+    prediction path at `speed` times real time, publishing on /ws/live and, with
+    `write`, storing the results. Progress and the lag report are on /api/replay/{id}.
+    """
+    estimator = registry.active
+    if estimator is None:
+        raise HTTPException(status_code=503, detail=f"Models are not loaded ({registry.state})")
+    if (file is None) == (range is None):
+        raise HTTPException(status_code=400, detail="Give either a log file or a range to replay")
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+    try:
+        if file is not None:
+            if not file.filename.lower().endswith(SUPPORTED_FORMATS):
+                raise HTTPException(status_code=400, detail="Unsupported file format")
+            source = file.filename
+            rate_df = await asyncio.to_thread(stream_request_rate, file.file, file.filename, RPSEstimator.WINDOW)
+        else:
+            source = f"range {range}" + (f" series {series}" if series else "")
+            rate_df = await adb.get_request_rate(range, series)
+        session = replay_manager.start(rate_df, estimator, speed, source, write)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Replay failed to start: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                logger.error(f"Error sending to websocket: {e}")
-                # Connection might be dead, safely ignore or remove
+    return session.to_dict()
 
-manager = ConnectionManager()
+@app.get("/api/replay")
+async def list_replays():
+    """
+    Running and recently finished replays.
+    """
+    return {"replays": [s.to_dict() for s in reversed(replay_manager.sessions.values())]}
+
+@app.get("/api/replay/{replay_id}")
+async def get_replay(replay_id: str):
+    """
+    Progress and lag report of a replay.
+    """
+    session = replay_manager.get(replay_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Unknown replay {replay_id}")
+    return session.to_dict()
+
+@app.delete("/api/replay/{replay_id}")
+async def stop_replay(replay_id: str):
+    """
+    Stop a running replay.
+    """
+    session = replay_manager.stop(replay_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Unknown replay {replay_id}")
+    return session.to_dict()
+
+# Queue depths and cache state, read when /metrics is scraped
+metrics.REGISTRY.gauge("rps_jobs_queued", "Upload jobs waiting for a slot", fn=lambda: job_manager.queue_depth)
+metrics.REGISTRY.gauge("rps_jobs_running", "Upload jobs being processed",
+                       fn=lambda: sum(1 for job in job_manager.jobs.values() if job.status == "running"))
+metrics.REGISTRY.gauge("rps_ws_clients", "Connected /ws/live clients", fn=lambda: len(manager.active_connections))
+metrics.REGISTRY.gauge("rps_ws_pending_points", "Points waiting for the next live tick", fn=lambda: len(manager.pending))
+metrics.REGISTRY.gauge("rps_ws_queued_frames", "Frames queued across all live clients", fn=lambda: manager.queue_depth)
+metrics.REGISTRY.gauge("rps_ws_dropped_frames_total", "Frames dropped for slow live clients",
+                       fn=lambda: manager.stats()["dropped_frames"], type="counter")
+metrics.REGISTRY.gauge("rps_result_cache_entries", "Uploads held in the result cache",
+                       fn=lambda: len(job_manager.cache) if job_manager.cache is not None else 0)
+metrics.REGISTRY.gauge("rps_result_cache_hits_total", "Uploads answered entirely from the result cache",
+                       fn=lambda: job_manager.cache.hits if job_manager.cache is not None else 0, type="counter")
+metrics.REGISTRY.gauge("rps_result_cache_extensions_total", "Uploads that extended a cached series",
+                       fn=lambda: job_manager.cache.extensions if job_manager.cache is not None else 0, type="counter")
+metrics.REGISTRY.gauge("rps_models_ready", "1 once a model version is active", fn=lambda: int(registry.ready))
+metrics.REGISTRY.gauge("rps_wal_pending_segments", "Buffered writes not yet drained to InfluxDB",
+                       fn=lambda: len(db.wal.pending()) if db.wal is not None else 0)
+metrics.REGISTRY.gauge("rps_wal_pending_rows", "Buffered result rows not yet drained to InfluxDB",
+                       fn=lambda: db.wal.stats()["pending_rows"] if db.wal is not None else 0)
+metrics.REGISTRY.gauge("rps_influx_queries_in_flight", "InfluxDB queries running from the request handlers",
+                       fn=lambda: adb.in_flight)
+metrics.REGISTRY.gauge("rps_scaling_replicas", "Replicas currently recommended",
+                       fn=lambda: scaling.state.replicas or 0)
+metrics.REGISTRY.gauge("rps_scaling_subscribers", "Connected /ws/scaling clients", fn=lambda: scaling.subscribers)
+metrics.REGISTRY.gauge("rps_history_cache_hits_total", "History cache hits",
+                       fn=lambda: db.history_cache.hits, type="counter")
+metrics.REGISTRY.gauge("rps_history_cache_misses_total", "History cache misses",
+                       fn=lambda: db.history_cache.misses, type="counter")
+
+@app.get("/api/live/stats")
+async def live_stats():
+    """
+    Connected dashboard clients, queued/dropped frames of the live push pipeline.
+    """
+    return manager.stats()
 
 @app.websocket("/ws/live")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, format: str = "json"):
+    # format=msgpack switches to binary frames (needs the optional msgpack package)
+    await manager.connect(websocket, binary=(format == "msgpack"))
     try:
         while True:
-            # Keep connection alive
-            # In a real scenario, this would potentially stream real-time metric updates
-            # For now, we just listen for messages or send heartbeats
+            # Frames are pushed by the manager's sender task; reading here only
+            # detects the client going away
             await websocket.receive_text()
     except WebSocketDisconnect:
         manager.disconnect(websocket)
@@ -139,5 +541,32 @@ async def websocket_endpoint(websocket: WebSocket):
         logger.error(f"WebSocket error: {e}")
         manager.disconnect(websocket)
 
-# Background task to simulate live data (Optional, if we want to push data)
-# For this prototype, the frontend handles simulation logic, or we can push backend metrics here.
+@app.websocket("/ws/scaling")
+async def scaling_websocket(websocket: WebSocket):
+    # Sends the current recommendation, then every new one; a slow client only gets the latest
+    await websocket.accept()
+    queue = scaling.subscribe()
+    # Reading only detects the client going away
+    receiver = asyncio.create_task(websocket.receive_text())
+    sender = None
+    try:
+        await websocket.send_text(scaling.current_json)
+        while True:
+            sender = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                receiver.result()
+                receiver = asyncio.create_task(websocket.receive_text())
+            if sender in done:
+                await websocket.send_text(sender.result())
+            else:
+                sender.cancel()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Scaling WebSocket error: {e}")
+    finally:
+        scaling.unsubscribe(queue)
+        for task in (sender, receiver):
+            if task is not None:
+                task.cancel()
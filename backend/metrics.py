@@ -0,0 +1,330 @@
+"""
+In-process metrics in the Prometheus text format, served on /metrics.
+
+Stage timings go through timed()/observe_stage(): one histogram observation and a
+rows counter per call, so it is cheap enough to leave on. Upload jobs run in worker
+processes; their observations are captured there with capture() and replayed into
+the API process with record().
+"""
+import bisect
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as _Tally, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond model calls to minute-long uploads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Requests slower than this are profiled (0 disables the profiler)
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+# Share of requests that get a sampler attached, so the profiler costs nothing on most requests
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.05"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    """A gauge that is either set directly or read from a callback at scrape time."""
+
+    type = "gauge"
+
+    def __init__(self, name, help, labelnames=(), fn: Callable[[], float] = None, type: str = None):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self.fn = fn
+        if type:
+            self.type = type
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        if self.fn is not None:
+            try:
+                return [f"{self.name} {_format_value(self.fn())}"]
+            except Exception as e:
+                logger.debug(f"Metric callback {self.name} failed: {e}")
+                return []
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), fn=None, type=None) -> Gauge:
+        return self._register(Gauge(name, help, labelnames, fn, type))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "rps_stage_duration_seconds", "Time spent per pipeline stage", ["stage"])
+STAGE_ROWS = REGISTRY.counter(
+    "rps_stage_rows_total", "Rows processed per pipeline stage", ["stage"])
+STAGE_ROWS_PER_SEC = REGISTRY.gauge(
+    "rps_stage_rows_per_second", "Throughput of the last call of each stage", ["stage"])
+HTTP_SECONDS = REGISTRY.histogram(
+    "rps_http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"])
+SLOW_REQUESTS = REGISTRY.counter(
+    "rps_http_slow_requests_total", "Requests over PROFILE_SLOW_MS", ["route"])
+
+# Observations made while a capture() is active in this thread
+_local = threading.local()
+
+
+def observe_stage(stage: str, seconds: float, rows: Optional[int] = None):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if rows is not None:
+        STAGE_ROWS.inc(rows, stage=stage)
+        if seconds > 0:
+            STAGE_ROWS_PER_SEC.set(rows / seconds, stage=stage)
+
+    captured = getattr(_local, "captured", None)
+    if captured is not None:
+        captured.append((stage, seconds, rows))
+
+
+class _StageTimer:
+    __slots__ = ("rows",)
+
+    def __init__(self, rows):
+        self.rows = rows
+
+
+@contextmanager
+def timed(stage: str, rows: Optional[int] = None):
+    """
+    Time the block as `stage`. The row count can be given up front or set on the
+    yielded object once it is known (`with timed("parse") as t: ...; t.rows = n`).
+    """
+    timer = _StageTimer(rows)
+    started = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        observe_stage(stage, time.perf_counter() - started, timer.rows)
+
+
+@contextmanager
+def capture():
+    """Collect the stage observations of this thread, e.g. inside a worker process."""
+    previous = getattr(_local, "captured", None)
+    _local.captured = observations = []
+    try:
+        yield observations
+    finally:
+        _local.captured = previous
+
+
+def record(observations: List[tuple]):
+    """Replay observations captured in another process."""
+    for stage, seconds, rows in observations:
+        observe_stage(stage, seconds, rows)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+class SlowRequestProfiler:
+    """
+    Sampling profiler for slow requests. A sampled request gets a background thread
+    that records the stacks of all other threads every `interval_ms`; if the request
+    ends up slower than `threshold_ms` the hottest stacks are logged. Requests that
+    aren't sampled only pay for one random() call.
+    """
+
+    def __init__(self, threshold_ms: float = PROFILE_SLOW_MS, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 interval_ms: float = PROFILE_INTERVAL_MS, top: int = 5, keep: int = 20):
+        self.threshold = threshold_ms / 1000
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.top = top
+        self.recent = deque(maxlen=keep)
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0 and self.sample_rate > 0
+
+    def start(self) -> Optional["_Sampler"]:
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        sampler = _Sampler(self.interval)
+        sampler.start()
+        return sampler
+
+    def finish(self, sampler: Optional["_Sampler"], route: str, seconds: float):
+        if seconds >= self.threshold > 0:
+            SLOW_REQUESTS.inc(route=route)
+        if sampler is None:
+            return
+        sampler.stop()
+        if seconds < self.threshold or not sampler.samples:
+            return
+
+        report = {
+            "route": route,
+            "seconds": round(seconds, 4),
+            "samples": sampler.total,
+            "top": [{"count": n, "stack": stack} for stack, n in sampler.samples.most_common(self.top)],
+        }
+        self.recent.append(report)
+        hottest = "\n".join(f"  {item['count']}/{sampler.total} samples in\n{item['stack']}" for item in report["top"])
+        logger.warning(f"Slow request {route} took {seconds * 1000:.0f}ms, hottest stacks:\n{hottest}")
+
+
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, interval: float):
+        super().__init__(daemon=True, name="slow-request-sampler")
+        self.interval = interval
+        self.samples = _Tally()
+        self.total = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                # Skip this thread and threads parked in a wait / select (idle pool workers, the idle loop)
+                if thread_id == me or frame.f_code.co_filename.endswith(_IDLE_FILES):
+                    continue
+                stack = "".join(traceback.format_list(traceback.extract_stack(frame, limit=8)))
+                self.samples[stack] += 1
+                self.total += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join(timeout=1)
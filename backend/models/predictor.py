@@ -1,26 +1,92 @@
 import pandas as pd
 import numpy as np
+import ast
+import glob
+import hashlib
 import logging
 import joblib
 import os
 import sys
 
+import metrics
+from ingest import count_requests
+from models.tree_engine import compile_models
+
 # Define dummy class to satisfy pickle
 class InferenceModel:
     def predict(self, X):
         return self.model.predict(X)
 
 # Inject into __main__ so pickle can find it
-import __main__
-if not hasattr(__main__, "InferenceModel"):
-    setattr(__main__, "InferenceModel", InferenceModel)
+def _inject_pickle_shim():
+    # Looked up on every load: multiprocessing's spawn replaces sys.modules['__main__']
+    # after this module may already have been imported
+    main_module = sys.modules["__main__"]
+    if not hasattr(main_module, "InferenceModel"):
+        setattr(main_module, "InferenceModel", InferenceModel)
+
+_inject_pickle_shim()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# "compiled" evaluates both boosters with the vectorized tree engine, "lightgbm" uses their predict()
+PREDICT_ENGINE = os.getenv("PREDICT_ENGINE", "lightgbm").lower()
+# Batches larger than this still go through LightGBM, whose C++ loop wins on big inputs (0 = no limit)
+COMPILED_ENGINE_MAX_ROWS = int(os.getenv("COMPILED_ENGINE_MAX_ROWS", "128"))
+# Forecast horizons served next to model1/model2, each backed by an inference_model_<horizon>.pkl
+FORECAST_HORIZONS = [h.strip() for h in os.getenv("FORECAST_HORIZONS", "1min,5min,15min").split(",") if h.strip()]
+
+
+class NotEnoughData(ValueError):
+    """The input can't be predicted as it is (too few windows for the features, no model)."""
+
+
+def horizon_column(horizon: str) -> str:
+    return f"pred_{horizon}"
+
+
+def _find_horizon_models(models_dir: str, horizons) -> dict:
+    """
+    Map each horizon to the pickle that serves it. Files are named
+    'inference_model_<horizon>.pkl', or bundle several horizons in one model
+    as "inference_model_['1min', '5min', '15min'].pkl".
+    """
+    paths = {}
+    prefix = os.path.join(models_dir, "inference_model_")
+    for path in sorted(glob.glob(glob.escape(prefix) + "*.pkl")):
+        suffix = path[len(prefix):-len(".pkl")]
+        try:
+            covered = ast.literal_eval(suffix) if suffix.startswith("[") else [suffix]
+        except (ValueError, SyntaxError):
+            logger.warning(f"Ignoring model file with unreadable horizon list: {path}")
+            continue
+        for horizon in covered:
+            # A dedicated per-horizon file wins over a bundle
+            if horizon in horizons and (horizon not in paths or not suffix.startswith("[")):
+                paths[horizon] = path
+    return paths
+
+def _model_version(paths, horizons) -> str:
+    """Short digest of the model files (and served horizons); changes whenever the predictions can."""
+    digest = hashlib.sha256(",".join(horizons).encode())
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()[:16]
+
 class RPSEstimator:
-    WINDOW = "60S" # 1 minute, as defined in the notebook
+    WINDOW = "60s" # 1 minute, as defined in the notebook (lowercase unit, "S" is rejected by pandas 3)
+
+    # Feature engineering parameters (match model_artifact.pkl)
+    EWMA_SLOW_ALPHA = 0.02
+    EWMA_FAST_ALPHA = 0.15
+    BASELINE_WEIGHT = (0.7, 0.3)
+    LAGS = [1, 2, 3, 5]
+    ROLL_WINDOWS = [3, 5]
 
     def __init__(self, models_dir: str = "models"):
         """
@@ -30,12 +96,19 @@ class RPSEstimator:
         self.base_model = None
         self.residual_model = None
         self.feature_names = [] # To store expected feature names from the model
+        self.engine = None # Optional CompiledEnsemble over [base, residual, *horizon models]
+        self.horizons = [] # Horizons with a loaded model, in FORECAST_HORIZONS order
+        self.horizon_models = [] # Distinct horizon models, each evaluated once
+        self.horizon_index = {} # horizon -> index into horizon_models
+        self.model_version = None # Digest of the loaded model files, see _model_version
         
         base_path = os.path.join(models_dir, "inference_model.pkl")
         residual_path = os.path.join(models_dir, "lgbm_residual_model.pkl")
         artifact_path = os.path.join(models_dir, "model_artifact.pkl") # New artifact path
 
         try:
+            _inject_pickle_shim()
+
             # Try to load feature names from model_artifact.pkl first
             if os.path.exists(artifact_path):
                 artifact = joblib.load(artifact_path)
@@ -77,6 +150,25 @@ class RPSEstimator:
                 logger.info(f"Loaded residual model from {residual_path}")
             else:
                 logger.warning(f"Residual model not found at {residual_path}")
+
+            # Multi-horizon models; a pickle bundling several horizons is loaded only once
+            loaded = {}
+            for horizon, path in _find_horizon_models(models_dir, FORECAST_HORIZONS).items():
+                if path not in loaded:
+                    loaded[path] = len(self.horizon_models)
+                    self.horizon_models.append(joblib.load(path))
+                    logger.info(f"Loaded horizon model from {path}")
+                self.horizon_index[horizon] = loaded[path]
+            self.horizons = [h for h in FORECAST_HORIZONS if h in self.horizon_index]
+
+            self.model_version = _model_version(
+                [base_path, residual_path] + sorted(set(_find_horizon_models(models_dir, self.horizons).values())),
+                self.horizons,
+            )
+
+            if PREDICT_ENGINE == "compiled" and self.base_model is not None:
+                models = [self.base_model] + ([self.residual_model] if self.residual_model is not None else [])
+                self.engine = compile_models(models + self.horizon_models)
                 
         except Exception as e:
             logger.error(f"Failed to load models or feature names: {e}")
@@ -86,20 +178,24 @@ class RPSEstimator:
         Build request_rate from raw log data.
         Requires 'timestamp' column.
         """
-        df_raw = df.copy()
-        if 'timestamp' not in df_raw.columns:
+        if 'timestamp' not in df.columns:
             raise ValueError("Input DataFrame must contain a 'timestamp' column for request rate calculation.")
-        
-        df_raw['timestamp'] = pd.to_datetime(df_raw['timestamp'])
-
-        rate_df = (
-            df_raw
-            .set_index("timestamp")
-            .resample(window)
-            .size()
-            .rename("request_rate")
-            .reset_index()
-        )
+
+        with metrics.timed("resample", len(df)):
+            if pd.Timedelta("1D") % pd.Timedelta(window) == pd.Timedelta(0):
+                # Integer bucket counting on epoch nanoseconds, same bins as resample() here
+                return count_requests(df['timestamp'], window)
+
+            # Only the timestamps are needed, so avoid copying the whole log frame
+            timestamps = pd.to_datetime(df['timestamp'])
+
+            rate_df = (
+                pd.Series(1, index=pd.DatetimeIndex(timestamps, name="timestamp"))
+                .resample(window)
+                .size()
+                .rename("request_rate")
+                .reset_index()
+            )
         return rate_df
 
     def _build_baseline(self, rate_df: pd.DataFrame) -> pd.DataFrame:
@@ -111,13 +207,14 @@ class RPSEstimator:
         y = df["request_rate"]
 
         # EWMA slow (long memory)
-        df["ewma_slow"] = y.shift(1).ewm(alpha=0.02, adjust=False).mean()
+        df["ewma_slow"] = y.shift(1).ewm(alpha=self.EWMA_SLOW_ALPHA, adjust=False).mean()
 
         # EWMA fast (medium memory)
-        df["ewma_fast"] = y.shift(1).ewm(alpha=0.15, adjust=False).mean()
+        df["ewma_fast"] = y.shift(1).ewm(alpha=self.EWMA_FAST_ALPHA, adjust=False).mean()
 
         # Combined baseline
-        df["baseline"] = 0.7 * df["ewma_slow"] + 0.3 * df["ewma_fast"]
+        slow_weight, fast_weight = self.BASELINE_WEIGHT
+        df["baseline"] = slow_weight * df["ewma_slow"] + fast_weight * df["ewma_fast"]
 
         # Residual
         df["residual"] = y - df["baseline"]
@@ -128,16 +225,29 @@ class RPSEstimator:
         """
         Build all the features required by the model from the baseline DataFrame.
         """
+        with metrics.timed("feature_build", len(rate_df)):
+            return self._build_feature_frame(rate_df)
+
+    def _build_series_features(self, rate_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        _build_feature for every series of a partitioned frame, stacked in series order.
+        EWMAs, lags and rolling windows never cross from one series into the next.
+        """
+        frames = [self._build_feature(group) for _, group in rate_df.groupby("series", sort=False)]
+        if not frames:
+            return self._build_feature(rate_df)
+        return pd.concat(frames, ignore_index=True)
+
+    def _build_feature_frame(self, rate_df: pd.DataFrame) -> pd.DataFrame:
         df = self._build_baseline(rate_df)
         r = df["residual"]
 
         # Short-term memory only
-        lags = [1, 2, 3, 5]
-        for lag in lags:
+        for lag in self.LAGS:
             df[f"lag_{lag}"] = r.shift(lag)
 
         # Volatility & local range
-        for win in [3, 5]:
+        for win in self.ROLL_WINDOWS:
             df[f"roll_std_{win}"] = r.shift(1).rolling(win).std()
             df[f"roll_max_{win}"] = r.shift(1).rolling(win).max()
             df[f"roll_min_{win}"] = r.shift(1).rolling(win).min()
@@ -159,6 +269,11 @@ class RPSEstimator:
 
         return df
 
+    @property
+    def min_windows(self) -> int:
+        """Windows before the first one with every feature: one to seed the baseline, then a residual per lag."""
+        return max(self.LAGS + self.ROLL_WINDOWS + [3]) + 2
+
     def predict(self, df: pd.DataFrame) -> np.ndarray:
         """
         Predict RPS based on the input DataFrame after performing feature engineering.
@@ -171,18 +286,40 @@ class RPSEstimator:
 
             # Step 1: Build request rate
             rate_df = self._build_request_rate(df)
-            logger.info(f"DataFrame after building request rate: {rate_df.shape} columns: {rate_df.columns.tolist()}")
+            logger.debug(f"DataFrame after building request rate: {rate_df.shape} columns: {rate_df.columns.tolist()}")
+        except Exception as e:
+            raise self._prediction_error(e)
+
+        return self.predict_rate(rate_df)
+
+    def predict_rate(self, rate_df: pd.DataFrame, start=None) -> pd.DataFrame:
+        """
+        Predict RPS from an already aggregated 'timestamp' / 'request_rate' frame,
+        e.g. the output of _build_request_rate or ingest.stream_request_rate.
+        With `start`, features still use the whole frame as history but only the
+        windows from `start` on are predicted and returned.
+        A partitioned frame (leading 'series' column) gets features per series and
+        all series go through the models in one batch; 'series' is kept in the output.
+        """
+        try:
+            if self.base_model is None:
+                raise NotEnoughData("No base model is loaded, can't predict")
 
             # Step 2: Build all features
-            engineered_df = self._build_feature(rate_df)
-            logger.info(f"DataFrame after feature engineering: {engineered_df.shape} columns: {engineered_df.columns.tolist()}")
+            if "series" in rate_df.columns:
+                engineered_df = self._build_series_features(rate_df)
+            else:
+                engineered_df = self._build_feature(rate_df)
+            if start is not None:
+                engineered_df = engineered_df[engineered_df["timestamp"] >= start].reset_index(drop=True)
+            logger.debug(f"DataFrame after feature engineering: {engineered_df.shape} columns: {engineered_df.columns.tolist()}")
 
             # Ensure engineered features match model's expected features
             if not self.feature_names:
                 # If feature names couldn't be loaded, try to infer from engineered_df
                 # This is a fallback and might not be reliable if engineered_df has extra columns
                 logger.warning("Model feature names not explicitly available. Using all engineered features for prediction.")
-                X = engineered_df.drop(columns=[col for col in engineered_df.columns if col in ["timestamp", "request_rate", "baseline", "residual"]], errors='ignore')
+                X = engineered_df.drop(columns=[col for col in engineered_df.columns if col in ["series", "timestamp", "request_rate", "baseline", "residual"]], errors='ignore')
                 self.feature_names = X.columns.tolist() # Update for logging if needed
             else:
                 # Select and reorder features to match the model's expected feature names
@@ -195,30 +332,16 @@ class RPSEstimator:
                 X = engineered_df[self.feature_names]
 
             if X.empty:
-                logger.warning("Engineered feature DataFrame is empty after processing. Cannot make predictions.")
-                return np.zeros(len(df)) # Return zeros or handle as appropriate
+                raise NotEnoughData(f"Too few windows to predict ({len(rate_df)}): the features need "
+                                    f"at least {self.min_windows} windows")
 
-            logger.info(f"Features passed to model ({X.shape[1]}): {X.columns.tolist()}")
+            logger.debug(f"Features passed to model ({X.shape[1]}): {X.columns.tolist()}")
             if X.shape[1] != len(self.feature_names) and self.feature_names:
                  raise ValueError(f"Mismatch in feature count. Expected {len(self.feature_names)}, got {X.shape[1]}. Expected: {self.feature_names}, Got: {X.columns.tolist()}")
 
 
-            # Base Prediction
-            base_pred = self.base_model.predict(X)
-            
-            # Residual Prediction (if available)
-            residual_pred_values = np.zeros(len(engineered_df)) # Initialize with zeros, length of engineered_df
-            if self.residual_model:
-                try:
-                    residual_pred_values = self.residual_model.predict(X)
-                except Exception as e:
-                    logger.warning(f"Residual prediction failed, ignoring: {e}")
-            
-            final_pred = base_pred + residual_pred_values
-            
-            # Ensure no negative values if RPS shouldn't be negative
-            final_pred = np.maximum(final_pred, 0)
-            
+            final_pred, base_pred, horizon_preds = self._predict_models(X)
+
             # The 'final_pred' corresponds to the 'engineered_df' after dropping NaNs.
             # We need to align these predictions back to the original 'df' if necessary,
             # but for now, we'll assume 'df' is processed into 'engineered_df' directly.
@@ -231,18 +354,72 @@ class RPSEstimator:
             # The 'request_rate' generated by _build_request_rate is the actual measurement for that time window.
             engineered_df['actual'] = engineered_df['request_rate'] # Use request_rate as actual for the time window
 
+            # Multi-horizon forecasts issued from the same feature row
+            horizon_columns = []
+            for horizon in self.horizons:
+                engineered_df[horizon_column(horizon)] = horizon_preds[:, self.horizon_index[horizon]]
+                horizon_columns.append(horizon_column(horizon))
+
             # Return the DataFrame with features and predictions, only selecting columns needed for the frontend.
-            return engineered_df[['timestamp', 'actual', 'model1', 'model2']]
+            key_columns = ['series'] if 'series' in engineered_df.columns else []
+            return engineered_df[key_columns + ['timestamp', 'actual', 'model1', 'model2'] + horizon_columns]
 
+        except NotEnoughData:
+            raise
         except Exception as e:
-            msg = f"Prediction error: {str(e)}"
-            
-            # Attempt to append expected features to the error message for debugging
-            if self.feature_names:
-                msg += f" || EXPECTED FEATURES ({len(self.feature_names)}): {self.feature_names}"
-            else:
-                msg += " || Expected features could not be determined from the model."
+            raise self._prediction_error(e)
+
+    def _predict_models(self, X: pd.DataFrame):
+        """
+        Run the base, residual and horizon models on one shared feature matrix.
+        Returns (final_pred, base_pred, horizon_preds) where horizon_preds has one
+        column per entry of self.horizon_models.
+        """
+        if self.engine is not None and (COMPILED_ENGINE_MAX_ROWS <= 0 or len(X) <= COMPILED_ENGINE_MAX_ROWS):
+            # Every model in a single pass over a contiguous matrix
+            with metrics.timed("predict_compiled", len(X)):
+                out = self.engine.predict(np.asarray(X, dtype=np.float64))
+            base_pred = out[:, 0]
+            has_residual = self.residual_model is not None
+            residual_pred_values = out[:, 1] if has_residual else np.zeros(len(X))
+            horizon_preds = np.maximum(out[:, 1 + has_residual:], 0)
+            return np.maximum(base_pred + residual_pred_values, 0), base_pred, horizon_preds
+
+        # Base Prediction
+        with metrics.timed("predict_base", len(X)):
+            base_pred = self.base_model.predict(X)
+
+        # Residual Prediction (if available)
+        residual_pred_values = np.zeros(len(X)) # Initialize with zeros, length of X
+        if self.residual_model:
+            try:
+                with metrics.timed("predict_residual", len(X)):
+                    residual_pred_values = self.residual_model.predict(X)
+            except Exception as e:
+                logger.warning(f"Residual prediction failed, ignoring: {e}")
+
+        final_pred = base_pred + residual_pred_values
+
+        # Ensure no negative values if RPS shouldn't be negative
+        final_pred = np.maximum(final_pred, 0)
+
+        # Horizon forecasts stacked into one (rows, models) array
+        horizon_preds = np.empty((len(X), len(self.horizon_models)))
+        with metrics.timed("predict_horizons", len(X)):
+            for i, model in enumerate(self.horizon_models):
+                horizon_preds[:, i] = np.maximum(model.predict(X), 0)
+
+        return final_pred, base_pred, horizon_preds
+
+    def _prediction_error(self, e: Exception) -> Exception:
+        msg = f"Prediction error: {str(e)}"
+
+        # Attempt to append expected features to the error message for debugging
+        if self.feature_names:
+            msg += f" || EXPECTED FEATURES ({len(self.feature_names)}): {self.feature_names}"
+        else:
+            msg += " || Expected features could not be determined from the model."
 
-            logger.error(msg)
-            raise Exception(msg)
+        logger.error(msg)
+        return Exception(msg)
 
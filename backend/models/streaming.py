@@ -0,0 +1,188 @@
+import copy
+import logging
+import os
+from collections import deque
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from models.predictor import RPSEstimator, horizon_column
+
+logger = logging.getLogger(__name__)
+
+# Longest run of empty windows filled with zeros; after a longer gap the stream starts over
+STREAM_MAX_GAP_WINDOWS = int(os.getenv("STREAM_MAX_GAP_WINDOWS", "1440"))
+
+
+class OnlineFeatureState:
+    """
+    Incremental version of RPSEstimator._build_feature for a single request_rate series.
+
+    Keeps the two EWMA accumulators and a fixed-size ring buffer of recent residuals,
+    so each new value is folded in and the next feature row is produced in constant time.
+    The features match the batch pipeline row for the following window.
+    """
+
+    def __init__(self, estimator: RPSEstimator):
+        self.slow_alpha = estimator.EWMA_SLOW_ALPHA
+        self.fast_alpha = estimator.EWMA_FAST_ALPHA
+        self.slow_weight, self.fast_weight = estimator.BASELINE_WEIGHT
+        self.lags = list(estimator.LAGS)
+        self.roll_windows = list(estimator.ROLL_WINDOWS)
+
+        # diff_2 looks back 3 residuals, the lags and rolling windows as far as they are configured
+        self.history = max(self.lags + self.roll_windows + [3])
+        self.reset()
+
+    def reset(self):
+        self.ewma_slow = None
+        self.ewma_fast = None
+        self.residuals = deque(maxlen=self.history)
+        self.count = 0
+
+    @property
+    def baseline(self) -> Optional[float]:
+        """Baseline for the next window (EWMAs only include values up to the last one ingested)."""
+        if self.ewma_slow is None:
+            return None
+        return self.slow_weight * self.ewma_slow + self.fast_weight * self.ewma_fast
+
+    def update(self, request_rate: float):
+        """Fold in the request_rate of the next window."""
+        y = float(request_rate)
+
+        # Residual against the baseline forecast for this window (undefined for the first value)
+        baseline = self.baseline
+        if baseline is not None:
+            self.residuals.append(y - baseline)
+
+        # EWMA with adjust=False, seeded with the first value
+        if self.ewma_slow is None:
+            self.ewma_slow = y
+            self.ewma_fast = y
+        else:
+            self.ewma_slow = (1 - self.slow_alpha) * self.ewma_slow + self.slow_alpha * y
+            self.ewma_fast = (1 - self.fast_alpha) * self.ewma_fast + self.fast_alpha * y
+
+        self.count += 1
+
+    @property
+    def ready(self) -> bool:
+        return len(self.residuals) == self.history
+
+    def features(self) -> Optional[dict]:
+        """
+        Feature row for the next (not yet observed) window, in the same column order
+        as _build_feature. Returns None while the state is still warming up.
+        """
+        if not self.ready:
+            return None
+
+        # r[-1] is the most recent residual, i.e. r.shift(1) in the batch pipeline
+        r = np.fromiter(self.residuals, dtype=np.float64, count=self.history)
+
+        row = {"ewma_slow": self.ewma_slow, "ewma_fast": self.ewma_fast}
+        for lag in self.lags:
+            row[f"lag_{lag}"] = r[-lag]
+
+        for win in self.roll_windows:
+            window = r[-win:]
+            row[f"roll_std_{win}"] = window.std(ddof=1)
+            row[f"roll_max_{win}"] = window.max()
+            row[f"roll_min_{win}"] = window.min()
+
+        row["diff_1"] = r[-1] - r[-2]
+        row["diff_2"] = r[-1] - r[-3]
+        row["acceleration"] = row["diff_1"] - row["diff_2"]
+        row["abs_diff_1"] = abs(row["diff_1"])
+        row["burst_strength"] = row["abs_diff_1"] / (row["roll_std_3"] + 1e-5)
+        row["range_expand"] = row["roll_max_5"] - row["roll_min_5"]
+
+        return row
+
+
+class StreamingRPSEstimator:
+    """
+    Stateful one-window-at-a-time front end for RPSEstimator.
+
+    step() takes the request_rate of the latest window and returns the point for that
+    window (identical to the batch predict_rate row) plus the forecast for the next one.
+    """
+
+    def __init__(self, estimator: RPSEstimator, window: str = RPSEstimator.WINDOW):
+        self.estimator = estimator
+        self.window = pd.Timedelta(window)
+        self.state = OnlineFeatureState(estimator)
+        self.last_timestamp = None
+        self.pending_forecast = None
+
+    def reset(self):
+        self.state.reset()
+        self.last_timestamp = None
+        self.pending_forecast = None
+
+    def use_estimator(self, estimator: RPSEstimator):
+        """Forecast with another estimator from the next window on; the online state carries over."""
+        self.estimator = estimator
+
+    def fork(self, estimator: RPSEstimator) -> "StreamingRPSEstimator":
+        """Copy of this stream, same online state, forecasting with another estimator."""
+        forked = StreamingRPSEstimator(estimator, self.window)
+        forked.state = copy.deepcopy(self.state)
+        forked.last_timestamp = self.last_timestamp
+        if self.last_timestamp is not None:
+            forked.pending_forecast = forked._forecast(self.last_timestamp + self.window)
+        return forked
+
+    def step(self, timestamp, request_rate: float) -> dict:
+        timestamp = pd.Timestamp(timestamp).floor(self.window)
+
+        if self.last_timestamp is not None:
+            if timestamp <= self.last_timestamp:
+                raise ValueError(f"Timestamp {timestamp} is not after the last ingested window {self.last_timestamp}")
+
+            # Windows without requests count as zero, exactly like resample().size(); only
+            # the state moves through them, the last one's forecast is the only one needed
+            gap = (timestamp - self.last_timestamp) // self.window - 1
+            if gap > STREAM_MAX_GAP_WINDOWS:
+                logger.warning(f"{gap} empty windows before {timestamp}, restarting the stream")
+                self.reset()
+            elif gap > 0:
+                for _ in range(gap):
+                    self.state.update(0)
+                self.last_timestamp = timestamp - self.window
+                self.pending_forecast = self._forecast(timestamp)
+
+        point = self._ingest(timestamp, request_rate)
+        return {"point": point, "forecast": self.pending_forecast}
+
+    def _ingest(self, timestamp: pd.Timestamp, request_rate: float) -> dict:
+        # The forecast made one window ago is this window's prediction, like in the batch output
+        forecast = self.pending_forecast or {}
+        point = {"timestamp": timestamp, "actual": request_rate, "model1": None, "model2": None}
+        point.update({k: v for k, v in forecast.items() if k != "timestamp"})
+
+        self.state.update(request_rate)
+        self.last_timestamp = timestamp
+        self.pending_forecast = self._forecast(timestamp + self.window)
+        return point
+
+    def _forecast(self, timestamp: pd.Timestamp) -> Optional[dict]:
+        # Read once, so a concurrent use_estimator() can't mix two model versions in one forecast
+        estimator = self.estimator
+        if estimator.base_model is None:
+            return None
+
+        row = self.state.features()
+        if row is None:
+            return None
+
+        feature_names = estimator.feature_names or list(row)
+        X = pd.DataFrame([[row[f] for f in feature_names]], columns=feature_names)
+        final_pred, base_pred, horizon_preds = estimator._predict_models(X)
+
+        forecast = {"timestamp": timestamp, "model1": float(final_pred[0]), "model2": float(base_pred[0])}
+        for horizon in estimator.horizons:
+            forecast[horizon_column(horizon)] = float(horizon_preds[0, estimator.horizon_index[horizon]])
+        return forecast
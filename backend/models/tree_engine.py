@@ -0,0 +1,243 @@
+"""
+Vectorized evaluator for the LightGBM tree ensembles used by RPSEstimator.
+
+The trees of every booster are exported once into flat NumPy node arrays (feature,
+threshold, children, leaf value), and all boosters are evaluated together in one
+pass over a contiguous float64 matrix. This avoids the per-call pandas validation
+and conversion of LGBMRegressor.predict, which dominates on small live batches.
+
+    python -m models.tree_engine      # parity check and latency benchmark on the bundled models
+"""
+import logging
+import time
+from typing import List, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Objectives whose raw score is the prediction, and those predicting exp(raw score)
+IDENTITY_OBJECTIVES = ("regression", "regression_l1", "huber", "fair", "quantile", "mape")
+EXP_OBJECTIVES = ("poisson", "gamma", "tweedie")
+
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+_MISSING_TYPES = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+# LightGBM's kZeroThreshold: values this close to 0 count as zero for missing_type "Zero"
+_ZERO_THRESHOLD = 1e-35
+
+
+class UnsupportedModelError(ValueError):
+    """The booster uses a feature the compiled evaluator doesn't implement."""
+
+
+def _booster_of(model):
+    """Unwrap InferenceModel / LGBMRegressor down to the lightgbm Booster."""
+    model = getattr(model, "model", model)
+    return getattr(model, "booster_", model)
+
+
+class CompiledEnsemble:
+    """
+    Several LightGBM boosters flattened into shared node arrays.
+    predict(X) returns one column per booster, in the order they were given.
+    """
+
+    def __init__(self, boosters: Sequence, block_rows: int = 512):
+        self.block_rows = block_rows
+        self.num_outputs = len(boosters)
+
+        features, thresholds, lefts, rights = [], [], [], []
+        default_left, missing, values = [], [], []
+        roots, tree_output, transforms = [], [], []
+        self.num_features = None
+        self.max_depth = 0
+
+        for output, booster in enumerate(boosters):
+            dump = _booster_of(booster).dump_model()
+            self._check_supported(dump)
+
+            num_features = dump["max_feature_idx"] + 1
+            if self.num_features is not None and num_features != self.num_features:
+                raise UnsupportedModelError("All boosters must use the same feature matrix")
+            self.num_features = num_features
+            transforms.append("exp" if dump["objective"].split(" ")[0] in EXP_OBJECTIVES else None)
+
+            for tree in dump["tree_info"]:
+                roots.append(len(features))
+                tree_output.append(output)
+                # Depth-first flattening; children are patched in once their index is known
+                stack = [(tree["tree_structure"], None, None, 0)]
+                while stack:
+                    node, parent, side, depth = stack.pop()
+                    index = len(features)
+                    if parent is not None:
+                        (lefts if side == "left" else rights)[parent] = index
+                    self.max_depth = max(self.max_depth, depth)
+
+                    if "leaf_value" in node:
+                        if node.get("leaf_coeff"):
+                            raise UnsupportedModelError("Linear trees are not supported")
+                        features.append(0)
+                        thresholds.append(np.nan)
+                        lefts.append(index)
+                        rights.append(index)
+                        default_left.append(True)
+                        missing.append(MISSING_NONE)
+                        values.append(node["leaf_value"])
+                        continue
+
+                    features.append(node["split_feature"])
+                    thresholds.append(node["threshold"])
+                    lefts.append(-1)
+                    rights.append(-1)
+                    default_left.append(node["default_left"])
+                    missing.append(_MISSING_TYPES[node["missing_type"]])
+                    values.append(0.0)
+                    stack.append((node["right_child"], index, "right", depth + 1))
+                    stack.append((node["left_child"], index, "left", depth + 1))
+
+        self.feature = np.asarray(features, dtype=np.intp)
+        self.threshold = np.asarray(thresholds, dtype=np.float64)
+        # children[2 * node] is the left child, children[2 * node + 1] the right one
+        self.children = np.column_stack([lefts, rights]).astype(np.intp).ravel()
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.missing_type = np.asarray(missing, dtype=np.int8)
+        self.value = np.asarray(values, dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.tree_output = np.asarray(tree_output, dtype=np.intp)
+        self.transforms = transforms
+        self.handles_missing = bool((self.missing_type != MISSING_NONE).any())
+
+        logger.info(f"Compiled {len(self.roots)} trees ({len(self.feature)} nodes, depth {self.max_depth}) "
+                    f"from {self.num_outputs} boosters")
+
+    @classmethod
+    def from_models(cls, models: Sequence, **kwargs) -> "CompiledEnsemble":
+        return cls([_booster_of(m) for m in models], **kwargs)
+
+    @staticmethod
+    def _check_supported(dump: dict):
+        if dump.get("num_tree_per_iteration", 1) != 1 or dump.get("num_class", 1) != 1:
+            raise UnsupportedModelError("Multiclass boosters are not supported")
+        if dump.get("average_output"):
+            raise UnsupportedModelError("Random forest (average_output) boosters are not supported")
+        objective = dump["objective"].split(" ")[0]
+        if objective not in IDENTITY_OBJECTIVES + EXP_OBJECTIVES:
+            raise UnsupportedModelError(f"Objective '{objective}' is not supported")
+        for tree in dump["tree_info"]:
+            if tree.get("num_cat", 0):
+                raise UnsupportedModelError("Categorical splits are not supported")
+
+    def predict(self, X) -> np.ndarray:
+        """Evaluate every booster on X; returns an (n_rows, n_boosters) array."""
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.num_features:
+            raise ValueError(f"Expected {self.num_features} features, got {X.shape[1]}")
+
+        out = np.empty((X.shape[0], self.num_outputs), dtype=np.float64)
+        for start in range(0, X.shape[0], self.block_rows):
+            block = X[start:start + self.block_rows]
+            out[start:start + len(block)] = self._predict_block(block)
+
+        for output, transform in enumerate(self.transforms):
+            if transform == "exp":
+                out[:, output] = np.exp(out[:, output])
+        return out
+
+    def _predict_block(self, X: np.ndarray) -> np.ndarray:
+        n = X.shape[0]
+        # Tree-major layout: nodes[tree, row]; X is read feature-major so each gather
+        # is a single flat np.take
+        x_flat = np.ascontiguousarray(X.T).ravel()
+        row_offset = np.arange(n)[None, :]
+        feature_offset = self.feature * n
+        nodes = np.repeat(self.roots[:, None], n, axis=1)
+        check_missing = self.handles_missing or np.isnan(x_flat).any()
+
+        # Every level moves all (tree, row) pairs one step down; leaves point to themselves
+        for _ in range(self.max_depth):
+            fval = x_flat.take(feature_offset.take(nodes) + row_offset)
+            threshold = self.threshold.take(nodes)
+            go_right = fval > threshold
+
+            if check_missing:
+                missing_type = self.missing_type.take(nodes)
+                is_nan = np.isnan(fval)
+                # Like LightGBM, NaN is treated as 0.0 unless the split handles NaN itself
+                go_right = np.where(is_nan & (missing_type != MISSING_NAN), 0.0 > threshold, go_right)
+                is_missing = ((missing_type == MISSING_ZERO) & (is_nan | (np.abs(fval) <= _ZERO_THRESHOLD))) \
+                    | ((missing_type == MISSING_NAN) & is_nan)
+                go_right = np.where(is_missing, ~self.default_left.take(nodes), go_right)
+
+            nodes = self.children.take(2 * nodes + go_right)
+
+        leaf_values = self.value.take(nodes)
+        result = np.empty((n, self.num_outputs), dtype=np.float64)
+        for output in range(self.num_outputs):
+            result[:, output] = leaf_values[self.tree_output == output].sum(axis=0)
+        return result
+
+    def max_abs_error(self, models: Sequence, X) -> float:
+        """Largest difference to the models' own predict() on X."""
+        expected = np.column_stack([np.asarray(m.predict(X), dtype=np.float64) for m in models])
+        return float(np.max(np.abs(self.predict(X) - expected))) if len(expected) else 0.0
+
+
+def compile_models(models: List, probe: np.ndarray = None, tolerance: float = 1e-9):
+    """
+    Build a CompiledEnsemble for `models` and check it against their predict() on `probe`.
+    Returns None (caller keeps using LightGBM) if the models can't be compiled or don't match.
+    """
+    try:
+        ensemble = CompiledEnsemble.from_models(models)
+    except Exception as e:
+        logger.warning(f"Compiled engine unavailable, using LightGBM predict: {e}")
+        return None
+
+    if probe is None:
+        probe = np.random.default_rng(0).normal(0, 100, size=(256, ensemble.num_features))
+
+    error = ensemble.max_abs_error(models, probe)
+    if error > tolerance:
+        logger.warning(f"Compiled engine disagrees with LightGBM (max abs error {error}), using LightGBM predict")
+        return None
+
+    logger.info(f"Compiled engine matches LightGBM on {len(probe)} probe rows (max abs error {error:.3g})")
+    return ensemble
+
+
+def _benchmark(repeat: int = 200):
+    import pandas as pd
+    from models.predictor import RPSEstimator
+
+    estimator = RPSEstimator()
+    models = [estimator.base_model, estimator.residual_model]
+    ensemble = compile_models(models)
+    if ensemble is None:
+        return
+
+    rng = np.random.default_rng(42)
+    for rows in (1, 16, 64, 256, 1440):
+        X = pd.DataFrame(rng.normal(0, 100, size=(rows, ensemble.num_features)), columns=estimator.feature_names)
+        n = max(3, repeat // rows)
+
+        started = time.perf_counter()
+        for _ in range(n):
+            for model in models:
+                model.predict(X)
+        lightgbm_ms = (time.perf_counter() - started) / n * 1000
+
+        started = time.perf_counter()
+        for _ in range(n):
+            ensemble.predict(X.to_numpy())
+        compiled_ms = (time.perf_counter() - started) / n * 1000
+
+        print(f"rows={rows:>6}  lightgbm={lightgbm_ms:9.3f} ms  compiled={compiled_ms:9.3f} ms  "
+              f"speedup={lightgbm_ms / compiled_ms:6.1f}x  max_abs_error={ensemble.max_abs_error(models, X):.3g}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    _benchmark()
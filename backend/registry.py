@@ -0,0 +1,362 @@
+"""
+Versioned model registry with background loading and hot swap.
+
+A version is a directory holding the RPSEstimator pickles: the models directory itself
+("default") and every subdirectory of MODEL_VERSIONS_DIR that has an inference_model.pkl.
+Only the active version and an optional shadow version are kept loaded. Callers take
+the active estimator once per request and keep using it, so swapping in another
+version never touches a prediction that is already running.
+
+The shadow version is fed the same live traffic as the active one; its forecasts are
+compared with the active forecasts but never served.
+"""
+import asyncio
+import glob
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import metrics
+from models.predictor import RPSEstimator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VERSION = "default"
+# One subdirectory per additional model version
+MODEL_VERSIONS_DIR = os.getenv("MODEL_VERSIONS_DIR", os.path.join("models", "versions"))
+# Version served after startup
+MODEL_ACTIVE_VERSION = os.getenv("MODEL_ACTIVE_VERSION", DEFAULT_VERSION)
+# Version run next to it for comparison (empty: none)
+MODEL_SHADOW_VERSION = os.getenv("MODEL_SHADOW_VERSION", "")
+# Seconds between checks for changed model files of the loaded versions (0 disables)
+MODEL_RELOAD_SECONDS = float(os.getenv("MODEL_RELOAD_SECONDS", "0"))
+
+
+def _signature(path: str) -> tuple:
+    """Names, sizes and mtimes of the pickles in a version directory."""
+    files = []
+    for name in sorted(glob.glob(os.path.join(glob.escape(path), "*.pkl"))):
+        try:
+            stat = os.stat(name)
+        except OSError:
+            continue
+        files.append((os.path.basename(name), stat.st_size, stat.st_mtime_ns))
+    return tuple(files)
+
+
+class ModelVersion:
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.status = "available"  # loading, loaded, failed
+        self.error = None
+        self.estimator: Optional[RPSEstimator] = None
+        self.model_version = None  # RPSEstimator.model_version of the loaded files
+        self.signature = None  # _signature() of the files last loaded (or tried)
+        self.loaded_at = None
+        self.load_seconds = None
+
+    def to_dict(self, role: Optional[str] = None) -> dict:
+        return {
+            "name": self.name,
+            "path": self.path,
+            "status": self.status,
+            "role": role,
+            "model_version": self.model_version,
+            "loaded_at": self.loaded_at,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+
+class ShadowComparison:
+    """Running absolute difference between active and shadow forecasts, per output column."""
+
+    def __init__(self, active: str, shadow: str):
+        self.active = active
+        self.shadow = shadow
+        self.started_at = time.time()
+        self.compared = 0
+        self.unmatched = 0  # only one of the two had a forecast, e.g. different warm-up
+        self.sums: Dict[str, float] = {}
+        self.max: Dict[str, float] = {}
+
+    def observe(self, active: Optional[dict], shadow: Optional[dict]):
+        if active is None or shadow is None:
+            if (active is None) != (shadow is None):
+                self.unmatched += 1
+            return
+
+        self.compared += 1
+        for key, value in active.items():
+            other = shadow.get(key)
+            if key == "timestamp" or value is None or other is None:
+                continue
+            diff = abs(float(other) - float(value))
+            self.sums[key] = self.sums.get(key, 0.0) + diff
+            self.max[key] = max(self.max.get(key, 0.0), diff)
+
+    def to_dict(self) -> dict:
+        return {
+            "active": self.active,
+            "shadow": self.shadow,
+            "started_at": self.started_at,
+            "compared": self.compared,
+            "unmatched": self.unmatched,
+            "mean_abs_diff": {k: s / self.compared for k, s in self.sums.items()} if self.compared else {},
+            "max_abs_diff": dict(self.max),
+        }
+
+
+class ModelRegistry:
+    """
+    start() loads the active (and shadow) version in a background thread and returns
+    right away. Loads and swaps are serialized by a lock; reading `active` is not,
+    it is one attribute read. Listeners get (role, ModelVersion or None) after every
+    swap, on the event loop that called start() when there is one.
+    """
+
+    def __init__(self, models_dir: str = "models", versions_dir: str = MODEL_VERSIONS_DIR,
+                 active: str = MODEL_ACTIVE_VERSION, shadow: Optional[str] = MODEL_SHADOW_VERSION or None,
+                 reload_seconds: float = MODEL_RELOAD_SECONDS):
+        self.models_dir = models_dir
+        self.versions_dir = versions_dir
+        self.active_name = active
+        self.shadow_name = shadow
+        self.reload_seconds = reload_seconds
+        self.versions: Dict[str, ModelVersion] = {}
+        self.comparison: Optional[ShadowComparison] = None
+        self._active: Optional[ModelVersion] = None
+        self._shadow: Optional[ModelVersion] = None
+        self._ready = threading.Event()
+        self._loading = False
+        self._lock = threading.RLock()
+        self._listeners: List[Callable] = []
+        self._loop = None
+        self._started = False
+        self.scan()
+
+    def scan(self) -> Dict[str, ModelVersion]:
+        """Pick up version directories added or removed since the last scan."""
+        found = {DEFAULT_VERSION: self.models_dir}
+        if os.path.isdir(self.versions_dir):
+            for name in sorted(os.listdir(self.versions_dir)):
+                path = os.path.join(self.versions_dir, name)
+                if name != DEFAULT_VERSION and os.path.exists(os.path.join(path, "inference_model.pkl")):
+                    found[name] = path
+
+        with self._lock:
+            for name, path in found.items():
+                if name not in self.versions:
+                    self.versions[name] = ModelVersion(name, path)
+            for name in list(self.versions):
+                version = self.versions[name]
+                if name not in found and version is not self._active and version is not self._shadow:
+                    del self.versions[name]
+        return self.versions
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    @property
+    def state(self) -> str:
+        if self._active is not None:
+            return "ready"
+        return "loading" if self._loading else "failed"
+
+    @property
+    def active(self) -> Optional[RPSEstimator]:
+        version = self._active
+        return version.estimator if version is not None else None
+
+    @property
+    def active_version(self) -> Optional[ModelVersion]:
+        return self._active
+
+    @property
+    def shadow(self) -> Optional[RPSEstimator]:
+        version = self._shadow
+        return version.estimator if version is not None else None
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[RPSEstimator]:
+        """Block until the first version is active (or the timeout passes)."""
+        self._ready.wait(timeout)
+        return self.active
+
+    def add_listener(self, callback: Callable):
+        self._listeners.append(callback)
+
+    def start(self):
+        """Load the configured versions in the background; call from the running event loop."""
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+        if self._started:
+            return
+        self._started = True
+        self._loading = True
+        threading.Thread(target=self._startup, daemon=True, name="model-loader").start()
+        if self.reload_seconds > 0:
+            threading.Thread(target=self._watch, daemon=True, name="model-watcher").start()
+
+    def _startup(self):
+        try:
+            self.activate(self.active_name)
+        except Exception as e:
+            logger.error(f"Could not load model version '{self.active_name}': {e}")
+        finally:
+            self._loading = False
+
+        if self.shadow_name and self._active is not None:
+            try:
+                self.set_shadow(self.shadow_name)
+            except Exception as e:
+                logger.error(f"Could not load shadow model version '{self.shadow_name}': {e}")
+
+    def _get(self, name: str) -> ModelVersion:
+        version = self.versions.get(name) or self.scan().get(name)
+        if version is None:
+            raise KeyError(f"Unknown model version '{name}'")
+        return version
+
+    def load(self, name: str) -> ModelVersion:
+        """Load a version unless it already is (blocking)."""
+        with self._lock:
+            version = self._get(name)
+            if version.estimator is None:
+                self._load(version)
+            return version
+
+    def _load(self, version: ModelVersion):
+        """
+        Load the version's files into a new estimator. On success it replaces
+        version.estimator in one assignment; on failure the old one stays.
+        """
+        previous_status = version.status
+        version.status = "loading"
+        version.signature = _signature(version.path)
+        started = time.perf_counter()
+        estimator = RPSEstimator(version.path)
+        seconds = time.perf_counter() - started
+        metrics.observe_stage("model_load", seconds)
+
+        if estimator.base_model is None:
+            version.error = f"No base model could be loaded from {version.path}"
+            version.status = "loaded" if version.estimator is not None else "failed"
+            raise RuntimeError(version.error)
+
+        version.estimator = estimator
+        version.model_version = estimator.model_version
+        version.status = "loaded"
+        version.error = None
+        version.loaded_at = time.time()
+        version.load_seconds = round(seconds, 3)
+        logger.info(f"Loaded model version '{version.name}' ({version.model_version}) "
+                    f"from {version.path} in {seconds:.2f}s (was {previous_status})")
+
+    def activate(self, name: str) -> ModelVersion:
+        """Load a version and make it the active one. Activating the shadow version promotes it."""
+        with self._lock:
+            version = self.load(name)
+            previous = self._active
+            # The swap itself: requests that already hold the previous estimator finish with it
+            self._active = version
+            self.active_name = name
+            promoted = self._shadow is version
+            if promoted:
+                self._shadow = None
+                self.shadow_name = None
+            if previous is not None and previous is not version:
+                self._release(previous)
+            if self._shadow is not None:
+                self.comparison = ShadowComparison(name, self._shadow.name)
+            elif promoted:
+                self.comparison = None
+        self._ready.set()
+        logger.info(f"Model version '{name}' ({version.model_version}) is active")
+
+        self._notify("active", version)
+        if promoted:
+            self._notify("shadow", None)
+        return version
+
+    def set_shadow(self, name: Optional[str]) -> Optional[ModelVersion]:
+        """Run `name` next to the active version for comparison; None stops shadowing."""
+        with self._lock:
+            version = self.load(name) if name else None
+            if version is not None and version is self._active:
+                raise ValueError(f"Model version '{name}' is already active")
+            previous = self._shadow
+            self._shadow = version
+            self.shadow_name = name if version is not None else None
+            self.comparison = ShadowComparison(self.active_name, name) if version is not None else None
+            if previous is not None and previous is not version:
+                self._release(previous)
+
+        self._notify("shadow", version)
+        return version
+
+    def reload(self) -> List[str]:
+        """
+        Reload the active and shadow versions whose files changed on disk and swap the new
+        models in. Returns the names of the versions that now serve different models.
+        """
+        self.scan()
+        swapped = []
+        with self._lock:
+            for version in (self._active, self._shadow):
+                if version is None or _signature(version.path) == version.signature:
+                    continue
+                previous = version.model_version
+                self._load(version)
+                if version.model_version != previous:
+                    swapped.append(version)
+            if swapped and self.comparison is not None:
+                self.comparison = ShadowComparison(self.active_name, self.shadow_name)
+
+        for version in swapped:
+            logger.info(f"Reloaded model version '{version.name}': {version.model_version}")
+            self._notify("active" if version is self._active else "shadow", version)
+        return [version.name for version in swapped]
+
+    def _release(self, version: ModelVersion):
+        """Drop a version's models once it has no role; requests holding them keep their reference."""
+        if version is self._active or version is self._shadow:
+            return
+        version.estimator = None
+        version.status = "available"
+
+    def _notify(self, role: str, version: Optional[ModelVersion]):
+        for callback in self._listeners:
+            if self._loop is not None and self._loop.is_running():
+                self._loop.call_soon_threadsafe(callback, role, version)
+            else:
+                callback(role, version)
+
+    def _watch(self):
+        while True:
+            time.sleep(self.reload_seconds)
+            try:
+                self.reload()
+            except Exception as e:
+                # The files are retried once they change again, e.g. when a copy has finished
+                logger.warning(f"Model reload failed: {e}")
+
+    def compare(self, active_forecast: Optional[dict], shadow_forecast: Optional[dict]):
+        comparison = self.comparison
+        if comparison is not None:
+            comparison.observe(active_forecast, shadow_forecast)
+
+    def status(self) -> dict:
+        roles = {id(self._active): "active", id(self._shadow): "shadow"}
+        return {
+            "state": self.state,
+            "active": self._active.name if self._active is not None else None,
+            "shadow": self._shadow.name if self._shadow is not None else None,
+            "versions": [v.to_dict(roles.get(id(v))) for v in self.versions.values()],
+            "comparison": self.comparison.to_dict() if self.comparison is not None else None,
+        }
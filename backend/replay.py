@@ -0,0 +1,207 @@
+"""
+Accelerated replay of a recorded request-rate series through the live pipeline.
+
+A replay feeds one window at a time into its own StreamingRPSEstimator at `speed`
+times real time (1x to 1000x), publishes every point on /ws/live and can write the
+results to the database under filename "replay-<id>". The report has the lag of each
+tick behind its schedule, the delivery lag of the /ws/live frames sent during the run,
+and the ticks, frames and points that were late or dropped.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from models.predictor import RPSEstimator
+from models.streaming import StreamingRPSEstimator
+
+logger = logging.getLogger(__name__)
+
+MIN_SPEED = 1.0
+MAX_SPEED = 1000.0
+# Results are written to the database in chunks of this many points
+REPLAY_WRITE_ROWS = int(os.getenv("REPLAY_WRITE_ROWS", "500"))
+# Finished replays kept for the status API
+REPLAY_HISTORY = int(os.getenv("REPLAY_HISTORY", "20"))
+
+TICK_LAG_SECONDS = metrics.REGISTRY.histogram(
+    "rps_replay_tick_lag_seconds", "How far replay ticks ran behind their schedule")
+
+
+def _lag_stats(lags: List[float]) -> dict:
+    if not lags:
+        return {"count": 0}
+    values = np.asarray(lags) * 1000
+    return {
+        "count": len(values),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+class ReplaySession:
+    def __init__(self, rate_df: pd.DataFrame, estimator: RPSEstimator, speed: float, source: str, write: bool):
+        self.id = uuid.uuid4().hex
+        self.rate_df = rate_df
+        self.estimator = estimator
+        self.speed = speed
+        self.source = source
+        self.write = write
+        self.status = "pending"
+        self.error = None
+        self.ticks = 0
+        self.late_ticks = 0  # processed after the next tick was already due
+        self.lags: List[float] = []
+        self.written = 0
+        self.dropped_frames = 0
+        self.dropped_points = 0
+        self.delivery_lags: List[float] = []
+        self.started_at = None
+        self.finished_at = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def filename(self) -> str:
+        return f"replay-{self.id}"
+
+    @property
+    def interval(self) -> float:
+        return pd.Timedelta(RPSEstimator.WINDOW).total_seconds() / self.speed
+
+    def to_dict(self) -> dict:
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else None
+        return {
+            "replay_id": self.id,
+            "source": self.source,
+            "status": self.status,
+            "error": self.error,
+            "speed": self.speed,
+            "tick_seconds": round(self.interval, 6),
+            "windows": len(self.rate_df),
+            "ticks": self.ticks,
+            "progress": round(self.ticks / len(self.rate_df), 3) if len(self.rate_df) else 1.0,
+            "model_version": self.estimator.model_version,
+            "achieved_speed": round(self.ticks * self.interval * self.speed / elapsed, 2) if elapsed else None,
+            "tick_lag": _lag_stats(self.lags),
+            "end_to_end_lag": _lag_stats(self.delivery_lags),
+            "late_ticks": self.late_ticks,
+            "dropped_frames": self.dropped_frames,
+            "dropped_points": self.dropped_points,
+            "written": self.written if self.write else None,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ReplayManager:
+    """
+    Runs replays as tasks on the event loop, next to the regular live traffic. Each
+    replay has its own online feature state, so the /api/stream state is untouched.
+    """
+
+    def __init__(self, live, db):
+        self.live = live
+        self.db = db
+        self.sessions: "OrderedDict[str, ReplaySession]" = OrderedDict()
+
+    def get(self, replay_id: str) -> Optional[ReplaySession]:
+        return self.sessions.get(replay_id)
+
+    def start(self, rate_df: pd.DataFrame, estimator: RPSEstimator, speed: float, source: str,
+              write: bool = False) -> ReplaySession:
+        if not MIN_SPEED <= speed <= MAX_SPEED:
+            raise ValueError(f"Speed must be between {MIN_SPEED:g}x and {MAX_SPEED:g}x")
+        if rate_df.empty:
+            raise ValueError(f"Nothing to replay from {source}")
+
+        session = ReplaySession(rate_df, estimator, speed, source, write)
+        self.sessions[session.id] = session
+        self._prune()
+        session.task = asyncio.create_task(self._run(session))
+        return session
+
+    def stop(self, replay_id: str) -> Optional[ReplaySession]:
+        session = self.sessions.get(replay_id)
+        if session is not None and session.task is not None and not session.task.done():
+            session.task.cancel()
+        return session
+
+    def shutdown(self):
+        for session in self.sessions.values():
+            if session.task is not None:
+                session.task.cancel()
+
+    async def _run(self, session: ReplaySession):
+        stream = StreamingRPSEstimator(session.estimator)
+        interval = session.interval
+        timestamps = session.rate_df["timestamp"].tolist()
+        rates = session.rate_df["request_rate"].tolist()
+        stats = self.live.stats()
+        frames_before, points_before = stats["dropped_frames"], stats["dropped_points"]
+        unwritten = []
+
+        session.status = "running"
+        session.started_at = time.time()
+        started = time.perf_counter()
+        logger.info(f"Replaying {len(rates)} windows from {session.source} at {session.speed:g}x")
+        try:
+            for i, (timestamp, rate) in enumerate(zip(timestamps, rates)):
+                due = started + i * interval
+                delay = due - time.perf_counter()
+                # Behind schedule the loop catches up, but still yields to the event loop every tick
+                await asyncio.sleep(max(delay, 0))
+
+                result = stream.step(timestamp, rate)
+                self.live.publish(result["point"], due=due)
+
+                now = time.perf_counter()
+                session.lags.append(now - due)
+                TICK_LAG_SECONDS.observe(now - due)
+                if now > due + interval:
+                    session.late_ticks += 1
+                session.ticks += 1
+
+                if session.write:
+                    unwritten.append(result["point"])
+                    if len(unwritten) >= REPLAY_WRITE_ROWS:
+                        await self._write(session, unwritten)
+                        unwritten = []
+
+            if unwritten:
+                await self._write(session, unwritten)
+            # Give the last points one live tick to go out before the report is taken
+            await asyncio.sleep(self.live.tick_seconds + 0.1)
+            session.status = "finished"
+        except asyncio.CancelledError:
+            session.status = "cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Replay {session.id} failed: {e}")
+            session.status = "failed"
+            session.error = str(e)
+        finally:
+            session.finished_at = time.time()
+            stats = self.live.stats()
+            session.dropped_frames = stats["dropped_frames"] - frames_before
+            session.dropped_points = stats["dropped_points"] - points_before
+            session.delivery_lags = [lag for sent_at, lag in self.live.deliveries if sent_at >= started]
+            logger.info(f"Replay {session.id} {session.status} after {session.ticks} ticks")
+
+    async def _write(self, session: ReplaySession, points: List[dict]):
+        df = pd.DataFrame(points)
+        await self.db.write_inference_results(df, session.filename)
+        session.written += len(df)
+
+    def _prune(self):
+        finished = [rid for rid, s in self.sessions.items() if s.finished_at is not None]
+        for replay_id in finished[:max(0, len(finished) - REPLAY_HISTORY)]:
+            del self.sessions[replay_id]
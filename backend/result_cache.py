@@ -0,0 +1,236 @@
+"""
+Content-addressed cache of upload results.
+
+Entries are keyed by the SHA-256 of the uploaded file and the model version, and
+hold the per-window request_rate series plus the prediction frame computed from it.
+An identical upload is answered from its entry without parsing or writing anything.
+An upload whose series continues a cached one reuses the cached predictions for the
+windows both agree on; only the windows after that are predicted and written.
+
+Entries live in memory (LRU) or, with RESULT_CACHE_DIR set, also as parquet files in
+that directory so they survive restarts.
+"""
+import glob
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Directory for the parquet cache; empty keeps the cache in memory only
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "")
+# Uploads kept, least recently used ones are evicted
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "32"))
+
+
+def copy_and_hash(src: BinaryIO, dst: BinaryIO, block_size: int = 1 << 20) -> str:
+    """shutil.copyfileobj that also returns the SHA-256 of what was copied."""
+    digest = hashlib.sha256()
+    for block in iter(lambda: src.read(block_size), b""):
+        digest.update(block)
+        dst.write(block)
+    return digest.hexdigest()
+
+
+def upload_digest(file_digest: str, partition: Optional[str] = None) -> str:
+    """Cache digest of an upload; the same file split by a partition column gives other results."""
+    if not partition:
+        return file_digest
+    return hashlib.sha256(f"{file_digest}\0{partition}".encode()).hexdigest()
+
+
+class CacheEntry:
+    """
+    rate_df / result_df cover the whole series the predictions were computed on, which
+    starts earlier than the upload itself when it extended a cached series. `first`
+    is the upload's own first window.
+    """
+
+    def __init__(self, digest: str, model_version: str, rate_df: pd.DataFrame, result_df: pd.DataFrame,
+                 first: Optional[pd.Timestamp] = None, filename: str = None):
+        self.digest = digest
+        self.model_version = model_version
+        self.rate_df = rate_df
+        self.result_df = result_df
+        self.first = first if first is not None else (rate_df["timestamp"].iloc[0] if len(rate_df) else None)
+        self.filename = filename
+
+    @property
+    def key(self) -> str:
+        return f"{self.model_version}-{self.digest}"
+
+    @property
+    def start(self) -> pd.Timestamp:
+        return self.rate_df["timestamp"].iloc[0]
+
+    @property
+    def end(self) -> pd.Timestamp:
+        return self.rate_df["timestamp"].iloc[-1]
+
+    def upload_result(self) -> pd.DataFrame:
+        """The predictions for the windows of the upload itself."""
+        if self.first is None:
+            return self.result_df
+        return self.result_df[self.result_df["timestamp"] >= self.first].reset_index(drop=True)
+
+
+class ResultCache:
+    def __init__(self, directory: str = RESULT_CACHE_DIR, maxsize: int = RESULT_CACHE_SIZE):
+        self.directory = directory or None
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.extensions = 0
+        self.misses = 0
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load()
+
+    def _paths(self, key: str):
+        return (os.path.join(self.directory, f"{key}.rate.parquet"),
+                os.path.join(self.directory, f"{key}.result.parquet"))
+
+    def _load(self):
+        import fastparquet
+
+        # Oldest first, so the LRU order follows the last use recorded in the mtimes
+        for rate_path in sorted(glob.glob(os.path.join(self.directory, "*.rate.parquet")), key=os.path.getmtime):
+            key = os.path.basename(rate_path)[:-len(".rate.parquet")]
+            model_version, _, digest = key.partition("-")
+            try:
+                rate_file = fastparquet.ParquetFile(rate_path)
+                meta = rate_file.key_value_metadata
+                rate_df = rate_file.to_pandas()
+                result_df = fastparquet.ParquetFile(self._paths(key)[1]).to_pandas()
+            except Exception as e:
+                logger.warning(f"Dropping unreadable result cache entry {key}: {e}")
+                self._remove_files(key)
+                continue
+            first = pd.Timestamp(meta["first"]) if meta.get("first") else None
+            self._entries[key] = CacheEntry(digest, model_version, rate_df, result_df, first, meta.get("filename"))
+        self._evict()
+        if self._entries:
+            logger.info(f"Loaded {len(self._entries)} cached upload results from {self.directory}")
+
+    def get(self, digest: str, model_version: str) -> Optional[CacheEntry]:
+        """Entry for exactly this file and model version."""
+        key = f"{model_version}-{digest}"
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        if self.directory:
+            os.utime(self._paths(key)[0])
+        return entry
+
+    def find_prefix(self, rate_df: pd.DataFrame, model_version: str, window: str):
+        """
+        Find the cached series that `rate_df` continues: it has to cover or directly
+        precede the new series' first window and agree with it on the windows both have.
+        Returns (entry, first window that still has to be predicted) or (None, None).
+
+        The last cached window usually only holds part of a minute, so prediction
+        restarts at the first window whose count differs. A first window that only
+        partly overlaps a cached series is taken from the cache, but at least one window
+        both series have whole has to match before the new one counts as a continuation.
+        """
+        if rate_df.empty or "series" in rate_df.columns:
+            return None, None
+
+        step = pd.Timedelta(window)
+        new_start = rate_df["timestamp"].iloc[0]
+        with self._lock:
+            candidates = [e for e in self._entries.values() if e.model_version == model_version]
+
+        best, best_resume = None, None
+        for entry in candidates:
+            # Partitioned entries are only reused whole, through get()
+            if "series" in entry.rate_df.columns:
+                continue
+            if entry.result_df.empty or entry.start.tz != new_start.tz:
+                continue
+            if not (entry.start <= new_start <= entry.end + step):
+                continue
+
+            cached = entry.rate_df.set_index("timestamp")["request_rate"]
+            overlap = rate_df[rate_df["timestamp"] <= entry.end]
+            differs = overlap["request_rate"].to_numpy() != cached.reindex(overlap["timestamp"]).to_numpy()
+            # Only windows both have whole are evidence: the last cached one and, for an export
+            # starting mid-series, the new first one usually hold part of a minute
+            whole = (overlap["timestamp"] < entry.end).to_numpy(copy=True)
+            if new_start > entry.start and len(differs):
+                whole[0] = False
+                # The cached count of a cut first minute is the full one
+                differs[0] = False
+            first_difference = int(np.argmax(differs)) if differs.any() else len(differs)
+            if not whole[:first_difference].any():
+                continue
+            resume = overlap["timestamp"].iloc[first_difference] if differs.any() else entry.end + step
+            # Cached predictions only help for the windows they cover
+            resume = min(resume, entry.result_df["timestamp"].iloc[-1] + step)
+
+            if resume <= new_start:
+                continue
+            if best_resume is None or resume > best_resume:
+                best, best_resume = entry, resume
+
+        if best is None:
+            self.misses += 1
+            return None, None
+
+        self.extensions += 1
+        with self._lock:
+            if best.key in self._entries:
+                self._entries.move_to_end(best.key)
+        return best, best_resume
+
+    def put(self, entry: CacheEntry):
+        with self._lock:
+            self._entries[entry.key] = entry
+            self._entries.move_to_end(entry.key)
+
+        if self.directory:
+            import fastparquet
+
+            rate_path, result_path = self._paths(entry.key)
+            meta = {"filename": entry.filename or "", "first": entry.first.isoformat() if entry.first is not None else ""}
+            # Write then rename, so a reader never sees half a file; the rate file goes last as it marks the entry
+            for df, path, custom in ((entry.result_df, result_path, None), (entry.rate_df, rate_path, meta)):
+                fastparquet.write(path + ".tmp", df, custom_metadata=custom)
+                os.replace(path + ".tmp", path)
+        self._evict()
+
+    def _evict(self):
+        evicted = []
+        with self._lock:
+            while len(self._entries) > self.maxsize:
+                key, _ = self._entries.popitem(last=False)
+                evicted.append(key)
+        for key in evicted:
+            self._remove_files(key)
+
+    def _remove_files(self, key: str):
+        if not self.directory:
+            return
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "extensions": self.extensions,
+                "misses": self.misses, "directory": self.directory}
+
+    def __len__(self) -> int:
+        return len(self._entries)
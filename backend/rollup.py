@@ -0,0 +1,217 @@
+"""
+Ingest-time rollups of the inference results.
+
+Every write is also aggregated into coarser windows (ROLLUP_RESOLUTIONS, 5 minutes,
+1 hour and 1 day by default), each kept in its own measurement (inference_metrics_5m,
+...) in its own bucket (<bucket>_5m, ...) with its own retention. A window row has
+
+    <field>_mean, <field>_max, <field>_p95   for actual and every forecast field
+    <field>_mae, <field>_rmse, <field>_bias  error of model1 / model2 against actual
+    count                                    windows of actual it covers
+
+and is stamped with the start of its window. Results usually arrive in pieces (replay
+chunks, buffered segments), so the rows of the open window of the coarsest resolution
+are kept per tag set, and every window a write touches is recomputed from all of its
+rows and written again whole; InfluxDB overwrites the earlier version in place. Rows
+of touched windows that aren't kept (after a restart, once a tag set was evicted, or
+for an earlier window) are read back from the stored points first through `load`.
+"""
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# <name>:<retention> pairs; a retention of 0 keeps the rollup forever. Empty disables rollups
+ROLLUP_RESOLUTIONS = os.getenv("ROLLUP_RESOLUTIONS", "5m:30d,1h:365d,1d:0")
+# Tag sets (upload, series) whose open windows are kept for later writes
+ROLLUP_OPEN_SERIES = int(os.getenv("ROLLUP_OPEN_SERIES", "256"))
+
+QUANTILE = 0.95
+# Forecasts of the window itself; the pred_<horizon> ones are for later windows
+ERROR_FIELDS = ("model1", "model2")
+
+_DURATION_RE = re.compile(r"^(\d+)(s|m|h|d|w)$")
+_DURATION_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def duration_seconds(text: str) -> int:
+    text = text.strip().lower()
+    if text == "0":
+        return 0
+    match = _DURATION_RE.match(text)
+    if not match:
+        raise ValueError(f"Invalid duration '{text}', expected e.g. 5m, 1h, 30d")
+    return int(match.group(1)) * _DURATION_SECONDS[match.group(2)]
+
+
+class Resolution:
+    def __init__(self, name: str, retention: int):
+        self.name = name
+        self.seconds = duration_seconds(name)
+        self.retention = retention  # seconds, 0 keeps it forever
+        self.measurement = f"inference_metrics_{name}"
+        self.freq = pd.Timedelta(seconds=self.seconds)
+
+    def keeps(self, range_seconds: int) -> bool:
+        return not self.retention or self.retention >= range_seconds
+
+    def __repr__(self) -> str:
+        return f"Resolution({self.name})"
+
+
+def parse_resolutions(spec: str) -> List[Resolution]:
+    resolutions = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, retention = item.partition(":")
+        resolutions.append(Resolution(name.strip(), duration_seconds(retention or "0")))
+    return sorted(resolutions, key=lambda r: r.seconds)
+
+
+def _quantile(values: np.ndarray, codes: np.ndarray, groups: int, q: float) -> np.ndarray:
+    """
+    Per-group quantile of every column, interpolated like pandas' and skipping NaN, from
+    one sort per column instead of a sort per group.
+    """
+    result = np.full((groups, values.shape[1]), np.nan)
+    starts = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=groups))[:-1]])
+    for j in range(values.shape[1]):
+        column = values[:, j]
+        # Grouped, ascending within each group, NaN last (the stable sort of the int codes is a radix sort)
+        order = np.argsort(column)
+        ordered = column[order[np.argsort(codes[order], kind="stable")]]
+        counts = np.bincount(codes, weights=~np.isnan(column), minlength=groups).astype(np.int64)
+        present = counts > 0
+        position = starts[present] + (counts[present] - 1) * q
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, starts[present] + counts[present] - 1)
+        result[present, j] = ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+    return result
+
+
+def aggregate(df: pd.DataFrame, fields: list, freq: pd.Timedelta) -> pd.DataFrame:
+    """The rollup rows of one series ('timestamp' in UTC and the fields) for windows of `freq`."""
+    keys = df["timestamp"].dt.floor(freq).rename("timestamp")
+    values = df[fields].astype(np.float64)
+    grouped = values.groupby(keys, sort=False)
+    codes, windows = pd.factorize(keys)
+    p95 = pd.DataFrame(_quantile(values.to_numpy(), codes, len(windows), QUANTILE),
+                       index=pd.Index(windows, name="timestamp"), columns=[f"{f}_p95" for f in fields])
+    parts = [grouped.mean().add_suffix("_mean"), grouped.max().add_suffix("_max"), p95]
+
+    if "actual" in fields:
+        errors = {}
+        for field in ERROR_FIELDS:
+            if field in fields:
+                error = values[field] - values["actual"]
+                errors[f"{field}_mae"] = error.abs()
+                errors[f"{field}_rmse"] = error * error
+                errors[f"{field}_bias"] = error
+        if errors:
+            means = pd.DataFrame(errors).groupby(keys, sort=False).mean()
+            rmse = [c for c in means.columns if c.endswith("_rmse")]
+            means[rmse] = np.sqrt(means[rmse])
+            parts.append(means)
+        parts.append(values["actual"].groupby(keys, sort=False).count().astype(np.float64).rename("count"))
+
+    return pd.concat(parts, axis=1).reset_index()
+
+
+class Rollups:
+    def __init__(self, resolutions: Optional[List[Resolution]] = None, open_series: int = ROLLUP_OPEN_SERIES,
+                 load: Optional[Callable[[dict, pd.Timestamp, pd.Timestamp], pd.DataFrame]] = None):
+        self.resolutions = parse_resolutions(ROLLUP_RESOLUTIONS) if resolutions is None else resolutions
+        self.open_series = open_series
+        # load(tags, start, stop): the stored rows ('timestamp', the fields, the series column) of a tag set
+        self.load = load
+        # (tags, series) -> rows of the open window of the coarsest resolution
+        self._open: "OrderedDict[tuple, pd.DataFrame]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolution_for(self, range_seconds: int, points: int) -> Optional[Resolution]:
+        """The coarsest rollup with at least `points` windows in the range that keeps the whole range."""
+        for resolution in reversed(self.resolutions):
+            if range_seconds // resolution.seconds >= points and resolution.keeps(range_seconds):
+                return resolution
+        return None
+
+    def build(self, df: pd.DataFrame, tags: dict, fields: list, series_column: str) -> List[Tuple[Resolution, pd.DataFrame]]:
+        """The rollup rows to (re)write for the windows `df` touches, per resolution."""
+        if not self.resolutions or df.empty or "timestamp" not in df.columns or not fields:
+            return []
+
+        df = df.assign(timestamp=pd.to_datetime(df["timestamp"], utc=True)).dropna(subset=["timestamp"])
+        if series_column in df.columns:
+            groups = df.groupby(series_column, sort=False, dropna=False)
+        else:
+            groups = [(None, df)]
+
+        coarsest = self.resolutions[-1].freq
+        tag_key = tuple(sorted(tags.items()))
+        built = {resolution: [] for resolution in self.resolutions}
+        groups = list(groups)
+        with self._lock:
+            span = self._missing_span(tag_key, groups)
+        # Read without the lock, so a slow InfluxDB only holds up this write; rows another
+        # write has kept meanwhile come after the stored ones and win over them
+        stored = self._load(tags, span) if span is not None else None
+        with self._lock:
+            for series, group in groups:
+                key = (tag_key, series)
+                rows = group[["timestamp", *fields]]
+                first = rows["timestamp"].min()
+                parts = []
+                if stored is not None and not stored.empty:
+                    earlier = stored[stored[series_column] == series] if series_column in stored.columns else stored
+                    parts.append(earlier[[c for c in rows.columns if c in earlier.columns]])
+                carried = self._open.pop(key, None)
+                if carried is not None:
+                    parts.append(carried)
+                if parts:
+                    # A retried write brings rows that are already here; the latest copy wins
+                    rows = pd.concat([*parts, rows], ignore_index=True).drop_duplicates("timestamp", keep="last")
+                rows = rows.sort_values("timestamp", ignore_index=True)
+
+                self._open[key] = rows[rows["timestamp"] >= rows["timestamp"].iloc[-1].floor(coarsest)]
+                while len(self._open) > self.open_series:
+                    self._open.popitem(last=False)
+
+                columns = [c for c in rows.columns if c != "timestamp"]
+                for resolution in self.resolutions:
+                    touched = rows[rows["timestamp"] >= first.floor(resolution.freq)]
+                    frame = aggregate(touched, columns, resolution.freq)
+                    if series is not None:
+                        frame[series_column] = series
+                    built[resolution].append(frame)
+
+        return [(resolution, pd.concat(frames, ignore_index=True)) for resolution, frames in built.items() if frames]
+
+    def _missing_span(self, tag_key: tuple, groups: list) -> Optional[Tuple[pd.Timestamp, pd.Timestamp]]:
+        """
+        (start, stop) of the coarsest windows a write touches whose rows aren't kept here,
+        over all its series; None if every series continues its kept window.
+        """
+        if self.load is None:
+            return None
+        coarsest = self.resolutions[-1].freq
+        start = stop = None
+        for series, group in groups:
+            carried = self._open.get((tag_key, series))
+            first = group["timestamp"].min().floor(coarsest)
+            kept = carried["timestamp"].iloc[0].floor(coarsest) if carried is not None and len(carried) else None
+            if kept is not None and first >= kept:
+                continue
+            end = kept if kept is not None else group["timestamp"].max().floor(coarsest) + coarsest
+            start = first if start is None else min(start, first)
+            stop = end if stop is None else max(stop, end)
+        return (start, stop) if start is not None else None
+
+    def _load(self, tags: dict, span: Tuple[pd.Timestamp, pd.Timestamp]) -> pd.DataFrame:
+        df = self.load(tags, *span)
+        return df.assign(timestamp=pd.to_datetime(df["timestamp"], utc=True))
@@ -0,0 +1,394 @@
+"""
+Predictive scaling: replica recommendations from the live forecasts.
+
+For every forecast of the live stream ScalingEngine.decide() works out
+
+    demand   = the highest of model1 and the pred_<horizon> forecasts within the lead time
+    desired  = ceil(demand * (1 + headroom) / replica_capacity), within [min_replicas, max_replicas]
+
+and moves the replica count towards it:
+
+    up       at most max_step_up replicas per decision, not within up_cooldown seconds of the last change
+    down     to the highest count recommended, with `hysteresis` extra headroom, during the last
+             down_stabilization seconds, and at most max_step_down replicas per decision
+
+Times are series time (the window timestamps), so a replayed or simulated series
+gets the same decisions as live traffic. The current recommendation is kept encoded,
+so /api/scaling serves it without building a response, and pushed to /ws/scaling.
+
+simulate() runs a policy over a predicted series and scores the capacity it would
+have provided against the actual requests, next to a reactive policy that only sees
+the previous window's actual.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Optional, Set
+
+import numpy as np
+import pandas as pd
+
+from downsample import lttb
+from models.predictor import RPSEstimator
+
+logger = logging.getLogger(__name__)
+
+# Requests per window one replica serves (request_rate is counted per RPSEstimator.WINDOW)
+SCALING_REPLICA_CAPACITY = float(os.getenv("SCALING_REPLICA_CAPACITY", "100"))
+# Spare capacity kept on top of the forecast
+SCALING_HEADROOM = float(os.getenv("SCALING_HEADROOM", "0.2"))
+# Extra headroom the demand has to fall below before replicas are removed
+SCALING_HYSTERESIS = float(os.getenv("SCALING_HYSTERESIS", "0.1"))
+SCALING_MIN_REPLICAS = int(os.getenv("SCALING_MIN_REPLICAS", "1"))
+SCALING_MAX_REPLICAS = int(os.getenv("SCALING_MAX_REPLICAS", "100"))
+# Replicas added / removed per decision at most
+SCALING_MAX_STEP_UP = int(os.getenv("SCALING_MAX_STEP_UP", "10"))
+SCALING_MAX_STEP_DOWN = int(os.getenv("SCALING_MAX_STEP_DOWN", "1"))
+# Seconds after a change before scaling up again
+SCALING_UP_COOLDOWN_SECONDS = float(os.getenv("SCALING_UP_COOLDOWN_SECONDS", "0"))
+# Scale-downs follow the highest recommendation of this many seconds
+SCALING_DOWN_STABILIZATION_SECONDS = float(os.getenv("SCALING_DOWN_STABILIZATION_SECONDS", "300"))
+# How far ahead capacity is planned, i.e. how long a new replica takes to serve;
+# forecast horizons up to it count towards the demand
+SCALING_LEAD_TIME = os.getenv("SCALING_LEAD_TIME", "1min")
+# Decisions kept for /api/scaling/status
+SCALING_HISTORY = int(os.getenv("SCALING_HISTORY", "500"))
+
+HORIZON_PREFIX = "pred_"
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+
+class ScalingPolicy:
+    FIELDS = ("replica_capacity", "headroom", "hysteresis", "min_replicas", "max_replicas", "max_step_up",
+              "max_step_down", "up_cooldown", "down_stabilization", "lead_time")
+
+    def __init__(self, replica_capacity: float = SCALING_REPLICA_CAPACITY, headroom: float = SCALING_HEADROOM,
+                 hysteresis: float = SCALING_HYSTERESIS, min_replicas: int = SCALING_MIN_REPLICAS,
+                 max_replicas: int = SCALING_MAX_REPLICAS, max_step_up: int = SCALING_MAX_STEP_UP,
+                 max_step_down: int = SCALING_MAX_STEP_DOWN, up_cooldown: float = SCALING_UP_COOLDOWN_SECONDS,
+                 down_stabilization: float = SCALING_DOWN_STABILIZATION_SECONDS, lead_time: str = SCALING_LEAD_TIME):
+        if replica_capacity <= 0:
+            raise ValueError("replica_capacity must be positive")
+        if headroom < 0 or hysteresis < 0:
+            raise ValueError("headroom and hysteresis can't be negative")
+        if min_replicas < 0 or max_replicas < max(min_replicas, 1):
+            raise ValueError("Need 0 <= min_replicas <= max_replicas and max_replicas >= 1")
+        if max_step_up < 1 or max_step_down < 1:
+            raise ValueError("max_step_up and max_step_down must be at least 1")
+        if up_cooldown < 0 or down_stabilization < 0:
+            raise ValueError("up_cooldown and down_stabilization can't be negative")
+        try:
+            lead = pd.Timedelta(lead_time)
+        except (ValueError, TypeError):
+            raise ValueError(f"Invalid lead_time '{lead_time}'")
+
+        self.replica_capacity = float(replica_capacity)
+        self.headroom = float(headroom)
+        self.hysteresis = float(hysteresis)
+        self.min_replicas = int(min_replicas)
+        self.max_replicas = int(max_replicas)
+        self.max_step_up = int(max_step_up)
+        self.max_step_down = int(max_step_down)
+        self.up_cooldown = float(up_cooldown)
+        self.down_stabilization = float(down_stabilization)
+        self.lead_time = lead_time
+        self._lead = lead
+        self._horizons = {}  # forecast column -> whether it is within the lead time
+
+    def replace(self, **changes) -> "ScalingPolicy":
+        """A copy with some settings changed; None leaves a setting as it is."""
+        unknown = set(changes) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown policy settings: {', '.join(sorted(unknown))}")
+        values = self.to_dict()
+        values.update({k: v for k, v in changes.items() if v is not None})
+        return ScalingPolicy(**values)
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def demand_columns(self, columns) -> list:
+        """model1 and the horizon forecasts that land within the lead time."""
+        selected = []
+        for column in columns:
+            if column == "model1":
+                selected.append(column)
+            elif str(column).startswith(HORIZON_PREFIX):
+                if column not in self._horizons:
+                    try:
+                        self._horizons[column] = pd.Timedelta(column[len(HORIZON_PREFIX):]) <= self._lead
+                    except ValueError:
+                        self._horizons[column] = False
+                if self._horizons[column]:
+                    selected.append(column)
+        return selected
+
+    def replicas_for(self, demand: float, extra_headroom: float = 0.0) -> int:
+        needed = demand * (1 + self.headroom + extra_headroom) / self.replica_capacity
+        # The small tolerance keeps exact multiples from rounding up on float noise
+        return min(max(math.ceil(needed - 1e-9), self.min_replicas), self.max_replicas)
+
+
+class ScalingState:
+    """The replica count a policy has settled on and what it needs to make the next decision."""
+
+    def __init__(self, policy: ScalingPolicy):
+        self.policy = policy
+        self.replicas: Optional[int] = None
+        self.last_change: Optional[pd.Timestamp] = None
+        self.scale_ups = 0
+        self.scale_downs = 0
+        # (timestamp, replicas) recommended with the hysteresis headroom, for the down stabilization
+        self._recent = deque()
+
+    def step(self, timestamp: pd.Timestamp, demand: float):
+        """Move towards the demand of the window at `timestamp`; returns (desired, action, reason)."""
+        policy = self.policy
+        desired = policy.replicas_for(demand)
+        # The initial sizing counts towards the down stabilization like any other recommendation
+        self._recent.append((timestamp, policy.replicas_for(demand, policy.hysteresis)))
+        if self.replicas is None:
+            self.replicas, self.last_change = desired, timestamp
+            return desired, "scale_up", "initial"
+
+        horizon = timestamp - pd.Timedelta(seconds=policy.down_stabilization)
+        while self._recent and self._recent[0][0] < horizon:
+            self._recent.popleft()
+
+        current = self.replicas
+        if desired > current:
+            if (timestamp - self.last_change).total_seconds() < policy.up_cooldown:
+                return desired, "hold", "cooldown"
+            self.replicas = min(desired, current + policy.max_step_up)
+            self.last_change = timestamp
+            self.scale_ups += 1
+            return desired, "scale_up", "forecast above capacity"
+
+        stable = max(replicas for _, replicas in self._recent)
+        if stable >= current:
+            reason = "within hysteresis" if desired < current else "at capacity"
+            return desired, "hold", reason
+        self.replicas = max(stable, current - policy.max_step_down)
+        self.last_change = timestamp
+        self.scale_downs += 1
+        return desired, "scale_down", "forecast below capacity"
+
+
+class ProvisioningScore:
+    """How the provided capacity compared with the actual requests, window by window."""
+
+    def __init__(self, replica_capacity: float):
+        self.replica_capacity = replica_capacity
+        self.windows = 0
+        self.under_windows = 0  # more requests than capacity
+        self.unserved = 0.0  # requests above capacity
+        self.replica_windows = 0  # capacity provided, in replica-windows
+        self.excess_replica_windows = 0  # replicas beyond what the actual requests needed
+        self.missing_replica_windows = 0  # replicas short of what they needed
+        self.utilization_sum = 0.0
+
+    def add(self, actual, replicas):
+        actual = np.asarray(actual, dtype=np.float64)
+        replicas = np.asarray(replicas, dtype=np.int64)
+        capacity = replicas * self.replica_capacity
+        needed = np.ceil(actual / self.replica_capacity - 1e-9).astype(np.int64)
+        self.windows += actual.size
+        self.under_windows += int((actual > capacity).sum())
+        self.unserved += float(np.maximum(actual - capacity, 0).sum())
+        self.replica_windows += int(replicas.sum())
+        self.excess_replica_windows += int(np.maximum(replicas - needed, 0).sum())
+        self.missing_replica_windows += int(np.maximum(needed - replicas, 0).sum())
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.utilization_sum += float(np.where(capacity > 0, np.minimum(actual / capacity, 1.0), 1.0).sum())
+
+    def to_dict(self) -> dict:
+        windows = self.windows or 1
+        return {
+            "windows": self.windows,
+            "under_provisioned_windows": self.under_windows,
+            "under_provisioned_ratio": round(self.under_windows / windows, 4),
+            "unserved_requests": round(self.unserved, 1),
+            "replica_windows": self.replica_windows,
+            "excess_replica_windows": self.excess_replica_windows,
+            "over_provisioned_ratio": round(self.excess_replica_windows / max(self.replica_windows, 1), 4),
+            "missing_replica_windows": self.missing_replica_windows,
+            "mean_utilization": round(self.utilization_sum / windows, 4),
+        }
+
+
+class ScalingEngine:
+    """
+    Decides on every forecast of the live stream (call decide() from the event loop).
+    `current_json` always holds the latest recommendation, encoded once per decision.
+    """
+
+    # Decisions awaiting the actual of their window, for the live score
+    PLANNED_WINDOWS = 16
+
+    def __init__(self, policy: Optional[ScalingPolicy] = None, history: int = SCALING_HISTORY):
+        self.policy = policy or ScalingPolicy()
+        self.decisions = deque(maxlen=history)
+        # Keeps counting across resets, so it can serve as the ETag of the current recommendation
+        self.sequence = 0
+        self._subscribers: Set[asyncio.Queue] = set()
+        self.reset()
+
+    def reset(self):
+        self.state = ScalingState(self.policy)
+        self.score = ProvisioningScore(self.policy.replica_capacity)
+        self._planned: "OrderedDict[pd.Timestamp, int]" = OrderedDict()
+        self.decisions.clear()
+        self._publish({"sequence": self.sequence + 1, "replicas": None, "action": "none",
+                       "reason": "waiting for forecasts"})
+
+    def set_policy(self, policy: ScalingPolicy):
+        """Use another policy from the next decision on; the replica count carries over."""
+        self.policy = policy
+        self.state.policy = policy
+        self.score = ProvisioningScore(policy.replica_capacity)
+
+    def demand(self, forecast: dict) -> Optional[float]:
+        values = [forecast[c] for c in self.policy.demand_columns(forecast) if forecast[c] is not None]
+        return max(values) if values else None
+
+    def decide(self, forecast: Optional[dict], model_version: Optional[str] = None) -> Optional[dict]:
+        """Recommendation for the window the forecast is for; None while the stream warms up."""
+        demand = self.demand(forecast) if forecast else None
+        if demand is None:
+            return None
+
+        timestamp = forecast["timestamp"]
+        previous = self.state.replicas
+        desired, action, reason = self.state.step(timestamp, demand)
+        replicas = self.state.replicas
+        capacity = replicas * self.policy.replica_capacity
+        self._planned[timestamp] = replicas
+        while len(self._planned) > self.PLANNED_WINDOWS:
+            self._planned.popitem(last=False)
+
+        decision = {
+            "sequence": self.sequence + 1,
+            "time": timestamp.isoformat(),
+            "replicas": replicas,
+            "previous": previous,
+            "desired": desired,
+            "action": action,
+            "reason": reason,
+            "demand": round(demand, 3),
+            "capacity": capacity,
+            "utilization": round(demand / capacity, 4) if capacity else None,
+            "model_version": model_version,
+            "decided_at": time.time(),
+        }
+        self.decisions.append(decision)
+        self._publish(decision)
+        return decision
+
+    def _publish(self, recommendation: dict):
+        self.sequence = recommendation["sequence"]
+        self.current = recommendation
+        self.current_json = _dumps(recommendation)
+        for queue in self._subscribers:
+            # Only the latest recommendation matters to a client that fell behind
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(self.current_json)
+
+    def observe(self, point: dict):
+        """Score the replicas planned for a completed window against its actual requests."""
+        replicas = self._planned.pop(point.get("timestamp"), None)
+        if replicas is not None and point.get("actual") is not None:
+            self.score.add([point["actual"]], [replicas])
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def status(self, limit: int = 60) -> dict:
+        return {
+            "policy": self.policy.to_dict(),
+            "current": self.current,
+            "scale_ups": self.state.scale_ups,
+            "scale_downs": self.state.scale_downs,
+            "score": self.score.to_dict(),
+            "subscribers": self.subscribers,
+            "decisions": list(self.decisions)[-limit:] if limit > 0 else [],
+        }
+
+
+def _run_policy(policy: ScalingPolicy, timestamps, demand: np.ndarray, actual: np.ndarray) -> tuple:
+    state = ScalingState(policy)
+    replicas = np.empty(len(demand), dtype=np.int64)
+    for i, (timestamp, value) in enumerate(zip(timestamps, demand.tolist())):
+        state.step(timestamp, value)
+        replicas[i] = state.replicas
+
+    score = ProvisioningScore(policy.replica_capacity)
+    score.add(actual, replicas)
+    report = score.to_dict()
+    report.update({"scale_ups": state.scale_ups, "scale_downs": state.scale_downs,
+                   "peak_replicas": int(replicas.max()) if len(replicas) else None})
+    return report, replicas
+
+
+def simulate(result_df: pd.DataFrame, policy: ScalingPolicy, points: int = 500) -> dict:
+    """
+    Score `policy` on a predicted series (RPSEstimator.predict_rate output): the replicas
+    decided from each window's forecast serve that window's actual requests. The same
+    policy driven by the previous window's actual gives the reactive baseline. `timeline`
+    holds about `points` windows of both, picked with LTTB on the actual requests.
+    """
+    if result_df.empty:
+        raise ValueError("Nothing to simulate")
+    if "series" in result_df.columns and result_df["series"].nunique() > 1:
+        raise ValueError("Simulate one series at a time")
+
+    df = result_df.sort_values("timestamp", ignore_index=True)
+    timestamps = df["timestamp"].tolist()
+    actual = df["actual"].to_numpy(dtype=np.float64)
+    demand = df[policy.demand_columns(df.columns)].max(axis=1).to_numpy(dtype=np.float64)
+    demand = np.where(np.isnan(demand), actual, demand)
+    # Reactive: sized for what the last window saw
+    reactive_demand = np.concatenate([actual[:1], actual[:-1]])
+
+    started = time.perf_counter()
+    predictive, predictive_replicas = _run_policy(policy, timestamps, demand, actual)
+    reactive, reactive_replicas = _run_policy(policy, timestamps, reactive_demand, actual)
+    elapsed = time.perf_counter() - started
+
+    x = pd.DatetimeIndex(df["timestamp"]).asi8.astype(np.float64)
+    keep = lttb(x, actual, points)
+    timeline = [{
+        "time": timestamps[i].isoformat(),
+        "actual": float(actual[i]),
+        "demand": round(float(demand[i]), 3),
+        "predictive_replicas": int(predictive_replicas[i]),
+        "reactive_replicas": int(reactive_replicas[i]),
+    } for i in keep]
+
+    return {
+        "policy": policy.to_dict(),
+        "windows": len(df),
+        "start": timestamps[0].isoformat(),
+        "end": timestamps[-1].isoformat(),
+        "window": RPSEstimator.WINDOW,
+        "predictive": predictive,
+        "reactive": reactive,
+        "decide_us_per_window": round(elapsed / (2 * len(df)) * 1e6, 3),
+        "timeline": timeline,
+    }
@@ -0,0 +1,34 @@
+import numpy as np
+
+from database import HistoryFrameReader, _history_chunk
+
+
+def test_short_and_empty_values():
+    header = ["", "result", "table", "_time", "actual", "model1", "pred_5min", "series"]
+    rows = [
+        ["", "", "0", "2024-01-01T00:00:00Z", "5", "", "", ""],
+        ["", "", "0", "2024-01-01T00:01:00Z", "", "7", "", "api"],
+    ]
+    df = _history_chunk(header, rows)
+
+    assert df["actual"].iloc[0] == 5.0 and np.isnan(df["actual"].iloc[1])
+    assert np.isnan(df["model1"].iloc[0]) and df["model1"].iloc[1] == 7.0
+    assert df["pred_5min"].isna().all() and df["pred_5min"].dtype == np.float64
+    assert df["model2"].isna().all()
+    assert df["series"].isna().tolist() == [True, False] and df["series"].iloc[1] == "api"
+
+
+def test_reader_splits_tables():
+    reader = HistoryFrameReader(chunk_rows=10)
+    frames = [reader.feed(row) for row in (
+        ["", "result", "table", "_time", "actual"],
+        ["", "", "0", "2024-01-01T00:00:00Z", ""],
+        [""],
+        ["", "result", "table", "_time", "actual", "pred_1min"],
+        ["", "", "1", "2024-01-01T00:01:00Z", "12.5", "3"],
+    )]
+    frames = [f for f in frames if f is not None] + [reader.flush()]
+
+    assert [len(f) for f in frames] == [1, 1]
+    assert np.isnan(frames[0]["actual"].iloc[0])
+    assert frames[1]["pred_1min"].iloc[0] == 3.0
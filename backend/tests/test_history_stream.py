@@ -0,0 +1,38 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import history_stream
+
+pa = pytest.importorskip("pyarrow")
+
+
+def _encode(frames) -> bytes:
+    async def source():
+        for frame in frames:
+            yield frame
+
+    async def body():
+        return b"".join([data async for data in history_stream.encode("arrow", source())])
+
+    return asyncio.run(body())
+
+
+def test_arrow_keeps_columns_of_later_frames():
+    times = pd.date_range("2024-01-01", periods=2, freq="min", tz="UTC")
+    first = pd.DataFrame({"time": times, "actual": [1.0, 2.0], "model1": np.nan, "model2": np.nan,
+                          "series": [None, None]})
+    later = pd.DataFrame({"time": times + pd.Timedelta("1h"), "actual": [3.0, 4.0], "model1": 1.0,
+                          "model2": 2.0, "pred_5min": [5.0, 6.0], "series": ["api", None]})
+
+    table = pa.ipc.open_stream(_encode([first, later])).read_all()
+
+    assert table.schema.field("series").type == pa.string()
+    assert table.column("pred_5min").to_pylist() == [None, None, 5.0, 6.0]
+    assert table.column("series").to_pylist() == [None, None, "api", None]
+
+
+def test_arrow_empty_range_is_a_readable_stream():
+    assert pa.ipc.open_stream(_encode([])).read_all().num_rows == 0
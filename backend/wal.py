@@ -0,0 +1,204 @@
+"""
+Local write-ahead buffer for inference results.
+
+Every write becomes one append-only parquet segment (<seq>.parquet, written to a temp
+file, fsynced and renamed into place), so accepting results costs a local file write
+and survives restarts. Segments are drained to InfluxDB in sequence order by
+InfluxDBWrapper; the last drained sequence number is kept in drained.json.
+Drained segments stay on disk for WAL_RETENTION_HOURS as a local copy of recent
+history that /api/history falls back to while InfluxDB can't be reached.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Directory of the buffer; empty disables it and writes go straight to InfluxDB
+WAL_DIR = os.getenv("WAL_DIR", os.path.join("data", "wal"))
+# Drained segments are kept this long for the history fallback
+WAL_RETENTION_HOURS = float(os.getenv("WAL_RETENTION_HOURS", "24"))
+
+_STATE_FILE = "drained.json"
+
+
+class Segment:
+    """One buffered write: its rows live in the file, the tags and time span in memory."""
+
+    def __init__(self, seq: int, path: str, rows: int, min_ns: Optional[int], max_ns: Optional[int], tags: dict):
+        self.seq = seq
+        self.path = path
+        self.rows = rows
+        self.min_ns = min_ns
+        self.max_ns = max_ns
+        self.tags = tags
+
+    def read(self) -> pd.DataFrame:
+        import fastparquet
+
+        return fastparquet.ParquetFile(self.path).to_pandas()
+
+
+def _time_span(df: pd.DataFrame):
+    if "timestamp" not in df.columns or df.empty:
+        return None, None
+    ns = pd.to_datetime(df["timestamp"], utc=True).to_numpy(dtype="datetime64[ns]").view(np.int64)
+    ns = ns[ns != np.iinfo(np.int64).min]
+    return (int(ns.min()), int(ns.max())) if len(ns) else (None, None)
+
+
+class WriteAheadBuffer:
+    def __init__(self, directory: str = WAL_DIR, retention_hours: float = WAL_RETENTION_HOURS):
+        self.directory = directory
+        self.retention = retention_hours * 3600
+        self.segments: Dict[int, Segment] = {}
+        self.drained_seq = 0
+        self._next_seq = 1
+        self._lock = threading.Lock()
+        # Set whenever a segment is appended, the drainer waits on it
+        self.appended = threading.Event()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{seq:012d}.parquet")
+
+    def _load(self):
+        import fastparquet
+
+        state_path = os.path.join(self.directory, _STATE_FILE)
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self.drained_seq = int(json.load(f).get("drained_seq", 0))
+
+        for path in sorted(glob.glob(os.path.join(glob.escape(self.directory), "*.parquet"))):
+            try:
+                seq = int(os.path.basename(path).split(".")[0])
+                parquet_file = fastparquet.ParquetFile(path)
+                meta = parquet_file.key_value_metadata
+                df = parquet_file.to_pandas(columns=["timestamp"]) if "timestamp" in parquet_file.columns else None
+            except Exception as e:
+                logger.warning(f"Skipping unreadable write buffer segment {path}: {e}")
+                continue
+            min_ns, max_ns = _time_span(df) if df is not None else (None, None)
+            tags = json.loads(meta.get("tags", "{}"))
+            self.segments[seq] = Segment(seq, path, int(meta.get("rows", 0)), min_ns, max_ns, tags)
+            self._next_seq = max(self._next_seq, seq + 1)
+
+        # Leftovers of writes interrupted before their rename
+        for tmp in glob.glob(os.path.join(glob.escape(self.directory), "*.tmp")):
+            os.remove(tmp)
+
+        pending = self.pending()
+        if pending:
+            logger.info(f"Write buffer has {len(pending)} segments ({sum(s.rows for s in pending)} rows) "
+                        f"left to drain")
+
+    def append(self, df: pd.DataFrame, tags: dict) -> Segment:
+        """Store a result frame durably; `tags` are written with every row once drained."""
+        import fastparquet
+
+        # Written under a temporary name first: the sequence number is only taken, and the
+        # segment registered, once it is in place, so the drainer never sees a later segment
+        # while an earlier one is still being written and marks past it
+        tmp = os.path.join(self.directory, f"{uuid.uuid4().hex}.tmp")
+        meta = {"tags": json.dumps(tags), "rows": str(len(df))}
+        fastparquet.write(tmp, df.reset_index(drop=True), custom_metadata=meta)
+        with open(tmp, "rb+") as f:
+            os.fsync(f.fileno())
+        min_ns, max_ns = _time_span(df)
+
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            path = self._path(seq)
+            os.replace(tmp, path)
+            segment = Segment(seq, path, len(df), min_ns, max_ns, tags)
+            self.segments[seq] = segment
+        self.appended.set()
+        return segment
+
+    def pending(self) -> List[Segment]:
+        """Segments not drained yet, oldest first."""
+        with self._lock:
+            return [self.segments[seq] for seq in sorted(self.segments) if seq > self.drained_seq]
+
+    def mark_drained(self, seq: int):
+        with self._lock:
+            self.drained_seq = max(self.drained_seq, seq)
+            state = {"drained_seq": self.drained_seq}
+        state_path = os.path.join(self.directory, _STATE_FILE)
+        with open(state_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(state_path + ".tmp", state_path)
+
+    def prune(self):
+        """Remove drained segments older than the retention."""
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [s for seq, s in self.segments.items() if seq <= self.drained_seq]
+        for segment in expired:
+            try:
+                if os.path.getmtime(segment.path) >= cutoff:
+                    continue
+                os.remove(segment.path)
+            except OSError:
+                pass
+            with self._lock:
+                self.segments.pop(segment.seq, None)
+
+    def read(self, start_ns: int, series: Optional[str] = None) -> pd.DataFrame:
+        """
+        Buffered rows from `start_ns` on, drained or not, with their tags as columns.
+        A point written more than once keeps its latest value, as in InfluxDB.
+        """
+        with self._lock:
+            segments = [self.segments[seq] for seq in sorted(self.segments)]
+
+        frames = []
+        for segment in segments:
+            if segment.max_ns is None or segment.max_ns < start_ns:
+                continue
+            if series is not None and "partition" not in segment.tags:
+                # Only partitioned uploads have series
+                continue
+            try:
+                df = segment.read()
+            except Exception as e:
+                logger.warning(f"Could not read write buffer segment {segment.path}: {e}")
+                continue
+            df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
+            df = df[df["timestamp"] >= pd.Timestamp(start_ns, unit="ns", tz="UTC")]
+            if series is not None:
+                if "series" not in df.columns:
+                    continue
+                df = df[df["series"] == series]
+            for key, value in segment.tags.items():
+                if key not in df.columns:
+                    df[key] = value
+            frames.append(df)
+
+        if not frames:
+            return pd.DataFrame(columns=["timestamp"])
+        df = pd.concat(frames, ignore_index=True)
+        keys = [c for c in ("filename", "partition", "series") if c in df.columns] + ["timestamp"]
+        return df.drop_duplicates(subset=keys, keep="last").sort_values("timestamp", ignore_index=True)
+
+    def stats(self) -> dict:
+        pending = self.pending()
+        return {
+            "directory": self.directory,
+            "segments": len(self.segments),
+            "pending_segments": len(pending),
+            "pending_rows": sum(s.rows for s in pending),
+            "drained_seq": self.drained_seq,
+        }
@@ -12,6 +12,8 @@ export default function App() {
     const [isAutoRefreshEnabled, setIsAutoRefreshEnabled] = useState(true);
     const [isLoading, setIsLoading] = useState(false);
     const [wsConnected, setWsConnected] = useState(false);
+    // Latest multi-horizon forecast (pred_1min, pred_5min, pred_15min) and the actual it starts from
+    const [latestForecast, setLatestForecast] = useState<Record<string, number>>({});
 
     // Fetch History Data
     const fetchHistory = useCallback(async (range: string) => {
@@ -59,17 +61,25 @@ export default function App() {
 
             ws.onmessage = (event) => {
                 try {
-                    const point = JSON.parse(event.data);
-                    // Point format: { time, actual, model1, model2 }
-                    const timeStr = new Date(point.time).toLocaleTimeString([], { hour12: false });
+                    const frame = JSON.parse(event.data);
+                    // Frames are batches: { type: 'batch', points: [{ time (epoch ms), actual, model1, model2 }] }
+                    const points = frame.type === 'batch' ? frame.points : [frame];
+                    if (points.length === 0) return;
+
+                    const last = points[points.length - 1];
+                    const forecast: Record<string, number> = {};
+                    Object.keys(last).forEach(key => {
+                        if (key === 'actual' || key.startsWith('pred_')) forecast[key] = last[key];
+                    });
+                    setLatestForecast(forecast);
 
                     setRealtimeData(prev => {
-                        const newData = [...prev, {
-                            time: timeStr,
-                            actual: point.actual || 0, // Assume WS sends 'actual'
-                            model1: point.model1 || 0, // Assume WS sends 'model1'
-                            model2: point.model2 || 0  // Assume WS sends 'model2'
-                        }];
+                        const newData = [...prev, ...points.map((point: any) => ({
+                            time: new Date(point.time).toLocaleTimeString([], { hour12: false }),
+                            actual: point.actual || 0,
+                            model1: point.model1 || 0,
+                            model2: point.model2 || 0
+                        }))];
                         // Keep last 50 points
                         return newData.slice(-50);
                     });
@@ -136,7 +146,7 @@ export default function App() {
                     />
                 </div>
                 <div className="shrink-0 h-[220px] sm:h-[180px] lg:h-[22vh] min-h-[160px]">
-                    <StatsGrid onFileUpload={() => { /** Handled by component internal fetch, maybe trigger refresh? */ }} />
+                    <StatsGrid forecast={latestForecast} onFileUpload={() => { if (viewMode !== 'Live') fetchHistory(viewMode); }} />
                 </div>
             </main>
         </div>
@@ -1,5 +1,5 @@
 import React, { useRef, useState } from 'react';
-import { CloudUpload, TrendingUp, Clock, History, Activity, Zap, Info, Building, Loader2, CheckCircle, FileSpreadsheet } from 'lucide-react';
+import { CloudUpload, TrendingUp, TrendingDown, Clock, History, Activity, Zap, Info, Building, Loader2, CheckCircle, XCircle, FileSpreadsheet } from 'lucide-react';
 
 interface CardProps {
     children: React.ReactNode;
@@ -9,21 +9,100 @@ interface CardProps {
 
 interface StatsGridProps {
     onFileUpload?: (file: File) => void;
+    // Latest point from the live stream: actual plus pred_<horizon> values
+    forecast?: Record<string, number>;
 }
 
+// /api/upload queues a background job; its status is polled until it has finished
+const JOB_POLL_MS = 1000;
+const FINISHED_STATUSES = ['succeeded', 'failed', 'cancelled'];
+
+interface UploadJob {
+    job_id: string;
+    status: string;
+    stage: string;
+    error?: string | null;
+}
+
+const waitForJob = async (jobId: string, onProgress: (job: UploadJob) => void): Promise<UploadJob> => {
+    while (true) {
+        const response = await fetch(`/api/jobs/${jobId}`);
+        if (!response.ok) {
+            throw new Error(`Job ${jobId}: ${response.statusText}`);
+        }
+        const job: UploadJob = await response.json();
+        if (FINISHED_STATUSES.includes(job.status)) {
+            return job;
+        }
+        onProgress(job);
+        await new Promise((resolve) => setTimeout(resolve, JOB_POLL_MS));
+    }
+};
+
+const HORIZONS = [
+    { key: 'pred_1min', label: '1M Pred', icon: Clock },
+    { key: 'pred_5min', label: '5M Pred', icon: History },
+    { key: 'pred_15min', label: '15M Pred', icon: History },
+];
+
 const Card: React.FC<CardProps> = ({ children, className = '', onClick }) => (
     <div onClick={onClick} className={`bg-white border border-slate-200 rounded-xl p-3 flex flex-col justify-between shadow-sm hover:shadow-md transition-all relative overflow-hidden group ${className} ${onClick ? 'cursor-pointer' : ''}`}>
         {children}
     </div>
 );
 
-export const StatsGrid: React.FC<StatsGridProps> = ({ onFileUpload }) => {
+const HorizonCard: React.FC<{ label: string; icon: React.ElementType; value?: number; actual?: number }> = ({ label, icon: Icon, value, actual }) => {
+    const hasValue = value !== undefined && value !== null;
+    const change = hasValue && actual ? ((value - actual) / actual) * 100 : null;
+    const width = hasValue && actual ? Math.min(100, (Math.min(value, actual) / Math.max(value, actual)) * 100) : 0;
+
+    return (
+        <Card>
+            <div className="flex justify-between items-start z-10">
+                <span className="text-slate-500 text-[10px] font-bold uppercase tracking-wide">{label}</span>
+                <Icon className="w-4 h-4 text-primary/30" />
+            </div>
+            <div className="z-10 mt-1">
+                <div className="flex items-baseline gap-1">
+                    <span className="text-2xl font-bold text-slate-900 tracking-tight">{hasValue ? Math.round(value).toLocaleString() : '—'}</span>
+                    <span className="text-[10px] text-slate-500">RPS</span>
+                </div>
+                {change !== null && (
+                    <div className={`text-[10px] font-bold flex items-center gap-0.5 mt-0.5 ${change >= 0 ? 'text-green-600' : 'text-red-600'}`}>
+                        {change >= 0 ? <TrendingUp className="w-3 h-3" /> : <TrendingDown className="w-3 h-3" />} {Math.abs(change).toFixed(1)}%
+                    </div>
+                )}
+            </div>
+            <div className="w-full bg-slate-100 h-1.5 mt-auto rounded-full overflow-hidden">
+                <div className="bg-primary h-full rounded-full" style={{ width: `${width}%` }}></div>
+            </div>
+        </Card>
+    );
+};
+
+export const StatsGrid: React.FC<StatsGridProps> = ({ onFileUpload, forecast = {} }) => {
     const fileInputRef = useRef<HTMLInputElement>(null);
-    const [uploadStatus, setUploadStatus] = useState<'idle' | 'uploading' | 'success'>('idle');
+    const [uploadStatus, setUploadStatus] = useState<'idle' | 'uploading' | 'success' | 'error'>('idle');
     const [fileName, setFileName] = useState<string>('');
+    const [uploadStage, setUploadStage] = useState<string>('');
+    const [uploadError, setUploadError] = useState<string>('');
+
+    // Reset status after a few seconds to allow new uploads
+    const resetLater = () => {
+        setTimeout(() => {
+            setUploadStatus('idle');
+            setFileName('');
+            setUploadStage('');
+            setUploadError('');
+        }, 4000);
+    };
 
     const handleInputClick = () => {
         if (uploadStatus !== 'uploading') {
+            // Lets the same file be picked again after a failed upload
+            if (fileInputRef.current) {
+                fileInputRef.current.value = '';
+            }
             fileInputRef.current?.click();
         }
     };
@@ -43,25 +122,29 @@ export const StatsGrid: React.FC<StatsGridProps> = ({ onFileUpload }) => {
                     body: formData,
                 });
 
-                if (response.ok) {
-                    if (onFileUpload) {
-                        onFileUpload(file);
-                    }
-                    setUploadStatus('success');
-
-                    // Reset status after a few seconds to allow new uploads
-                    setTimeout(() => {
-                        setUploadStatus('idle');
-                        setFileName('');
-                    }, 4000);
-                } else {
-                    console.error('Upload failed:', response.statusText);
-                    setUploadStatus('idle');
+                if (!response.ok) {
+                    const body = await response.json().catch(() => null);
+                    throw new Error(body?.detail || response.statusText);
                 }
+
+                const { job_id } = await response.json();
+                setUploadStage('queued');
+                const job = await waitForJob(job_id, (progress) => setUploadStage(progress.stage));
+
+                if (job.status !== 'succeeded') {
+                    throw new Error(job.error || `Job ${job.status}`);
+                }
+                // The points are written now, so a refresh shows them
+                if (onFileUpload) {
+                    onFileUpload(file);
+                }
+                setUploadStatus('success');
             } catch (error) {
                 console.error('Error uploading file:', error);
-                setUploadStatus('idle');
+                setUploadError(error instanceof Error ? error.message : String(error));
+                setUploadStatus('error');
             }
+            resetLater();
         }
     };
 
@@ -70,13 +153,13 @@ export const StatsGrid: React.FC<StatsGridProps> = ({ onFileUpload }) => {
             {/* 1. Input Model (Interactive Parquet Loader) */}
             <div
                 onClick={handleInputClick}
-                className={`col-span-1 bg-white border-2 border-dashed border-slate-200 hover:border-primary/50 hover:bg-slate-50 rounded-xl p-4 flex flex-col justify-center items-center gap-2 cursor-pointer transition-all group relative overflow-hidden shadow-sm ${uploadStatus === 'success' ? 'border-green-300 bg-green-50' : ''}`}
+                className={`col-span-1 bg-white border-2 border-dashed border-slate-200 hover:border-primary/50 hover:bg-slate-50 rounded-xl p-4 flex flex-col justify-center items-center gap-2 cursor-pointer transition-all group relative overflow-hidden shadow-sm ${uploadStatus === 'success' ? 'border-green-300 bg-green-50' : ''} ${uploadStatus === 'error' ? 'border-red-300 bg-red-50' : ''}`}
             >
                 <input
                     type="file"
                     ref={fileInputRef}
                     onChange={handleFileChange}
-                    accept=".parquet,.json,.csv"
+                    accept=".parquet,.json,.jsonl,.ndjson,.csv"
                     className="hidden"
                 />
 
@@ -93,7 +176,9 @@ export const StatsGrid: React.FC<StatsGridProps> = ({ onFileUpload }) => {
                 {uploadStatus === 'uploading' && (
                     <>
                         <Loader2 className="w-8 h-8 text-primary animate-spin mb-1" />
-                        <p className="text-xs font-bold text-slate-700 text-center animate-pulse">Uploading...</p>
+                        <p className="text-xs font-bold text-slate-700 text-center animate-pulse">
+                            {uploadStage ? `${uploadStage.charAt(0).toUpperCase()}${uploadStage.slice(1)}...` : 'Uploading...'}
+                        </p>
                         <p className="text-[9px] text-slate-400 text-center truncate max-w-[90%]">{fileName}</p>
                     </>
                 )}
@@ -104,70 +189,25 @@ export const StatsGrid: React.FC<StatsGridProps> = ({ onFileUpload }) => {
                             <CheckCircle className="w-6 h-6" />
                         </div>
                         <p className="text-xs font-bold text-green-700 text-center">Uploaded</p>
-                        <p className="text-[10px] text-green-600 text-center font-medium">Processing started</p>
+                        <p className="text-[10px] text-green-600 text-center font-medium">Forecast ready</p>
                     </>
                 )}
-            </div>
 
-            {/* 2. 1M Pred */}
-            <Card>
-                <div className="flex justify-between items-start z-10">
-                    <span className="text-slate-500 text-[10px] font-bold uppercase tracking-wide">1M Pred</span>
-                    <Clock className="w-4 h-4 text-primary/30" />
-                </div>
-                <div className="z-10 mt-1">
-                    <div className="flex items-baseline gap-1">
-                        <span className="text-2xl font-bold text-slate-900 tracking-tight">2,510</span>
-                        <span className="text-[10px] text-slate-500">RPS</span>
-                    </div>
-                    <div className="text-[10px] text-green-600 font-bold flex items-center gap-0.5 mt-0.5">
-                        <TrendingUp className="w-3 h-3" /> 3.2%
-                    </div>
-                </div>
-                <div className="w-full bg-slate-100 h-1.5 mt-auto rounded-full overflow-hidden">
-                    <div className="bg-primary h-full rounded-full" style={{ width: '98%' }}></div>
-                </div>
-            </Card>
-
-            {/* 3. 5M Pred */}
-            <Card>
-                <div className="flex justify-between items-start z-10">
-                    <span className="text-slate-500 text-[10px] font-bold uppercase tracking-wide">5M Pred</span>
-                    <History className="w-4 h-4 text-primary/30" />
-                </div>
-                <div className="z-10 mt-1">
-                    <div className="flex items-baseline gap-1">
-                        <span className="text-2xl font-bold text-slate-900 tracking-tight">2,840</span>
-                        <span className="text-[10px] text-slate-500">RPS</span>
-                    </div>
-                    <div className="text-[10px] text-green-600 font-bold flex items-center gap-0.5 mt-0.5">
-                        <TrendingUp className="w-3 h-3" /> 16.8%
-                    </div>
-                </div>
-                <div className="w-full bg-slate-100 h-1.5 mt-auto rounded-full overflow-hidden">
-                    <div className="bg-primary h-full rounded-full" style={{ width: '85%' }}></div>
-                </div>
-            </Card>
+                {uploadStatus === 'error' && (
+                    <>
+                        <div className="bg-red-100 p-2.5 rounded-full text-red-600 mb-1 animate-in zoom-in">
+                            <XCircle className="w-6 h-6" />
+                        </div>
+                        <p className="text-xs font-bold text-red-700 text-center">Upload failed</p>
+                        <p className="text-[9px] text-red-600 text-center font-medium truncate max-w-[90%]" title={uploadError}>{uploadError}</p>
+                    </>
+                )}
+            </div>
 
-            {/* 4. 15M Pred */}
-            <Card>
-                <div className="flex justify-between items-start z-10">
-                    <span className="text-slate-500 text-[10px] font-bold uppercase tracking-wide">15M Pred</span>
-                    <History className="w-4 h-4 text-primary/30" />
-                </div>
-                <div className="z-10 mt-1">
-                    <div className="flex items-baseline gap-1">
-                        <span className="text-2xl font-bold text-slate-900 tracking-tight">3,150</span>
-                        <span className="text-[10px] text-slate-500">RPS</span>
-                    </div>
-                    <div className="text-[10px] text-green-600 font-bold flex items-center gap-0.5 mt-0.5">
-                        <TrendingUp className="w-3 h-3" /> 29.6%
-                    </div>
-                </div>
-                <div className="w-full bg-slate-100 h-1.5 mt-auto rounded-full overflow-hidden">
-                    <div className="bg-primary h-full rounded-full" style={{ width: '70%' }}></div>
-                </div>
-            </Card>
+            {/* 2-4. Horizon forecasts from the live stream */}
+            {HORIZONS.map(({ key, label, icon }) => (
+                <HorizonCard key={key} label={label} icon={icon} value={forecast[key]} actual={forecast.actual} />
+            ))}
 
             {/* 5. Active Pods */}
             <Card>